@@ -1,34 +1,65 @@
 # app/__init__.py
-from flask import Flask, session
+import logging
+import time
+import click
+from flask import Flask, current_app, request, session
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect, generate_csrf
 from .config import Config
-import time
-from sqlalchemy.exc import OperationalError
 
 db = SQLAlchemy()
-migrate = Migrate()
 login_manager = LoginManager()
 csrf = CSRFProtect()
 
 def create_app(config_class=Config):
+    started = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object(config_class)
+    # Before app.logger is first used: Flask only adds its stderr handler if nothing would show
+    # the logger's records at the level it has then
+    logging.getLogger(app.name).setLevel(app.config['LOG_LEVEL'])
+
+    # Before db.init_app, since it sets the engine's pool class
+    from .metrics import init_metrics, observe_startup
+    init_metrics(app)
 
     # Initialize extensions
     db.init_app(app)
-    migrate.init_app(app, db)
+    # Flask-Migrate imports Alembic, which takes longer to load than the rest of the app, and only
+    # adds the flask db commands; so it is left out when the app is not run by the flask command
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
     login_manager.init_app(app)
     csrf.init_app(app)  # Initialize CSRF protection
 
     login_manager.login_view = 'app.authentication'
 
-    from .models import User, Note, Board, Access, Reply #need to import all models here
+    # First, so its timer starts before and its after_request hook runs after everything else's
+    from .instrumentation import init_instrumentation
+    init_instrumentation(app)
+
+    from .events import init_events
+    init_events(app)
+    from .cache import init_cache
+    init_cache(app)
+    from .auth import init_auth
+    init_auth(app)
+    from .assets import PUBLIC_ENDPOINTS, init_assets
+    init_assets(app)
+    from . import sync  # Registers the note/reply versioning hooks
+    from . import spatial  # Registers the note tile index hook
+    from . import search  # Registers the full-text index hooks
+
+    from .models import User, Note, Board, Access, Reply, Avatar, BoardEvent, NoteTile #need to import all models here
+    from .identity import get_identity
 
     @app.before_request
     def before_request():
+        # Public cacheable files must not start a session (see assets.py)
+        if request.endpoint in PUBLIC_ENDPOINTS:
+            return
         # Ensure CSRF token is set in the session for all requests
         if 'csrf_token' not in session:
             session['csrf_token'] = generate_csrf()
@@ -36,7 +67,7 @@ def create_app(config_class=Config):
     @login_manager.user_loader
     def load_user(user_id):
         try:
-            return User.query.get(int(user_id))
+            return get_identity(int(user_id))
         except Exception as e:
             # Log the error but don't crash
             current_app.logger.error(f"Error loading user: {e}")
@@ -45,34 +76,10 @@ def create_app(config_class=Config):
     from .routes import app as app_blueprint
     app.register_blueprint(app_blueprint)
     
-    with app.app_context():
-        db.create_all() # Generate all tables if they do not exist
-
-    #create any database tables (and file) if they don't exist:
-    with app.app_context():
-        initialize_database(app)
+    from .schema import prepare_schema
+    prepare_schema(app)
 
+    elapsed = time.perf_counter() - started
+    observe_startup(elapsed)
+    app.logger.info(f"Application created in {elapsed * 1000:.0f}ms")
     return app
-
-def initialize_database(app, retries=5, delay=2):
-    """Initialize database with retry logic for production environments"""
-    for attempt in range(retries):
-        try:
-            with app.app_context():
-                db.create_all()
-                print(f"Database initialized successfully on attempt {attempt + 1}")
-                return True
-        except OperationalError as e:
-            if attempt < retries - 1:
-                print(f"Database connection failed (attempt {attempt + 1}/{retries}): {e}")
-                print(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                print(f"Failed to connect to database after {retries} attempts")
-                # In production, fall back to SQLite
-                if os.environ.get('RENDER'):
-                    print("Falling back to SQLite database")
-                    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
-                    db.create_all()
-                    return True
-                return False
@@ -0,0 +1,178 @@
+# app/assets.py
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from collections import namedtuple
+import brotli
+from flask import Response, abort, current_app, g, request, send_from_directory
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.security import safe_join
+
+ONE_YEAR = 31536000
+
+# Endpoints serving the same bytes to everyone, which shared caches will only store without a Set-Cookie
+PUBLIC_ENDPOINTS = ('static', 'app.get_avatar')
+
+# Text assets are precompressed; images are already compressed and are sent as they are
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+ENCODINGS = ('br', 'gzip')
+
+# Relative url(...) references in stylesheets, which are fingerprinted like url_for links
+CSS_URL = re.compile(r'''url\((["']?)(?![a-z]+:|/|#)([^"')?#]+)\1\)''')
+
+# data holds the bytes of compressible assets and is None for ones sent straight from disk
+Asset = namedtuple('Asset', ['mtime', 'digest', 'mimetype', 'data'])
+
+
+class AssetRegistry:
+    """Content hashes and precompressed bodies of static files.
+
+    Each file is hashed on first use and again only if its mtime changes. Compression is
+    deferred until the file is first requested, so rendering links only pays for the hash.
+    """
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._bodies = {}
+
+    def get(self, filename):
+        path = safe_join(self.static_folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        mtime = os.stat(path).st_mtime_ns
+        asset = self._assets.get(filename)
+        if asset is None or asset.mtime != mtime:
+            asset = self._build(filename, path, mtime)
+            with self._lock:
+                self._assets[filename] = asset
+        return asset
+
+    def _build(self, filename, path, mtime):
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        with open(path, 'rb') as f:
+            data = f.read()
+        if mimetype == 'text/css':
+            data = self._fingerprint_css(filename, data)
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        return Asset(mtime, digest, mimetype, data if mimetype.startswith(COMPRESSIBLE_TYPES) else None)
+
+    def bodies(self, asset):
+        """The asset's bytes by content-coding, compressed at the highest levels once per version"""
+        bodies = self._bodies.get(asset.digest)
+        if bodies is None:
+            bodies = {'identity': asset.data}
+            for encoding, compressed in (('br', brotli.compress(asset.data)), ('gzip', gzip.compress(asset.data, 9))):
+                # Tiny files can grow when compressed
+                if len(compressed) < len(asset.data):
+                    bodies[encoding] = compressed
+            with self._lock:
+                self._bodies[asset.digest] = bodies
+        return bodies
+
+    def _fingerprint_css(self, filename, data):
+        def fingerprint(match):
+            quote, url = match.groups()
+            asset = self.get(posixpath.normpath(posixpath.join(posixpath.dirname(filename), url)))
+            if asset is None:
+                return match.group(0)
+            return f'url({quote}{url}?v={asset.digest}{quote})'
+        return CSS_URL.sub(fingerprint, data.decode('utf-8')).encode('utf-8')
+
+
+class PublicAssetSessionInterface(SecureCookieSessionInterface):
+    """Leaves the session cookie off responses from PUBLIC_ENDPOINTS"""
+
+    def should_set_cookie(self, app, session):
+        if request.endpoint in PUBLIC_ENDPOINTS:
+            return False
+        return super().should_set_cookie(app, session)
+
+
+def init_assets(app):
+    app.extensions['assets'] = AssetRegistry(app.static_folder)
+    app.session_interface = PublicAssetSessionInterface()
+    app.view_functions['static'] = serve_static
+    app.url_defaults(add_fingerprint)
+    app.after_request(compress_response)
+
+
+def get_assets():
+    return current_app.extensions['assets']
+
+
+def add_fingerprint(endpoint, values):
+    """Make url_for('static', filename=...) carry the file's content hash as ?v="""
+    if endpoint == 'static' and 'v' not in values:
+        asset = get_assets().get(values.get('filename', ''))
+        if asset is not None:
+            values['v'] = asset.digest
+
+
+def serve_static(filename):
+    assets = get_assets()
+    asset = assets.get(filename)
+    if asset is None:
+        abort(404)
+
+    if asset.data is None:
+        response = send_from_directory(current_app.static_folder, filename)
+    elif request.if_none_match.contains_weak(asset.digest):
+        response = Response(status=304)
+    else:
+        bodies = assets.bodies(asset)
+        encoding = next((encoding for encoding in ENCODINGS
+                         if encoding in bodies and request.accept_encodings.quality(encoding)), 'identity')
+        response = Response(bodies[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.content_encoding = encoding
+    if asset.data is not None:
+        # Weak, since the compressed and uncompressed bodies are the same asset
+        response.set_etag(asset.digest, weak=True)
+        response.vary.add('Accept-Encoding')
+
+    # A URL carrying the current hash can never change, anything else is revalidated
+    if request.args.get('v') == asset.digest:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = ONE_YEAR
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def carries_csrf_token():
+    """Whether this request made the CSRF token, which pages embed for their forms"""
+    return current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token') in g
+
+
+def compress_response(response):
+    """Gzip large JSON and HTML responses for clients that accept it"""
+    config = current_app.config
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in config['COMPRESS_MIMETYPES']):
+        return response
+    # Compressed sizes would leak a secret sent alongside attacker-chosen text (BREACH), and
+    # the token is the same in every page of a session, so responses carrying it go uncompressed
+    if carries_csrf_token():
+        return response
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings.quality('gzip'):
+        return response
+    response.set_data(gzip.compress(data, config['COMPRESS_LEVEL']))
+    response.content_encoding = 'gzip'
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,88 @@
+# app/auth.py
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app
+from sqlalchemy import select
+from werkzeug.security import check_password_hash, generate_password_hash
+from . import db
+from .metrics import PASSWORD_HASH_TIME
+from .models import User
+
+
+class HashingBusy(Exception):
+    """Every hashing worker is busy and the queue for them is full"""
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a small thread pool.
+
+    Hashes are slow on purpose, and scrypt holds 32MB while it runs, so a burst of sign-ins on
+    every request thread would starve note requests of CPU and memory. At most
+    PASSWORD_HASH_WORKERS hashes run at once per process; up to PASSWORD_HASH_QUEUE more
+    callers wait for them, and any beyond that get HashingBusy straight away.
+    """
+
+    def __init__(self, config):
+        self.method = config['PASSWORD_HASH_METHOD']
+        self.timeout = config['PASSWORD_HASH_TIMEOUT']
+        self.executor = ThreadPoolExecutor(config['PASSWORD_HASH_WORKERS'], thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(config['PASSWORD_HASH_WORKERS'] + config['PASSWORD_HASH_QUEUE'])
+        # Made once at startup, so no sign-in pays for it on top of its check
+        self.dummy_hash = generate_password_hash(secrets.token_hex(16), self.method)
+
+    def run(self, operation, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        start = time.perf_counter()
+        future = self.executor.submit(function, *args)
+        # Released when the hash finishes, even if the caller stopped waiting for it
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HashingBusy()
+        finally:
+            PASSWORD_HASH_TIME.labels(operation).observe(time.perf_counter() - start)
+
+    def hash(self, password):
+        return self.run('hash', generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        return self.run('check', check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # Werkzeug hashes start with the method and its parameters, e.g. scrypt:32768:8:1$salt$hash
+        return password_hash.split('$', 1)[0] != self.method
+
+    def check_unknown(self, password):
+        """Check against a throwaway hash, so an unknown email takes as long as a wrong password"""
+        self.check(self.dummy_hash, password)
+
+
+def init_auth(app):
+    app.extensions['password_hasher'] = PasswordHasher(app.config)
+
+
+def get_password_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def user_by_email(email):
+    return db.session.execute(select(User).where(User.email == email)).scalar_one_or_none()
+
+
+def authenticate(user, password):
+    """The user if the password is theirs, else None. Hashes made with older parameters are
+    replaced with PASSWORD_HASH_METHOD ones while the password is at hand."""
+    hasher = get_password_hasher()
+    if user is None:
+        hasher.check_unknown(password)
+        return None
+    if not hasher.check(user.password, password):
+        return None
+    if hasher.needs_rehash(user.password):
+        user.password = hasher.hash(password)
+        db.session.commit()
+    return user
@@ -0,0 +1,110 @@
+# app/avatars.py
+import base64
+import binascii
+import hashlib
+from io import BytesIO
+from flask import Response, url_for
+from . import db
+from .models import Avatar
+
+# Only raster formats are accepted; SVG could carry script when served from our origin
+ALLOWED_FORMATS = {'PNG', 'JPEG', 'GIF', 'WEBP'}
+MAX_SOURCE_PIXELS = 25000000  # Reject decompression bombs before decoding the pixel data
+CACHE_MAX_AGE = 31536000  # One year, safe because the URL changes whenever the image does
+
+# Square variants kept for each upload, at twice the CSS size for high-DPI screens:
+# 'note' for .sticky-note-profile-picture (40px) and 'profile' for .profile-picture (80px)
+AVATAR_VARIANTS = {'note': 80, 'profile': 160}
+VARIANT_FORMAT = 'WEBP'
+VARIANT_CONTENT_TYPE = 'image/webp'
+VARIANT_QUALITY = 80
+
+
+def decode_data_url(data_url):
+    """Return the raw bytes of a base64 data:image URL"""
+    header, _, encoded = data_url.partition(',')
+    if not header.startswith('data:image/') or not header.endswith(';base64'):
+        raise ValueError('Profile picture must be a base64 encoded image.')
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except binascii.Error:
+        raise ValueError('Profile picture is not valid base64.')
+
+
+def make_variants(data):
+    """Decode an uploaded image and return {variant name: WebP bytes} for every size in AVATAR_VARIANTS"""
+    # Only uploads need Pillow, so workers don't import it at startup
+    from PIL import Image, ImageOps, UnidentifiedImageError
+    try:
+        image = Image.open(BytesIO(data))
+    except Image.DecompressionBombError:
+        # Pillow's own limit, hit by headers claiming far more pixels than MAX_SOURCE_PIXELS
+        raise ValueError('Image too large. Please use a smaller image.')
+    except UnidentifiedImageError:
+        raise ValueError('Profile picture is not a recognised image.')
+    if image.format not in ALLOWED_FORMATS:
+        raise ValueError('Unsupported image type.')
+    if image.width * image.height > MAX_SOURCE_PIXELS:
+        raise ValueError('Image too large. Please use a smaller image.')
+    try:
+        image.load()
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError('Profile picture is truncated or corrupt.')
+
+    # Honour camera rotation and drop palette/CMYK modes WebP cannot encode directly
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    variants = {}
+    for name, size in AVATAR_VARIANTS.items():
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        thumbnail.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+        variants[name] = buffer.getvalue()
+    return variants
+
+
+def avatar_url(avatar_hash):
+    return url_for('app.get_avatar', avatar_hash=avatar_hash)
+
+
+def store_image(data):
+    """Store image bytes under their content hash and return the URL they are served from"""
+    avatar_hash = hashlib.sha256(data).hexdigest()
+
+    # Identical images share a row, so only check existence rather than loading the blob
+    exists = db.session.query(Avatar.hash).filter_by(hash=avatar_hash).first()
+    if not exists:
+        db.session.add(Avatar(hash=avatar_hash, content_type=VARIANT_CONTENT_TYPE, data=data))
+    return avatar_url(avatar_hash)
+
+
+def store_avatar(data_url):
+    """Thumbnail an uploaded data:image URL and return {variant name: URL}; the original is not kept"""
+    variants = make_variants(decode_data_url(data_url))
+    return {name: store_image(data) for name, data in variants.items()}
+
+
+def set_profile_picture(preferences, data_url):
+    urls = store_avatar(data_url)
+    preferences.profile_picture = urls['profile']
+    preferences.profile_thumbnail = urls['note']
+
+
+def avatar_response(avatar):
+    response = Response(avatar.data, mimetype=avatar.content_type)
+    set_cache_headers(response, avatar.hash)
+    return response
+
+
+def not_modified_response(avatar_hash):
+    response = Response(status=304)
+    set_cache_headers(response, avatar_hash)
+    return response
+
+
+def set_cache_headers(response, avatar_hash):
+    response.set_etag(avatar_hash)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    response.cache_control.immutable = True
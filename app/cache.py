@@ -0,0 +1,248 @@
+# app/cache.py
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, url_for
+from sqlalchemy import select, union
+from . import db
+from .models import Access, Board, UserPreferences
+from .queries import get_user_boards
+
+
+class MemoryCache:
+    """Least-recently-used cache with per-entry expiry, private to one process"""
+
+    def __init__(self, config):
+        self.max_entries = config['CACHE_MAX_ENTRIES']
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class FileCache:
+    """Cache of JSON values in a local directory, shared by every worker process on the host.
+
+    Versioned keys are retired by no longer being read, so expired files are swept every
+    SWEEP_EVERY writes rather than waiting for a read of their key. Each file's modification
+    time is set to its expiry, so a sweep only needs to stat the directory.
+    """
+
+    SWEEP_EVERY = 100  # Writes between sweeps
+    ORPHAN_AGE = 60  # Seconds after which a temporary file no write renamed is removed
+
+    def __init__(self, config):
+        self.directory = config['CACHE_DIR']
+        self.max_entries = config['CACHE_MAX_ENTRIES']
+        self._writes = itertools.count(1)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expires'] < time.time():
+            self.delete(key)
+            return None
+        return entry['value']
+
+    def set(self, key, value, ttl):
+        # Write then rename so readers in other workers never see a partial file
+        expires = time.time() + ttl
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'value': value, 'expires': expires}, f)
+        os.utime(tmp_path, (expires, expires))
+        os.replace(tmp_path, self._path(key))
+        if next(self._writes) % self.SWEEP_EVERY == 0:
+            self.sweep()
+
+    def sweep(self):
+        """Remove expired entries, then the soonest to expire past CACHE_MAX_ENTRIES"""
+        now = time.time()
+        entries = []
+        with os.scandir(self.directory) as files:
+            for file in files:
+                try:
+                    modified = file.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if not file.name.endswith('.json'):
+                    # A write that crashed before its rename
+                    if modified < now - self.ORPHAN_AGE:
+                        self._remove(file.path)
+                elif modified < now:
+                    self._remove(file.path)
+                else:
+                    entries.append((modified, file.path))
+        if len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                self._remove(path)
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    @staticmethod
+    def _remove(path):
+        # Another worker may have removed it first
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+CACHES = {
+    'memory': MemoryCache,
+    'file': FileCache,
+}
+
+
+def init_cache(app):
+    backend = app.config['CACHE_BACKEND']
+    if backend not in CACHES:
+        raise ValueError(f"Unknown CACHE_BACKEND '{backend}', expected one of {sorted(CACHES)}")
+    app.config.setdefault('CACHE_DIR', os.path.join(app.instance_path, 'cache'))
+    app.extensions['cache'] = CACHES[backend](app.config)
+
+
+def get_cache():
+    return current_app.extensions['cache']
+
+
+def board_list_key(user_id):
+    return f'boards:{user_id}'
+
+
+def get_cached_board_list(user_id):
+    """The user's sidebar board list, reading through the cache"""
+    cache = get_cache()
+    boards = cache.get(board_list_key(user_id))
+    if boards is None:
+        boards = get_user_boards(user_id)
+        cache.set(board_list_key(user_id), boards, current_app.config['BOARD_LIST_CACHE_TTL'])
+    return boards
+
+
+def invalidate_board_list(user_id):
+    get_cache().delete(board_list_key(user_id))
+
+
+def invalidate_board_lists(board_id):
+    """Drop the cached list of everyone who sees the board, whose note counts it shows; call after committing"""
+    members = union(select(Board.owner_id).where(Board.id == board_id),
+                    select(Access.user_id).where(Access.board_id == board_id))
+    for user_id in db.session.execute(members).scalars():
+        invalidate_board_list(user_id)
+
+
+USER_VERSION_TTL = 86400  # Outlives every entry keyed by the version
+
+
+def user_version_key(user_id):
+    return f'user_version:{user_id}'
+
+
+def user_version(user_id):
+    """The version the user's identity, permissions and preferences are cached under"""
+    return get_cache().get(user_version_key(user_id)) or 0
+
+
+def bump_user_version(user_id):
+    """Retire the user's cached identity, permissions and preferences at once.
+
+    A request that read the database before a change stores what it read under the version it
+    started with, so the entry is never served; deleting keys instead could race with it.
+    """
+    get_cache().set(user_version_key(user_id), user_version(user_id) + 1, USER_VERSION_TTL)
+
+
+def preferences_key(user_id, version):
+    return f'preferences:{user_id}:{version}'
+
+
+def preferences_payload(preferences):
+    # Fix profile picture URL bug
+    profile_picture = preferences.profile_picture
+    if not profile_picture:
+        profile_picture = url_for('static', filename='images/default-avatar.jpg')
+
+    return {
+        'designTheme': preferences.designTheme,
+        'designBackColor': preferences.designBackColor,
+        'designSideBarColor': preferences.designSideBarColor,
+        'timezone': preferences.timezone,
+        'enableEmailNotif': preferences.enable_email_notif,
+        'enableEmailNotifReply': preferences.enable_email_notif_reply,
+        'enableEmailNotifBoard': preferences.enable_email_notif_board,
+        'enableEmailNotifOwn': preferences.enable_email_notif_own,
+        'enableEmailNotifStar': preferences.enable_email_notif_star,
+        'privacy': preferences.privacy,
+        'profilePicture': profile_picture,
+        'profileThumbnail': preferences.note_picture or profile_picture,
+        'username': preferences.username,
+        'lightDarkMode': preferences.light_dark_mode,
+        'noteColour': preferences.note_colour
+    }
+
+
+def preferences_entry(preferences):
+    payload = preferences_payload(preferences)
+    return {'payload': payload, 'etag': hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()}
+
+
+def get_cached_preferences(user_id):
+    """Return {'payload', 'etag'} for the user's preferences, reading through the cache"""
+    cache = get_cache()
+    version = user_version(user_id)
+    entry = cache.get(preferences_key(user_id, version))
+    if entry is not None:
+        return entry
+
+    preferences = UserPreferences.query.filter_by(user_id=user_id).first()
+
+    # Create default preferences if not found
+    if not preferences:
+        preferences = UserPreferences(user_id=user_id)
+        db.session.add(preferences)
+        db.session.commit()
+
+    entry = preferences_entry(preferences)
+    cache.set(preferences_key(user_id, version), entry, current_app.config['PREFERENCES_CACHE_TTL'])
+    return entry
+
+
+def invalidate_preferences(user_id):
+    """Retire the cached preferences; call after committing a change to them"""
+    bump_user_version(user_id)
@@ -0,0 +1,73 @@
+# app/cloning.py
+from datetime import datetime
+from sqlalchemy import func, insert, literal, select
+from . import db
+from .models import Board, Note, NoteTile, Reply
+from .search import index_board_version
+from .spatial import GEOMETRY_FIELDS
+from .sync import adjust_note_count, bump_board_version
+
+
+def note_copies(source_id, copy_id):
+    """(source_id, copy_id) note pairs, matching the nth note of each board in id order.
+
+    Both boards' notes are numbered in one pass, then sorted so each source note is followed by its
+    copy. Joining two numbered subqueries on the number instead is quadratic on SQLite, which
+    won't index them.
+    """
+    numbered = (select(Note.id, Note.board_id, func.row_number().over(partition_by=Note.board_id, order_by=Note.id).label('position'))
+                .where(Note.board_id.in_([source_id, copy_id])).subquery())
+    paired = select(numbered.c.id.label('source_id'), numbered.c.board_id,
+                    func.lead(numbered.c.id).over(order_by=(numbered.c.position, numbered.c.board_id == copy_id)).label('copy_id')
+                    ).subquery()
+    return select(paired.c.source_id, paired.c.copy_id).where(paired.c.board_id == source_id).subquery()
+
+
+def clone_board(board_id, owner_id, title, include_replies=False, is_template=False):
+    """Copy a board's notes, with their colours and geometry, and optionally their replies, to a new board.
+
+    Each table is copied by one INSERT ... SELECT, so the work stays in the database however large the
+    board is. Like imports.import_board this skips the ORM flush hooks, so the copy's version, note count,
+    tiles and search index are written here. The caller commits.
+    Returns (new board, notes copied, replies copied).
+    """
+    # Writers to a board update its row, so locking it keeps the notes still while they are copied
+    db.session.execute(select(Board.id).where(Board.id == board_id).with_for_update())
+    board = Board(title=title, owner_id=owner_id, is_template=is_template)
+    db.session.add(board)
+    db.session.flush()
+    version = bump_board_version(board.id)
+    now = datetime.now()
+    connection = db.session.connection()
+
+    # Copied notes belong to the user cloning the board, so they can edit and delete them
+    geometry = [getattr(Note, field) for field in GEOMETRY_FIELDS]
+    notes = connection.execute(insert(Note.__table__).from_select(
+        ['content', 'color', *GEOMETRY_FIELDS, 'board_id', 'user_id', 'version', 'created_at', 'updated_at'],
+        select(Note.content, Note.color, *geometry, literal(board.id), literal(owner_id), literal(version),
+               literal(now), literal(now))
+        .where(Note.board_id == board_id).order_by(Note.id)
+    )).rowcount
+
+    # Copies get ids in the order they were selected, so the nth note of each board is the same note
+    copies = note_copies(board_id, board.id)
+
+    # Tiles depend only on geometry, so the source's can be reused
+    connection.execute(insert(NoteTile.__table__).from_select(
+        ['note_id', 'tile_x', 'tile_y', 'board_id'],
+        select(copies.c.copy_id, NoteTile.tile_x, NoteTile.tile_y, literal(board.id))
+        .join(copies, copies.c.source_id == NoteTile.note_id)
+    ))
+
+    replies = 0
+    if include_replies:
+        # Replies keep their authors and times, so threads read as they did
+        replies = connection.execute(insert(Reply.__table__).from_select(
+            ['content', 'created_at', 'user_id', 'note_id', 'updated_at', 'version'],
+            select(Reply.content, Reply.created_at, Reply.user_id, copies.c.copy_id, literal(now), literal(version))
+            .join(copies, copies.c.source_id == Reply.note_id).order_by(Reply.id)
+        )).rowcount
+
+    index_board_version(connection, board.id, version)
+    adjust_note_count(board.id, notes)
+    return board, notes, replies
@@ -24,6 +24,84 @@ class Config:
     }
     
     SECRET_KEY = os.environ.get('SECRET_KEY', 'development-key')
+
+    # What create_app does about the schema: 'create' makes any missing tables (development);
+    # 'check' runs no DDL and only compares the database's Alembic revision with the newest
+    # migration, in one query, logging an error if "flask db upgrade" is due (production, set by
+    # gunicorn.conf.py); 'off' does neither
+    SCHEMA_MODE = os.environ.get('SCHEMA_MODE', 'create')
+
+    # Boards with more notes than this are loaded per viewport rather than all at once
+    WINDOWED_BOARD_THRESHOLD = 500
+
+    # Replies are sent a page at a time, newest first
+    REPLY_PAGE_SIZE = 50
+    MAX_REPLY_PAGE_SIZE = 200
+
+    # Search results are paged by offset
+    SEARCH_PAGE_SIZE = 20
+    MAX_SEARCH_PAGE_SIZE = 100
+
+    # Real-time board events: 'memory' works within one process, 'database' shares
+    # events between gunicorn workers through the board_event table
+    EVENT_BROKER = os.environ.get('EVENT_BROKER', 'memory')
+    EVENT_POLL_INTERVAL = 1.0    # Seconds between board_event polls (database broker)
+    EVENT_HEARTBEAT = 15         # Seconds between keep-alive comments on idle streams
+    # Streams are closed after this and the browser reconnects, catching up through /notes/get_by_board;
+    # under most proxies' 60s idle limit
+    EVENT_STREAM_TIMEOUT = 55
+    # Each open stream holds a gunicorn thread, so streams are capped per process below the thread
+    # count (GUNICORN_THREADS in gunicorn.conf.py); past it the browser keeps to periodic syncing
+    EVENT_MAX_STREAMS = int(os.environ.get('EVENT_MAX_STREAMS', 24))
+    EVENT_RETENTION = 3600       # Seconds board_event rows are kept for reconnecting clients
+
+    # Dynamic responses at least this large are gzipped (static files are precompressed, see assets.py),
+    # except ones embedding the session's CSRF token, which are most pages
+    COMPRESS_MIMETYPES = ['application/json', 'text/html']
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_LEVEL = 6
+
+    # Per-request instrumentation (see instrumentation.py): query count, DB and serialisation
+    # time go in a Server-Timing header and a JSON log line; requests running more than
+    # QUERY_BUDGET statements are logged as warnings with their most repeated statements
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+    QUERY_BUDGET = 20
+    SLOW_STATEMENT_COUNT = 3
+    # Level of the app's logger, which writes to stderr (gunicorn's error log); the per-request
+    # lines above are INFO, so they are dropped at WARNING
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+    # Admin exports are open to these users' sessions (comma separated in ADMIN_EMAILS),
+    # and to scripts sending "Authorization: Bearer <ADMIN_SECRET>" when it is set
+    ADMIN_EMAILS = [email.strip() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()]
+    ADMIN_SECRET = os.environ.get('ADMIN_SECRET')
+
+    # Passwords are hashed and checked on a pool of PASSWORD_HASH_WORKERS threads per process
+    # (see auth.py), with up to PASSWORD_HASH_QUEUE sign-ins waiting for one; more are turned away
+    # with a 503. Without the pool each of a process's GUNICORN_THREADS (32) request threads could
+    # hash at once, holding 32MB apiece under scrypt. Changing PASSWORD_HASH_METHOD (Werkzeug's
+    # full form, e.g. pbkdf2:sha256:600000) rehashes each user's password with it at their next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+    PASSWORD_HASH_TIMEOUT = 10  # Seconds a sign-in waits for its hash before giving up
+
+    # When set, GET /metrics requires an "Authorization: Bearer <token>" header
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Read-through cache: 'memory' is an LRU per process, 'file' is shared by the workers on
+    # a host through CACHE_DIR (defaults to instance/cache)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_MAX_ENTRIES = 10000     # Entries kept per process (memory backend), or in CACHE_DIR (file backend)
+    PREFERENCES_CACHE_TTL = 300   # Seconds a user's preferences are served from the cache
+    # Seconds a user's board permissions are reused. Sharing changes invalidate them at once
+    # in the worker that made them; other workers see them within this TTL unless CACHE_BACKEND is 'file'
+    BOARD_PERMISSIONS_CACHE_TTL = 60
+    # Seconds current_user is rebuilt from the cache rather than loaded (see identity.py). Preference
+    # and sharing changes retire it at once, in other workers too when CACHE_BACKEND is 'file'
+    IDENTITY_CACHE_TTL = 60
+    # Seconds the sidebar board list is reused; collaborators' note counts may lag by this much
+    BOARD_LIST_CACHE_TTL = 60
     
     # Fix for CSRF issues in production
     SESSION_COOKIE_SECURE = True
@@ -37,4 +115,6 @@ class Config:
 class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
     WTF_CSRF_ENABLED = False
+    SCHEMA_MODE = 'off'  # The test fixtures create the tables
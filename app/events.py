@@ -0,0 +1,240 @@
+# app/events.py
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app, request
+from sqlalchemy import delete, func, select
+from . import db
+from .models import BoardEvent
+
+Event = namedtuple('Event', ['id', 'type', 'data'])
+
+
+class MemoryBroker:
+    """Per-board publish/subscribe within a single process"""
+
+    def __init__(self, config):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._ids = itertools.count(1)
+
+    def publish(self, board_id, event_type, data):
+        event = Event(next(self._ids), event_type, data)
+        with self._lock:
+            subscribers = list(self._subscribers[board_id])
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def subscribe(self, board_id, last_event_id=None):
+        # Events are not kept, so there is nothing to replay from last_event_id
+        subscription = MemorySubscription(self, board_id)
+        with self._lock:
+            self._subscribers[board_id].add(subscription.queue)
+        return subscription
+
+    def unsubscribe(self, board_id, subscriber):
+        with self._lock:
+            self._subscribers[board_id].discard(subscriber)
+            if not self._subscribers[board_id]:
+                del self._subscribers[board_id]
+
+
+class MemorySubscription:
+    def __init__(self, broker, board_id):
+        self.broker = broker
+        self.board_id = board_id
+        self.queue = queue.Queue()
+
+    def get(self, timeout):
+        """Wait up to timeout seconds and return every event received, or an empty list"""
+        try:
+            events = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        self.broker.unsubscribe(self.board_id, self.queue)
+
+
+class DatabaseBroker:
+    """Shares events between worker processes through the board_event table.
+
+    One thread per process polls the table for every board with subscribers and hands new rows
+    to their queues, so the polling cost doesn't grow with the number of open streams, and
+    streams hold no database connection while they wait.
+
+    Ids are assigned at insert but rows only become visible at commit, so with concurrent
+    publishers a smaller id can appear after a larger one has been read. Each poll re-reads the
+    REORDER_WINDOW ids behind the cursor and delivers any it hasn't delivered before.
+    """
+
+    PRUNE_EVERY = 100  # Publishes between deletions of expired rows
+    BATCH_SIZE = 500
+    REORDER_WINDOW = 1000  # Ids behind the cursor re-read for events that committed late
+
+    def __init__(self, config):
+        self.poll_interval = config['EVENT_POLL_INTERVAL']
+        self.retention = timedelta(seconds=config['EVENT_RETENTION'])
+        self._publishes = itertools.count()
+        self._lock = threading.Lock()
+        # board_id -> {queue: (id it started after, ids it was given by replay)}
+        self._subscribers = defaultdict(dict)
+        self._cursor = None  # Newest row the poller has read
+        self._delivered = set()  # Ids within REORDER_WINDOW of the cursor already handed out
+        self._poller = None
+
+    def publish(self, board_id, event_type, data):
+        db.session.add(BoardEvent(board_id=board_id, event_type=event_type, payload=json.dumps(data)))
+        if next(self._publishes) % self.PRUNE_EVERY == 0:
+            db.session.execute(delete(BoardEvent).where(BoardEvent.created_at < datetime.now() - self.retention))
+        db.session.commit()
+
+    def subscribe(self, board_id, last_event_id=None):
+        subscription = MemorySubscription(self, board_id)
+        # Under the lock, so the poller can't hand out newer events before the missed ones are queued
+        with self._lock:
+            replayed = set()
+            if last_event_id is None:
+                start = db.session.execute(
+                    select(func.coalesce(func.max(BoardEvent.id), 0)).where(BoardEvent.board_id == board_id)
+                ).scalar()
+            else:
+                start = last_event_id
+                for _, event in self.read(BoardEvent.board_id == board_id, BoardEvent.id > last_event_id):
+                    subscription.queue.put(event)
+                    replayed.add(event.id)
+            self._subscribers[board_id][subscription.queue] = (start, replayed)
+            if self._poller is None:
+                self._cursor = max(replayed, default=start)
+                self._delivered = set()
+                self._poller = threading.Thread(target=self.poll_forever, args=(current_app._get_current_object(),),
+                                                name='board-event-poller', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, board_id, subscriber):
+        with self._lock:
+            self._subscribers[board_id].pop(subscriber, None)
+            if not self._subscribers[board_id]:
+                del self._subscribers[board_id]
+
+    def read(self, *conditions, limit=None):
+        """(board_id, event) for the board_event rows matching conditions, oldest first"""
+        rows = db.session.execute(
+            select(BoardEvent.id, BoardEvent.board_id, BoardEvent.event_type, BoardEvent.payload)
+            .where(*conditions).order_by(BoardEvent.id).limit(limit)
+        ).all()
+        return [(row.board_id, Event(row.id, row.event_type, json.loads(row.payload))) for row in rows]
+
+    def poll_forever(self, app):
+        with app.app_context():
+            while True:
+                time.sleep(self.poll_interval)
+                with self._lock:
+                    if not self._subscribers:
+                        # The next subscriber starts a new poller
+                        self._poller = None
+                        self._cursor = None
+                        return
+                try:
+                    self.poll()
+                except Exception as e:
+                    app.logger.error(f"Error polling board events: {e}")
+                finally:
+                    # Return the connection to the pool between polls
+                    db.session.remove()
+
+    def poll(self):
+        """Hand every new event on a subscribed board to that board's subscribers"""
+        with self._lock:
+            boards = list(self._subscribers)
+            cursor = self._cursor
+        late = self.read(BoardEvent.board_id.in_(boards), BoardEvent.id > cursor - self.REORDER_WINDOW,
+                         BoardEvent.id <= cursor)
+        self.deliver([(board_id, event) for board_id, event in late if event.id not in self._delivered])
+        while True:
+            events = self.read(BoardEvent.board_id.in_(boards), BoardEvent.id > cursor, limit=self.BATCH_SIZE)
+            self.deliver(events)
+            if len(events) < self.BATCH_SIZE:
+                return
+            cursor = events[-1][1].id
+
+    def deliver(self, events):
+        if not events:
+            return
+        with self._lock:
+            for board_id, event in events:
+                self._delivered.add(event.id)
+                for subscriber, (start, replayed) in self._subscribers.get(board_id, {}).items():
+                    # Subscribers that replayed from Last-Event-ID may have it already
+                    if event.id > start and event.id not in replayed:
+                        subscriber.put(event)
+                self._cursor = max(self._cursor, event.id)
+            # Ids this far behind are never re-read, so they needn't be remembered
+            horizon = self._cursor - self.REORDER_WINDOW
+            self._delivered = {event_id for event_id in self._delivered if event_id > horizon}
+            for subscribers in self._subscribers.values():
+                for _, replayed in subscribers.values():
+                    replayed.difference_update([event_id for event_id in replayed if event_id <= horizon])
+
+
+BROKERS = {
+    'memory': MemoryBroker,
+    'database': DatabaseBroker,
+}
+
+
+def init_events(app):
+    backend = app.config['EVENT_BROKER']
+    if backend not in BROKERS:
+        raise ValueError(f"Unknown EVENT_BROKER '{backend}', expected one of {sorted(BROKERS)}")
+    app.extensions['event_broker'] = BROKERS[backend](app.config)
+    app.extensions['event_stream_slots'] = threading.BoundedSemaphore(app.config['EVENT_MAX_STREAMS'])
+
+
+def get_broker():
+    return current_app.extensions['event_broker']
+
+
+def get_stream_slots():
+    """Semaphore counting the event streams this process may still open"""
+    return current_app.extensions['event_stream_slots']
+
+
+def publish_board_event(board_id, event_type, data):
+    """Push a change to everyone watching the board; call after the change has been committed"""
+    data = dict(data, origin=request.headers.get('X-Client-Id'))
+    try:
+        get_broker().publish(board_id, event_type, data)
+    except Exception as e:
+        # A failed push must not fail the write that has already been committed
+        db.session.rollback()
+        current_app.logger.error(f"Error publishing board event: {e}")
+
+
+def format_event(event):
+    return f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n"
+
+
+def stream_events(subscription, heartbeat, timeout):
+    """Yield server-sent events until timeout, after which the browser reconnects with Last-Event-ID"""
+    deadline = time.monotonic() + timeout
+    try:
+        yield "retry: 3000\n\n"
+        while time.monotonic() < deadline:
+            events = subscription.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0)))
+            if not events:
+                yield ": keep-alive\n\n"
+            for event in events:
+                yield format_event(event)
+    finally:
+        subscription.close()
@@ -0,0 +1,129 @@
+# app/exports.py
+import csv
+import io
+import json
+from itertools import groupby
+from sqlalchemy import select
+from . import db
+from .models import Access, Board, Note, Reply, User
+
+BOARD_EXPORT_FORMAT = 1  # Bump if imports.import_board can no longer read older files
+YIELD_PER = 1000  # Rows fetched from the cursor at a time
+CHUNK_SIZE = 65536  # Bytes of output sent per write
+
+# Whole-table exports: the columns to send and the key they are ordered and paged by
+TABLES = {
+    'notes': (select(Note.id, Note.board_id, Note.user_id, Note.content, Note.color, Note.created_at, Note.updated_at), Note.id),
+    'boards': (select(Board.id, Board.title, Board.owner_id, Board.note_count, Board.updated_at), Board.id),
+}
+DATASETS = (*TABLES, 'user_boards')
+CSV_COLUMNS = {
+    'notes': ['id', 'board_id', 'user_id', 'content', 'color', 'created_at', 'updated_at'],
+    'boards': ['id', 'title', 'owner_id', 'note_count', 'updated_at'],
+    'user_boards': ['user_id', 'username', 'board_id', 'title'],
+}
+
+
+def table_records(dataset, after, limit):
+    query, key = TABLES[dataset]
+    statement = query.where(key > after).order_by(key)
+    if limit:
+        statement = statement.limit(limit)
+    # yield_per streams from a server-side cursor instead of fetching every row up front
+    for row in db.session.execute(statement.execution_options(yield_per=YIELD_PER)):
+        yield row._asdict()
+
+
+def user_board_records(after, limit):
+    """Each user with the boards they have been granted, from one query ordered by user"""
+    users = select(User.id).where(User.id > after).order_by(User.id)
+    if limit:
+        users = users.limit(limit)
+    users = users.subquery()
+    statement = (
+        select(User.id, User.email, Board.id.label('board_id'), Board.title)
+        .join(users, users.c.id == User.id)
+        .outerjoin(Access, Access.user_id == User.id)
+        .outerjoin(Board, Board.id == Access.board_id)
+        .order_by(User.id, Board.id)
+    )
+    rows = db.session.execute(statement.execution_options(yield_per=YIELD_PER))
+    # Rows arrive grouped by user, so only one user's boards are held at a time
+    for (user_id, email), user_rows in groupby(rows, key=lambda row: (row.id, row.email)):
+        yield {
+            'user_id': user_id,
+            'username': email,
+            'boards': [{'board_id': row.board_id, 'title': row.title, 'type': 'access_granted'}
+                       for row in user_rows if row.board_id is not None],
+        }
+
+
+def export_records(dataset, after, limit):
+    if dataset == 'user_boards':
+        return user_board_records(after, limit)
+    return table_records(dataset, after, limit)
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, default=lambda value: value.isoformat()) + '\n'
+
+
+def csv_rows(dataset, record):
+    if dataset != 'user_boards':
+        return [record]
+    # One row per granted board, or one without a board for users who have none
+    return [dict(record, **board) for board in record['boards'] or [{}]]
+
+
+def csv_lines(dataset, records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_COLUMNS[dataset], extrasaction='ignore')
+    writer.writeheader()
+    for record in records:
+        writer.writerows(csv_rows(dataset, record))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # An export with no records still has its header
+    yield buffer.getvalue()
+
+
+def chunked(lines):
+    """Join small lines into writes of about CHUNK_SIZE bytes"""
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def export_stream(dataset, format, after=0, limit=None):
+    """The dataset as NDJSON or CSV text chunks, ordered by id; page with after=<last id seen>"""
+    records = export_records(dataset, after, limit)
+    return chunked(csv_lines(dataset, records) if format == 'csv' else ndjson_lines(records))
+
+
+def board_records(board_id):
+    """The board, then its notes, then their replies, as read back by imports.import_board"""
+    board = db.session.get(Board, board_id)
+    yield {'type': 'board', 'format': BOARD_EXPORT_FORMAT, 'title': board.title}
+    notes = (select(Note.id, Note.content, Note.color, Note.position_x, Note.position_y, Note.width, Note.height, Note.created_at)
+             .where(Note.board_id == board_id).order_by(Note.id))
+    for row in db.session.execute(notes.execution_options(yield_per=YIELD_PER)):
+        yield {'type': 'note', **row._asdict()}
+    replies = (select(Reply.id, Reply.note_id, Reply.content, Reply.created_at)
+               .join(Note, Note.id == Reply.note_id).where(Note.board_id == board_id)
+               .order_by(Reply.note_id, Reply.created_at, Reply.id))
+    for row in db.session.execute(replies.execution_options(yield_per=YIELD_PER)):
+        yield {'type': 'reply', **row._asdict()}
+
+
+def board_export_stream(board_id):
+    return chunked(ndjson_lines(board_records(board_id)))
@@ -2,7 +2,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
-from .models import User
+from .auth import user_by_email
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -14,10 +14,11 @@ class RegisterForm(FlaskForm):
     password = PasswordField('Password', validators=[DataRequired()])
     confirm_password = PasswordField('Confirm Password', validators=[DataRequired(), EqualTo('password')])
     submit = SubmitField('Create Account')
+    existing_user = None  # Set by validate_email, so the view doesn't look the email up again
 
     def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user:
+        self.existing_user = user_by_email(email.data)
+        if self.existing_user:
             raise ValidationError('Email already registered.')
 
 class NoteForm(FlaskForm):
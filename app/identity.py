@@ -0,0 +1,64 @@
+# app/identity.py
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import case, literal, select, true, union_all
+from . import db
+from .cache import get_cache, preferences_entry, preferences_key, user_version
+from .models import Access, Board, User, UserPreferences
+from .permissions import EDIT, LEVELS, OWNER, READ, cache_board_permissions
+
+
+class Identity(UserMixin):
+    """current_user: the id and email of a User, rebuilt from the cache on each request"""
+
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+
+    @property
+    def preferences(self):
+        # For writing settings; reads go through cache.get_cached_preferences
+        return UserPreferences.query.filter_by(user_id=self.id).first()
+
+
+def identity_key(user_id, version):
+    return f'identity:{user_id}:{version}'
+
+
+def load_identity(user_id, version):
+    """Read the user with their preferences and boards in one query, caching all three under `version`"""
+    boards = union_all(
+        select(Access.board_id, case((Access.can_edit, EDIT), else_=READ).label('level')).where(Access.user_id == user_id),
+        select(Board.id, literal(OWNER)).where(Board.owner_id == user_id),
+    ).subquery()
+    rows = db.session.execute(
+        select(User.id, User.email, UserPreferences, boards.c.board_id, boards.c.level)
+        .outerjoin(UserPreferences, UserPreferences.user_id == User.id)
+        .outerjoin(boards, true())
+        .where(User.id == user_id)
+    ).all()
+    if not rows:
+        return None
+
+    permissions = {}
+    for row in rows:
+        # Owning a board outranks any access granted to it
+        if row.board_id is not None and LEVELS[row.level] > LEVELS.get(permissions.get(row.board_id), 0):
+            permissions[row.board_id] = row.level
+    cache_board_permissions(user_id, version, permissions)
+    # Users without preferences get defaults created by get_cached_preferences
+    if rows[0].UserPreferences is not None:
+        get_cache().set(preferences_key(user_id, version), preferences_entry(rows[0].UserPreferences),
+                        current_app.config['PREFERENCES_CACHE_TTL'])
+
+    identity = {'id': rows[0].id, 'email': rows[0].email}
+    get_cache().set(identity_key(user_id, version), identity, current_app.config['IDENTITY_CACHE_TTL'])
+    return identity
+
+
+def get_identity(user_id):
+    """The user as current_user, or None if they no longer exist. Served from the cache, so
+    authenticated requests don't query for the user; see cache.bump_user_version."""
+    version = user_version(user_id)
+    identity = get_cache().get(identity_key(user_id, version)) or load_identity(user_id, version)
+    return Identity(**identity) if identity else None
@@ -0,0 +1,129 @@
+# app/imports.py
+import json
+from datetime import datetime
+from sqlalchemy import insert, select
+from . import db
+from .models import Note, Reply
+from .search import index_board_version
+from .spatial import GEOMETRY_FIELDS, geometry_error, index_notes
+from .sync import adjust_note_count, bump_board_version
+
+IMPORT_BATCH_SIZE = 5000  # Rows per executemany INSERT
+MAX_IMPORT_RECORDS = 500000
+MAX_REPLY_LENGTH = 1000  # Reply.content is a String(1000)
+
+
+def parse_created_at(value, number):
+    if value is None:
+        return datetime.now()
+    try:
+        created_at = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Line {number}: created_at must be an ISO 8601 timestamp')
+    # Stored as naive local time
+    return created_at.astimezone().replace(tzinfo=None) if created_at.tzinfo else created_at
+
+
+def parse_content(record, number, max_length=None):
+    content = record.get('content')
+    if not isinstance(content, str) or not content.strip():
+        raise ValueError(f'Line {number}: content must be a non-empty string')
+    if max_length and len(content) > max_length:
+        raise ValueError(f'Line {number}: content is longer than {max_length} characters')
+    return content
+
+
+def note_row(record, number, board_id, user_id, version):
+    color = record.get('color')
+    if color is not None and not (isinstance(color, str) and len(color) <= 7):
+        raise ValueError(f'Line {number}: color must be a hex colour such as #7785cc')
+    # Checked as batch updates are, since each note's size sets how many tiles it gets
+    error = geometry_error(record)
+    if error:
+        raise ValueError(f'Line {number}: {error}')
+    row = {'content': parse_content(record, number), 'color': color, 'board_id': board_id, 'user_id': user_id,
+           'version': version, 'created_at': parse_created_at(record.get('created_at'), number)}
+    row.update({field: record.get(field) for field in GEOMETRY_FIELDS})
+    return row
+
+
+def import_board(board_id, user_id, lines):
+    """Add the notes and replies in NDJSON lines, as written by exports.board_records, to the board.
+
+    Lines are parsed as they are read and inserted IMPORT_BATCH_SIZE rows per executemany.
+    Bulk inserts skip the ORM flush hooks, so versions, note counts, tiles and the search
+    index are maintained here. Raises ValueError naming the first bad line; the caller
+    commits or rolls back, so a file is imported completely or not at all.
+    Returns (notes imported, replies imported, board version).
+    """
+    version = bump_board_version(board_id)
+    note_ids = {}  # Exported note id -> new id, for the replies that follow
+    notes = []  # Pending (exported id, row)
+    replies = []
+    counts = {'notes': 0, 'replies': 0, 'last_note_id': 0}
+
+    def insert_notes():
+        if not notes:
+            return
+        # Core executemany without RETURNING, which SQLite can only keep in order one INSERT per row.
+        # The board row is locked until commit, so this import is the only writer at this version,
+        # and autoincrement ids follow insert order.
+        connection = db.session.connection()
+        connection.execute(insert(Note.__table__), [row for _, row in notes])
+        new_ids = connection.execute(
+            select(Note.id).where(Note.board_id == board_id, Note.version == version, Note.id > counts['last_note_id'])
+            .order_by(Note.id)
+        ).scalars().all()
+        for (exported_id, _), note_id in zip(notes, new_ids):
+            if exported_id is not None:
+                note_ids[exported_id] = note_id
+        index_notes(connection, [(note_id, board_id, row) for (_, row), note_id in zip(notes, new_ids)])
+        counts['notes'] += len(notes)
+        counts['last_note_id'] = new_ids[-1]
+        notes.clear()
+
+    def insert_replies():
+        if replies:
+            db.session.connection().execute(insert(Reply.__table__), replies)
+            counts['replies'] += len(replies)
+            replies.clear()
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f'Line {number}: not valid JSON')
+        if not isinstance(record, dict):
+            raise ValueError(f'Line {number}: expected a JSON object')
+
+        kind = record.get('type')
+        if kind == 'board':
+            continue
+        elif kind == 'note':
+            notes.append((record.get('id'), note_row(record, number, board_id, user_id, version)))
+            if len(notes) >= IMPORT_BATCH_SIZE:
+                insert_notes()
+        elif kind == 'reply':
+            # Replies name notes from earlier in the file, which need their new ids first
+            insert_notes()
+            note_id = note_ids.get(record.get('note_id'))
+            if note_id is None:
+                raise ValueError(f'Line {number}: reply refers to note {record.get("note_id")!r}, which is not earlier in the file')
+            replies.append({'content': parse_content(record, number, MAX_REPLY_LENGTH), 'note_id': note_id,
+                            'user_id': user_id, 'version': version,
+                            'created_at': parse_created_at(record.get('created_at'), number)})
+            if len(replies) >= IMPORT_BATCH_SIZE:
+                insert_replies()
+        else:
+            raise ValueError(f"Line {number}: type must be 'board', 'note' or 'reply'")
+
+        if counts['notes'] + counts['replies'] + len(notes) + len(replies) > MAX_IMPORT_RECORDS:
+            raise ValueError(f'At most {MAX_IMPORT_RECORDS} notes and replies can be imported at once')
+
+    insert_notes()
+    insert_replies()
+    index_board_version(db.session.connection(), board_id, version)
+    adjust_note_count(board_id, counts['notes'])
+    return counts['notes'], counts['replies'], version
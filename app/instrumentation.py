@@ -0,0 +1,136 @@
+# app/instrumentation.py
+import json
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .metrics import observe_request
+
+
+class RequestStats:
+    """What one request spent on SQL and serialisation"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = []  # (duration, statement)
+        self.serialize_time = 0.0
+        self.render_start = None
+
+    @property
+    def db_time(self):
+        return sum(duration for duration, _ in self.statements)
+
+
+def request_stats():
+    """Stats for the current request, or None outside one (or before it started)"""
+    return g.get('request_stats') if has_request_context() else None
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Adds the time jsonify spends encoding to the request's serialisation time"""
+
+    def response(self, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().response(*args, **kwargs)
+        stats = request_stats()
+        if stats is not None:
+            stats.serialize_time += time.perf_counter() - start
+        return response
+
+
+# Listening on the Engine class covers every engine, including ones created after this import.
+# The start time lives on the statement's execution context, so a statement that fails (and
+# never reaches after_cursor_execute) leaves nothing behind on the pooled connection.
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.statement_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'statement_start', None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    stats = request_stats()
+    if stats is not None:
+        stats.statements.append((duration, statement))
+
+
+def start_render(sender, template, context, **extra):
+    stats = request_stats()
+    if stats is not None:
+        stats.render_start = time.perf_counter()
+
+
+def end_render(sender, template, context, **extra):
+    stats = request_stats()
+    if stats is not None and stats.render_start is not None:
+        stats.serialize_time += time.perf_counter() - stats.render_start
+        stats.render_start = None
+
+
+def init_instrumentation(app):
+    """Time every request's SQL and serialisation; call before other after_request hooks are added
+    so the response size is measured after compression"""
+    app.json = TimedJSONProvider(app)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(end_render, app)
+    app.before_request(start_request)
+    app.after_request(record_request)
+
+
+def start_request():
+    g.request_stats = RequestStats()
+
+
+def record_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    config = current_app.config
+    total = time.perf_counter() - stats.start
+    count = len(stats.statements)
+
+    if config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={stats.db_time * 1000:.1f};desc="{count} queries"',
+            f'serialize;dur={stats.serialize_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+    # Streamed and file responses are sent after this hook, so their size isn't known here
+    size = None if response.is_streamed or response.direct_passthrough else response.calculate_content_length()
+    record = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(total * 1000, 2),
+        'queries': count,
+        'db_ms': round(stats.db_time * 1000, 2),
+        'serialize_ms': round(stats.serialize_time * 1000, 2),
+        'response_bytes': size,
+        'slowest': [{'ms': round(duration * 1000, 2), 'sql': statement}
+                    for duration, statement in sorted(stats.statements, reverse=True)[:config['SLOW_STATEMENT_COUNT']]],
+    }
+    current_app.logger.info(json.dumps(record))
+    observe_request(request.endpoint, request.method, response.status_code, total, size)
+
+    if count > config['QUERY_BUDGET']:
+        # The same statement run over and over is usually a lazy load inside a loop
+        repeated = [{'count': n, 'sql': statement}
+                    for statement, n in Counter(statement for _, statement in stats.statements).most_common(3) if n > 1]
+        current_app.logger.warning(json.dumps({
+            'warning': 'query budget exceeded',
+            'endpoint': request.endpoint,
+            'path': request.path,
+            'queries': count,
+            'budget': config['QUERY_BUDGET'],
+            'repeated': repeated,
+        }))
+    return response
@@ -0,0 +1,119 @@
+# app/metrics.py
+import hmac
+import os
+import time
+from collections import Counter as Tally
+from flask import Response, abort, current_app, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.pool import Pool, QueuePool
+from . import db
+from .models import Note, Reply
+
+# Under gunicorn every worker writes its values to files in PROMETHEUS_MULTIPROC_DIR
+# (set up by gunicorn.conf.py) and /metrics adds them up; otherwise the values are in memory
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+REQUEST_LATENCY = Histogram('taskhub_request_duration_seconds', 'Time to handle a request',
+                            ['endpoint', 'method'])
+REQUESTS = Counter('taskhub_requests_total', 'Requests handled', ['endpoint', 'method', 'status'])
+RESPONSE_SIZE = Histogram('taskhub_response_size_bytes', 'Size of response bodies', ['endpoint'],
+                          buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+AVATAR_SIZE = Histogram('taskhub_avatar_size_bytes', 'Size of avatar images served',
+                        buckets=(1024, 2048, 4096, 8192, 16384, 32768, 65536))
+POOL_WAIT = Histogram('taskhub_db_pool_checkout_seconds', 'Time spent waiting for a pooled database connection',
+                      buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+PASSWORD_HASH_TIME = Histogram('taskhub_password_hash_seconds', 'Time to hash or check a password, including the wait for a hashing worker',
+                               ['operation'], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+CONNECTIONS_IN_USE = Gauge('taskhub_db_connections_in_use', 'Database connections checked out of the pool',
+                           multiprocess_mode='livesum')
+STARTUP_TIME = Histogram('taskhub_app_startup_seconds', 'Time for create_app to build the app, once per worker boot',
+                         buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+WRITES = Counter('taskhub_writes_total', 'Committed note and reply writes', ['kind', 'operation'])
+
+WRITE_KINDS = {Note: 'note', Reply: 'reply'}
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waits, including any new connection it opens"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+
+def init_metrics(app):
+    """Register /metrics; call before db.init_app, which builds the engine with TimedQueuePool"""
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    # In-memory SQLite keeps the single connection Flask-SQLAlchemy gives it
+    options.setdefault('poolclass', TimedQueuePool)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def observe_request(endpoint, method, status, duration, size):
+    """Called by instrumentation.py once a response is ready"""
+    endpoint = endpoint or 'none'  # Unmatched URLs
+    REQUEST_LATENCY.labels(endpoint, method).observe(duration)
+    REQUESTS.labels(endpoint, method, str(status)).inc()
+    if size is not None:
+        RESPONSE_SIZE.labels(endpoint).observe(size)
+        if endpoint == 'app.get_avatar' and status == 200:
+            AVATAR_SIZE.observe(size)
+
+
+def count_writes(kind, operation, count=1):
+    """For writes that bypass the session hooks, such as bulk updates; call after committing"""
+    WRITES.labels(kind, operation).inc(count)
+
+
+def observe_startup(duration):
+    STARTUP_TIME.observe(duration)
+
+
+@event.listens_for(Pool, 'checkout')
+def connection_checked_out(dbapi_connection, connection_record, connection_proxy):
+    CONNECTIONS_IN_USE.inc()
+
+
+@event.listens_for(Pool, 'checkin')
+def connection_checked_in(dbapi_connection, connection_record):
+    CONNECTIONS_IN_USE.dec()
+
+
+@event.listens_for(db.session, 'after_flush')
+def tally_writes(session, flush_context):
+    # Counted when the transaction commits, so rolled back writes are left out
+    tally = session.info.setdefault('metrics_writes', Tally())
+    for operation, objects in (('create', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            kind = WRITE_KINDS.get(type(obj))
+            if kind is not None and (operation != 'update' or session.is_modified(obj)):
+                tally[kind, operation] += 1
+
+
+@event.listens_for(db.session, 'after_commit')
+def record_writes(session):
+    for (kind, operation), count in session.info.pop('metrics_writes', Tally()).items():
+        count_writes(kind, operation, count)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_writes(session):
+    session.info.pop('metrics_writes', None)
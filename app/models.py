@@ -13,20 +13,24 @@ class User(db.Model, UserMixin):
     boards = db.relationship('Board', backref='owner', lazy=True)
 
 class Note(db.Model):
+    __table_args__ = (db.Index('ix_note_board_id_version', 'board_id', 'version'),)
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now())
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     color = db.Column(db.String(7)) 
     position_x = db.Column(db.Integer)
     position_y = db.Column(db.Integer)
     width = db.Column(db.Integer)
     height = db.Column(db.Integer)
-    board_id = db.Column(db.Integer, db.ForeignKey('board.id'), nullable=False)
+    board_id = db.Column(db.Integer, db.ForeignKey('board.id'), nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    version = db.Column(db.Integer, nullable=False, default=0)  # Board version of the last change, see sync.py
 
 class UserPreferences(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True, index=True)
     designTheme = db.Column(db.String(150), default='default')
     designBackColor = db.Column(db.String(7), default='#D3D3D3') #	1A202C is also nice
     designSideBarColor = db.Column(db.String(7), default='#F4F4F4')
@@ -37,33 +41,90 @@ class UserPreferences(db.Model):
     enable_email_notif_own = db.Column(db.Boolean, default=False)
     enable_email_notif_star = db.Column(db.Boolean, default=False)
     privacy = db.Column(db.String(50), default='private')
-    profile_picture = db.Column(db.Text)  # Changed from String(250) to Text
+    profile_picture = db.Column(db.Text)  # URL of the avatar, e.g. /avatars/<hash>
+    profile_thumbnail = db.Column(db.Text)  # URL of the small variant shown on notes
     username = db.Column(db.String(150), default='Username')
     light_dark_mode = db.Column(db.Boolean, default=False)
     note_colour = db.Column(db.String(7), default='#7785cc')
 
+    @property
+    def note_picture(self):
+        # Small variant for note headers, falling back for pictures set before thumbnailing
+        return self.profile_thumbnail or self.profile_picture
+
+class Avatar(db.Model):
+    hash = db.Column(db.String(64), primary_key=True)  # sha256 of the image bytes
+    content_type = db.Column(db.String(50), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
 class Access(db.Model):
+    # The composite index also serves lookups on user_id alone
+    __table_args__ = (db.Index('ix_access_user_id_board_id', 'user_id', 'board_id', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    board_id = db.Column(db.Integer, db.ForeignKey('board.id'), nullable=False)
+    board_id = db.Column(db.Integer, db.ForeignKey('board.id'), nullable=False, index=True)
     can_edit = db.Column(db.Boolean, default=False)
 
 class Board(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
-    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False, default=0)  # Bumped on every note/reply change
+    # Denormalised for the board list, both maintained by sync.py
+    note_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+    is_template = db.Column(db.Boolean, nullable=False, default=False)  # Kept out of the board list; cloned to start new boards
     notes = db.relationship('Note', backref='board', lazy=True)
 
+class Tombstone(db.Model):
+    # Records deletions so ?since= syncs can tell clients what to remove
+    __table_args__ = (db.Index('ix_tombstone_board_id_version', 'board_id', 'version'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    board_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # 'note' or 'reply'
+    object_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.now)
+
+class NoteTile(db.Model):
+    # Grid buckets each note's rectangle overlaps, maintained by spatial.py
+    __table_args__ = (db.Index('ix_note_tile_board_id_tile', 'board_id', 'tile_x', 'tile_y'),)
+
+    note_id = db.Column(db.Integer, db.ForeignKey('note.id'), primary_key=True)
+    tile_x = db.Column(db.Integer, primary_key=True)
+    tile_y = db.Column(db.Integer, primary_key=True)
+    board_id = db.Column(db.Integer, nullable=False)
+
+class BoardEvent(db.Model):
+    # Change log shared between workers when EVENT_BROKER is 'database'
+    id = db.Column(db.Integer, primary_key=True)
+    board_id = db.Column(db.Integer, nullable=False, index=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
 class Reply(db.Model, UserMixin):
+    __table_args__ = (
+        db.Index('ix_reply_note_id_version', 'note_id', 'version'),
+        # Backs keyset pagination of a note's thread, newest first (see queries.get_reply_page)
+        db.Index('ix_reply_note_id_created_at_id', 'note_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(1000), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now())
+    created_at = db.Column(db.DateTime, default=datetime.now)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     note_id = db.Column(db.Integer, db.ForeignKey('note.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    version = db.Column(db.Integer, nullable=False, default=0)  # Board version of the last change, see sync.py
 
     user = db.relationship('User', backref='replies')
 
     def to_dict(self):
+        # Expects user and user.preferences to be eagerly loaded (see queries.get_reply / get_note_replies)
         return {
             'id': self.id,
             'content': self.content,
@@ -0,0 +1,108 @@
+# app/permissions.py
+import hmac
+from functools import wraps
+from flask import current_app, g, jsonify, request
+from flask_login import current_user
+from sqlalchemy import select
+from . import db
+from .cache import bump_user_version, get_cache, invalidate_board_list, user_version
+from .models import Access, Board
+
+READ, EDIT, OWNER = 'read', 'edit', 'owner'
+LEVELS = {READ: 1, EDIT: 2, OWNER: 3}
+
+
+def permissions_key(user_id, version):
+    return f'board_permissions:{user_id}:{version}'
+
+
+def load_board_permissions(user_id):
+    """Every board the user can see, mapped to their permission level on it"""
+    permissions = {row.board_id: (EDIT if row.can_edit else READ) for row in db.session.execute(
+        select(Access.board_id, Access.can_edit).where(Access.user_id == user_id)
+    )}
+    for board_id in db.session.execute(select(Board.id).where(Board.owner_id == user_id)).scalars():
+        permissions[board_id] = OWNER
+    return permissions
+
+
+def get_board_permissions(user_id):
+    """The user's board permissions, computed once and reused by later requests until invalidated"""
+    if getattr(g, 'board_permissions', None) is None:
+        g.board_permissions = {}
+    if user_id in g.board_permissions:
+        return g.board_permissions[user_id]
+
+    cache = get_cache()
+    version = user_version(user_id)
+    cached = cache.get(permissions_key(user_id, version))
+    if cached is None:
+        permissions = load_board_permissions(user_id)
+        cache_board_permissions(user_id, version, permissions)
+    else:
+        permissions = {int(board_id): level for board_id, level in cached.items()}
+    g.board_permissions[user_id] = permissions
+    return permissions
+
+
+def cache_board_permissions(user_id, version, permissions):
+    # Keys are stored as strings so the file cache can hold them as JSON
+    get_cache().set(permissions_key(user_id, version), {str(board_id): level for board_id, level in permissions.items()},
+                    current_app.config['BOARD_PERMISSIONS_CACHE_TTL'])
+
+
+def invalidate_board_permissions(user_id):
+    """Forget the user's cached permissions and board list; call after committing a change to their access"""
+    bump_user_version(user_id)
+    invalidate_board_list(user_id)
+    if getattr(g, 'board_permissions', None):
+        g.board_permissions.pop(user_id, None)
+
+
+def board_permission(user_id, board_id):
+    return get_board_permissions(user_id).get(board_id)
+
+
+def has_board_permission(user_id, board_id, level=READ):
+    permission = board_permission(user_id, board_id)
+    return permission is not None and LEVELS[permission] >= LEVELS[level]
+
+
+def editable_board_ids(user_id, board_ids):
+    """The boards among board_ids that the user owns or may edit"""
+    return {board_id for board_id in board_ids if has_board_permission(user_id, board_id, EDIT)}
+
+
+def board_access_required(level=READ):
+    """Reject the request unless the current user has at least `level` on the board_id view argument"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            board_id = kwargs['board_id']
+            if not has_board_permission(current_user.id, board_id, level):
+                # Only denied requests pay for telling a missing board from a forbidden one
+                if db.session.get(Board, board_id) is None:
+                    return jsonify({"error": "Board not found"}), 404
+                return jsonify({"error": "Unauthorized"}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def is_admin():
+    """A session of a user in ADMIN_EMAILS, or a script sending the ADMIN_SECRET bearer token"""
+    secret = current_app.config['ADMIN_SECRET']
+    if secret and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {secret}'):
+        return True
+    return current_user.is_authenticated and current_user.email in current_app.config['ADMIN_EMAILS']
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            if not current_user.is_authenticated:
+                return jsonify({"error": "Authentication required"}), 401
+            return jsonify({"error": "Unauthorized"}), 403
+        return view(*args, **kwargs)
+    return wrapper
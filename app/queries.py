@@ -0,0 +1,138 @@
+# app/queries.py
+from flask import url_for
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import joinedload
+from . import db
+from .models import User, Note, Reply, Board, Access, Tombstone
+
+
+def get_board_notes(board_id, since=None):
+    """Load a board's notes together with their authors and author preferences in a single query.
+
+    With since, only notes changed after that board version are returned.
+    """
+    query = (Note.query
+             .options(joinedload(Note.user).joinedload(User.preferences))
+             .filter(Note.board_id == board_id))
+    if since is not None:
+        query = query.filter(Note.version > since)
+    return query.all()
+
+
+def get_note_with_author(note_id):
+    """Load a note with its author and author preferences in a single query"""
+    return (Note.query
+            .options(joinedload(Note.user).joinedload(User.preferences))
+            .filter(Note.id == note_id)
+            .first())
+
+
+def get_note_replies(note_id, since=None):
+    """Load every reply on a note with the reply authors and their preferences in a single query"""
+    query = (Reply.query
+             .options(joinedload(Reply.user).joinedload(User.preferences))
+             .filter(Reply.note_id == note_id))
+    if since is not None:
+        query = query.filter(Reply.version > since)
+    return query.order_by(Reply.created_at, Reply.id).all()
+
+
+def get_reply_page(note_id, limit, before=None):
+    """Up to `limit` replies older than reply `before` (or the newest, without it), oldest first.
+
+    Pages are taken by (created_at, id) keyset on ix_reply_note_id_created_at_id, so a page
+    deep in a long thread costs the same as the first. Returns (replies, has_older), or
+    None when `before` is not a reply on this note.
+    """
+    query = (Reply.query
+             .options(joinedload(Reply.user).joinedload(User.preferences))
+             .filter(Reply.note_id == note_id))
+    if before is not None:
+        cursor = db.session.execute(
+            select(Reply.created_at, Reply.id).where(Reply.id == before, Reply.note_id == note_id)
+        ).first()
+        if cursor is None:
+            return None
+        query = query.filter(tuple_(Reply.created_at, Reply.id) < tuple_(cursor.created_at, cursor.id))
+    # One extra row tells us whether an older page exists
+    replies = query.order_by(Reply.created_at.desc(), Reply.id.desc()).limit(limit + 1).all()
+    return replies[:limit][::-1], len(replies) > limit
+
+
+def get_deleted_ids(board_id, kind, since):
+    """Ids of notes or replies deleted from the board after the given board version"""
+    return db.session.execute(
+        select(Tombstone.object_id)
+        .where(Tombstone.board_id == board_id, Tombstone.kind == kind, Tombstone.version > since)
+    ).scalars().all()
+
+
+def get_reply(reply_id):
+    """Load one reply with its author and preferences so Reply.to_dict needs no further queries"""
+    return (Reply.query
+            .options(joinedload(Reply.user).joinedload(User.preferences))
+            .filter(Reply.id == reply_id)
+            .first())
+
+
+def get_board_validators(board_id):
+    """(version, updated_at) of a board; the version changes with every note or reply change on it"""
+    return db.session.execute(select(Board.version, Board.updated_at).where(Board.id == board_id)).first()
+
+
+def get_note_validators(note_id):
+    """(user_id, board_id, version, updated_at) for a note, the version and time being its board's"""
+    return db.session.execute(
+        select(Note.user_id, Note.board_id, Board.version, Board.updated_at)
+        .join(Board, Note.board_id == Board.id)
+        .where(Note.id == note_id)
+    ).first()
+
+
+def get_user_boards(user_id, templates=False):
+    """Boards (or templates) the user owns or has been granted, with their denormalised note counts, in one query"""
+    rows = db.session.execute(
+        select(Board.id, Board.title, Board.owner_id, Board.note_count, Board.updated_at, Access.can_edit)
+        .outerjoin(Access, (Access.board_id == Board.id) & (Access.user_id == user_id))
+        .where((Board.owner_id == user_id) | (Access.user_id == user_id), Board.is_template == templates)
+        .order_by(Board.id)
+    )
+    return [{
+        'id': row.id,
+        'title': row.title,
+        'permission': 'owner' if row.owner_id == user_id else ('edit' if row.can_edit else 'read'),
+        'note_count': row.note_count,
+        'updated_at': row.updated_at.isoformat() if row.updated_at else None
+    } for row in rows]
+
+
+def note_payload(note):
+    """JSON-ready note with its author's display name and note-sized photo"""
+    prefs = note.user.preferences
+    return {
+        'id': note.id,
+        'content': note.content,
+        'color': note.color,
+        'position_x': note.position_x,
+        'position_y': note.position_y,
+        'width': note.width,
+        'height': note.height,
+        'created_at': note.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'user_id': note.user_id,
+        'user_name': prefs.username if prefs else note.user.email,
+        'user_photo': prefs.note_picture if prefs and prefs.note_picture else url_for('static', filename='images/default-avatar.jpg')
+    }
+
+
+def notes_with_user_data(notes):
+    """Attach the display name and photo of each note's author, using the already-loaded relationships"""
+    default_photo = url_for('static', filename='images/default-avatar.jpg')
+    notes_data = []
+    for note in notes:
+        prefs = note.user.preferences
+        notes_data.append({
+            'note': note,
+            'user_name': prefs.username if prefs else note.user.email,
+            'user_photo': prefs.note_picture if prefs and prefs.note_picture else default_photo
+        })
+    return notes_data
@@ -1,17 +1,61 @@
 # app/routes.py
-from flask import Blueprint, render_template, redirect, session, url_for, flash, request, jsonify, Response
+from flask import Blueprint, render_template, redirect, session, url_for, flash, request, jsonify, Response, abort, stream_with_context, make_response
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf.csrf import generate_csrf  # Add this import
-from .models import User, Note, Board, Access, UserPreferences, Reply
+from .models import User, Note, Board, Access, UserPreferences, Reply, Avatar
 from .forms import LoginForm, RegisterForm, NoteForm
+from .auth import HashingBusy, authenticate, get_password_hasher, user_by_email
+from .avatars import set_profile_picture, avatar_response, not_modified_response
+from .queries import get_board_notes, get_board_validators, get_note_with_author, get_note_validators, get_note_replies, get_reply_page, get_reply, get_deleted_ids, note_payload, notes_with_user_data, get_user_boards
+from .sync import bump_board_version, bump_reply_boards
+from .spatial import GEOMETRY_FIELDS, geometry_error, get_notes_in_window, reindex_notes, window_too_large
+from .search import reindex_note_content, search_content
+from .metrics import count_writes
+from .exports import DATASETS, board_export_stream, export_stream
+from .imports import import_board
+from .cloning import clone_board
+from .events import get_broker, get_stream_slots, publish_board_event, stream_events
+from .cache import get_cached_board_list, get_cached_preferences, invalidate_board_lists, invalidate_preferences
+from .permissions import EDIT, admin_required, board_access_required, editable_board_ids, get_board_permissions, has_board_permission, invalidate_board_permissions
 from . import db, login_manager
+import io
 import os
+from datetime import timezone
+from urllib.parse import urlparse
 from flask import current_app
+from sqlalchemy import select, update
 from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
 app = Blueprint('app', __name__)
 
+NOTE_PATCH_FIELDS = ('position_x', 'position_y', 'width', 'height', 'color', 'content')
+MAX_BATCH_SIZE = 500
+def note_patch_error(values):
+    """Why a batch update's values can't be stored, or None; checked as imports.note_row checks imported notes"""
+    if 'content' in values and not (isinstance(values['content'], str) and values['content'].strip()):
+        return 'content must be a non-empty string'
+    color = values.get('color')
+    if color is not None and not (isinstance(color, str) and len(color) <= 7):
+        return 'color must be a hex colour such as #7785cc'
+    return geometry_error(values)
+
+def conditional_json(etag, updated_at, build):
+    """jsonify(build()) with validators, or a 304 without calling build() if the client's copy is current"""
+    # Timestamps are stored as naive local time
+    last_modified = updated_at.astimezone(timezone.utc).replace(microsecond=0) if updated_at else None
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+
+    response = Response(status=304) if not_modified else jsonify(build())
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Private and always revalidated, so a change is never served stale
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/', methods=['GET', 'POST'])
 def authentication():
     # Make session permanent to prevent premature expiration
@@ -44,17 +88,15 @@ def authentication():
             return render_template('authentication.html', login_form=login_form, register_form=register_form, form_type='login')
 
         elif 'register' in request.form:
-            existing_user = User.query.filter_by(email=register_form.email.data).first()
-            if existing_user:
-                flash('Email already registered. Please log in or use a different email.', 'alert-registerfail')
-                return render_template('authentication.html', login_form=LoginForm(), register_form=register_form, form_type='register')
-            
             if register_form.validate_on_submit():
                 response = register_user(register_form)
                 if response:
                     return response
                 else:
                     flash('Registration failed. Please check your input.', 'alert-registerfail')
+            elif register_form.existing_user:
+                flash('Email already registered. Please log in or use a different email.', 'alert-registerfail')
+                return render_template('authentication.html', login_form=LoginForm(), register_form=register_form, form_type='register')
             else:
                 flash('Registration failed. Please check your input.', 'alert-registerfail')
             return render_template('authentication.html', login_form=login_form, register_form=register_form, form_type='register')
@@ -69,45 +111,42 @@ def notes():
     board_id = session.get('active_board_id')
     print(f"Current active board ID: {board_id}")  # Debug statement
 
-    owned_boards = Board.query.filter_by(owner_id=current_user.id)
-    granted_access_boards = Board.query.join(Access).filter(Access.user_id == current_user.id)
-    boards = owned_boards.union(granted_access_boards).all()
-    current_board = Board.query.get(board_id) if board_id else None
-    current_board_title = current_board.title if current_board else "Your Notes"
-
     if request.method == 'POST' and form.validate_on_submit():
         if board_id:
             new_note = Note(content=form.content.data, user_id=current_user.id, board_id=board_id)
             db.session.add(new_note)
             db.session.commit()
+            invalidate_board_lists(board_id)
             flash('Note added successfully!', 'alert-success')
         else:
             flash('No board selected.', 'error')
+
+    # After any note added above, so the sidebar counts include it
+    boards = get_cached_board_list(current_user.id)
+    current_board = Board.query.get(board_id) if board_id else None
+    current_board_title = current_board.title if current_board else "Your Notes"
+    board_version = current_board.version if current_board else 0
             
-    notes = Note.query.filter_by(board_id=board_id).all() if board_id else []
-    
-    # Fetch user information for formatting
-    notes_with_user_data = [
-        {
-            'note': note,
-            'user_name': note.user.preferences.username if note.user.preferences else note.user.email,
-            'user_photo': note.user.preferences.profile_picture if note.user.preferences and note.user.preferences.profile_picture else url_for('static', filename='images/default-avatar.jpg')
-        }
-        for note in notes
-    ]
+    # Very large boards are loaded by notes.js one viewport at a time instead
+    windowed = bool(board_id) and Note.query.filter_by(board_id=board_id).count() > current_app.config['WINDOWED_BOARD_THRESHOLD']
+
+    # Notes, authors and preferences are loaded together to avoid a query per note
+    notes = get_board_notes(board_id) if board_id and not windowed else []
+    notes_data = notes_with_user_data(notes)
         
-    return render_template('notes.html', notes=notes_with_user_data, form=form, boards=boards, current_board_title=current_board_title, user_id=current_user.id)
+    return render_template('notes.html', notes=notes_data, form=form, boards=boards, current_board_title=current_board_title, board_version=board_version, windowed=windowed, user_id=current_user.id)
 
 
 def process_login(form):
-    user = User.query.filter_by(email=form.email.data).first()
-    if user and check_password_hash(user.password, form.password.data):
+    user = authenticate(user_by_email(form.email.data), form.password.data)
+    if user:
         login_user(user, remember=True)
         if not user.boards:
             # Create a default board if the user has none
             default_board = Board(title='Default Board', owner=user)
             db.session.add(default_board)
             db.session.commit()
+            invalidate_board_permissions(user.id)
             session['active_board_id'] = default_board.id
         else:
             session['active_board_id'] = user.boards[0].id 
@@ -117,9 +156,11 @@ def process_login(form):
         return None
 
 def register_user(form):
+    # Outside the try, so a busy hashing pool is answered with a 503 rather than a failed registration
+    password = get_password_hasher().hash(form.password.data)
     try:
         # Create user
-        new_user = User(email=form.email.data, password=generate_password_hash(form.password.data))
+        new_user = User(email=form.email.data, password=password)
         db.session.add(new_user)
         db.session.flush()  # Get the user ID without committing yet
         
@@ -133,6 +174,7 @@ def register_user(form):
         
         # Commit all changes to database
         db.session.commit()
+        invalidate_board_permissions(new_user.id)
         
         # Log in the user automatically
         login_user(new_user, remember=True)
@@ -178,8 +220,18 @@ def logout():
         flash('You have been logged out. (Session cleared manually)', 'info')
         return redirect(url_for('app.authentication'))
 
+@app.errorhandler(HashingBusy)
+def sign_in_busy(e):
+    flash('Too many people are signing in right now. Please try again in a moment.', 'alert-loginfail')
+    response = make_response(render_template('authentication.html', login_form=LoginForm(), register_form=RegisterForm()), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
 @login_manager.unauthorized_handler
 def unauthorized():
+    # Scripts asking for JSON get a status, not the sign-in page
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({"error": "Authentication required"}), 401
     flash('You must be logged in to view that page.', 'alert-error')
     return redirect(url_for('app.authentication'))
 
@@ -203,6 +255,8 @@ def add_note():
     
     db.session.add(new_note)
     db.session.commit()
+    invalidate_board_lists(board_id)
+    publish_board_event(board_id, 'note_added', note_payload(new_note))
     
     # Return more complete data
     return jsonify({
@@ -225,8 +279,11 @@ def delete_note(note_id):
     if note.user_id != current_user.id:
         flash('Permission denied', 'alert-error')
         return redirect(url_for('get_notes'))
+    board_id = note.board_id
     db.session.delete(note) 
     db.session.commit()
+    invalidate_board_lists(board_id)
+    publish_board_event(board_id, 'note_deleted', {'id': note_id})
     flash('Note deleted successfully!', 'alert-success')
     return redirect(url_for('app.notes'))
 
@@ -237,12 +294,15 @@ def update_note_position_and_size(note_id):
     if note is None:
         return jsonify({"error": "Note not found"}), 404
     
-    board = Board.query.get(note.board_id)
-    access = Access.query.filter_by(user_id=current_user.id, board_id=note.board_id).first()
-    if board.owner_id != current_user.id and (access is None or not access.can_edit):
+    if not has_board_permission(current_user.id, note.board_id, EDIT):
         return jsonify({"error": "Unauthorized"}), 403
 
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "No note update provided"}), 400
+    error = note_patch_error(data)
+    if error:
+        return jsonify({"error": error}), 400
     note.position_x = data.get('position_x', note.position_x)
     note.position_y = data.get('position_y', note.position_y)
     note.width = data.get('width', note.width)
@@ -253,8 +313,76 @@ def update_note_position_and_size(note_id):
         note.content = data['content']
 
     db.session.commit()
+    changes = {field: getattr(note, field) for field in NOTE_PATCH_FIELDS}
+    publish_board_event(note.board_id, 'notes_updated', {'notes': [dict(changes, id=note.id)]})
     return jsonify({"message": "Note updated successfully"}), 200
 
+@app.route('/notes/batch_update', methods=['POST'])
+@login_required
+def batch_update_notes():
+    data = request.get_json(silent=True) or {}
+    patches = data.get('notes')
+    if not isinstance(patches, list) or not patches:
+        return jsonify({"error": "No note updates provided"}), 400
+    if len(patches) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} notes can be updated at once"}), 400
+
+    # Merge patches per note; later patches for the same note win
+    merged = {}
+    for patch in patches:
+        if not isinstance(patch, dict) or not isinstance(patch.get('id'), int):
+            return jsonify({"error": "Each update needs an integer id"}), 400
+        values = {field: patch[field] for field in NOTE_PATCH_FIELDS if field in patch}
+        # One bad value rejects the whole batch before anything is written
+        error = note_patch_error(values)
+        if error:
+            return jsonify({"error": f"Note {patch['id']}: {error}"}), 400
+        merged.setdefault(patch['id'], {}).update(values)
+
+    # Permissions are checked once per board rather than once per note
+    existing = {row.id: row for row in db.session.execute(
+        select(Note.id, Note.board_id, Note.position_x, Note.position_y, Note.width, Note.height)
+        .where(Note.id.in_(merged))
+    )}
+    note_boards = {note_id: row.board_id for note_id, row in existing.items()}
+    editable_boards = editable_board_ids(current_user.id, set(note_boards.values()))
+
+    rows = []
+    failed = []
+    for note_id, values in merged.items():
+        if note_id not in note_boards:
+            failed.append({'id': note_id, 'error': 'Note not found'})
+        elif note_boards[note_id] not in editable_boards:
+            failed.append({'id': note_id, 'error': 'Unauthorized'})
+        elif values:
+            rows.append({'id': note_id, **values})
+
+    # One bulk UPDATE by primary key, committed as a single transaction.
+    # Bulk updates skip the ORM flush hooks, so rows are versioned here.
+    if rows:
+        versions = {board_id: bump_board_version(board_id) for board_id in {note_boards[row['id']] for row in rows}}
+        for row in rows:
+            row['version'] = versions[note_boards[row['id']]]
+        db.session.execute(update(Note), rows)
+        # ...and the spatial index hook, so moved notes are re-tiled here too
+        moved = [(row['id'], note_boards[row['id']], dict(existing[row['id']]._mapping, **row))
+                 for row in rows if any(field in row for field in GEOMETRY_FIELDS)]
+        reindex_notes(db.session.connection(), moved)
+        # ...and the search index, for edited text
+        reindex_note_content(db.session.connection(), [(row['id'], note_boards[row['id']], row['content'])
+                                                       for row in rows if 'content' in row])
+        db.session.commit()
+        count_writes('note', 'update', len(rows))
+
+        # Collaborators receive only the changed fields, grouped per board
+        board_rows = {}
+        for row in rows:
+            changes = {field: value for field, value in row.items() if field != 'version'}
+            board_rows.setdefault(note_boards[row['id']], []).append(changes)
+        for board_id, board_updates in board_rows.items():
+            publish_board_event(board_id, 'notes_updated', {'notes': board_updates})
+    return jsonify({'updated': [row['id'] for row in rows], 'failed': failed}), 200
+
 @app.route('/save_preferences', methods=['POST'])
 def save_preferences():
     if not current_user.is_authenticated:
@@ -298,13 +426,23 @@ def save_preferences():
         preferences.enable_email_notif_own = data['enableEmailNotifOwn']
         preferences.enable_email_notif_star = data['enableEmailNotifStar']
         preferences.privacy = data['privacy']
-        preferences.profile_picture = data['profilePicture']
+        profile_picture = data['profilePicture']
+        if profile_picture and profile_picture.startswith('data:image'):
+            # Inline uploads are thumbnailed once and referenced by URL from then on
+            set_profile_picture(preferences, profile_picture)
+        elif urlparse(profile_picture or '').path != preferences.profile_picture:
+            preferences.profile_picture = profile_picture
+            preferences.profile_thumbnail = None
+        renamed = preferences.username != data['username']
         preferences.username = data['username']
         preferences.light_dark_mode = data['lightDarkMode']
         preferences.note_colour = data['noteColour']
 
         db.session.add(preferences)
+        if renamed:
+            bump_reply_boards(user_id)
         db.session.commit()
+        invalidate_preferences(user_id)
         return jsonify({"message": "Preferences saved successfully"}), 200
     except Exception as e:
         print("Error:", e)  # Debugging
@@ -315,36 +453,17 @@ def get_preferences():
     if not current_user.is_authenticated:
         return jsonify({"message": "User not logged in"}), 401
 
-    user_id = current_user.id
-    preferences = UserPreferences.query.filter_by(user_id=user_id).first()
-    
-    # Create default preferences if not found
-    if not preferences:
-        preferences = UserPreferences(user_id=user_id)
-        db.session.add(preferences)
-        db.session.commit()
-
-    # Fix profile picture URL bug
-    profile_picture = preferences.profile_picture
-    if not profile_picture:
-        profile_picture = url_for('static', filename='images/default-avatar.jpg')
+    preferences = get_cached_preferences(current_user.id)
 
-    return jsonify({
-        'designTheme': preferences.designTheme,
-        'designBackColor': preferences.designBackColor,
-        'designSideBarColor': preferences.designSideBarColor,
-        'timezone': preferences.timezone,
-        'enableEmailNotif': preferences.enable_email_notif,
-        'enableEmailNotifReply': preferences.enable_email_notif_reply,
-        'enableEmailNotifBoard': preferences.enable_email_notif_board,
-        'enableEmailNotifOwn': preferences.enable_email_notif_own,
-        'enableEmailNotifStar': preferences.enable_email_notif_star,
-        'privacy': preferences.privacy,
-        'profilePicture': profile_picture,
-        'username': preferences.username,
-        'lightDarkMode': preferences.light_dark_mode,
-        'noteColour': preferences.note_colour
-    }), 200
+    # no-cache makes the browser revalidate each time, so unchanged preferences cost a 304
+    if request.if_none_match.contains_weak(preferences['etag']):
+        response = Response(status=304)
+    else:
+        response = jsonify(preferences['payload'])
+    response.set_etag(preferences['etag'])
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/notes/update/color/<int:note_id>', methods=['POST'])
 @login_required
@@ -359,21 +478,22 @@ def update_note_color(note_id):
     data = request.get_json()
     note.color = data.get('color', note.color)
     db.session.commit()
+    publish_board_event(note.board_id, 'notes_updated', {'notes': [{'id': note.id, 'color': note.color}]})
     return jsonify({"message": "Note color updated successfully"}), 200
 
+@app.route('/boards', methods=['GET'])
 @app.route('/boards/list', methods=['GET'])
 @login_required
 def list_boards():
-    boards = Board.query.filter_by(owner_id=current_user.id).all()
-    return render_template('notes.html', boards=boards)
+    # Owned and shared boards with note counts, for the sidebar
+    return jsonify(get_cached_board_list(current_user.id))
 
 @app.route('/boards/switch/<int:board_id>', methods=['POST'])
 @login_required
 def switch_board(board_id):
-    board = Board.query.get_or_404(board_id)
-    access = Access.query.filter_by(user_id=current_user.id, board_id=board_id).first()
-
-    if board.owner_id != current_user.id and not access:
+    if not has_board_permission(current_user.id, board_id):
+        if db.session.get(Board, board_id) is None:
+            abort(404)
         return jsonify({'success': False, 'message': 'No Access'}), 403
 
     session['active_board_id'] = board_id
@@ -407,12 +527,14 @@ def share_board():
         if access:
             db.session.delete(access)
             db.session.commit()
+            invalidate_board_permissions(user.id)
             print("Debug: Access revoked.")  # Debug 
             return jsonify({'success': True, 'message': 'Access revoked'}), 200
         else:
             new_access = Access(user_id=user.id, board_id=board_id, can_edit=True) 
             db.session.add(new_access)
             db.session.commit()
+            invalidate_board_permissions(user.id)
             print("Debug: Access granted.")  # Debug 
             return jsonify({'success': True, 'message': 'Access granted'}), 200
 
@@ -422,14 +544,36 @@ def share_board():
 
 @app.route('/boards/details/<int:board_id>', methods=['GET'])
 @login_required
+@board_access_required()
 def board_details(board_id):
-    board = Board.query.get_or_404(board_id)
-    access = Access.query.filter_by(user_id=current_user.id, board_id=board_id).first()
+    board = db.session.get(Board, board_id)
+    return conditional_json(f'board-{board.id}-{board.version}', board.updated_at,
+                            lambda: {'id': board.id, 'title': board.title})
 
-    if board.owner_id != current_user.id and not access:
-        return jsonify({"error": "Unauthorized"}), 403
-
-    return jsonify({'id': board.id, 'title': board.title})
+@app.route('/boards/<int:board_id>/events', methods=['GET'])
+@login_required
+@board_access_required()
+def board_events(board_id):
+    # Streams hold a worker thread each; beyond the cap the browser's periodic sync takes over
+    slots = get_stream_slots()
+    if not slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many live connections, try again later"})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    try:
+        subscription = get_broker().subscribe(board_id, request.headers.get('Last-Event-ID', type=int))
+    except Exception:
+        slots.release()
+        raise
+    # Don't hold a pooled connection open for the life of the stream
+    db.session.close()
+
+    stream = stream_events(subscription, current_app.config['EVENT_HEARTBEAT'], current_app.config['EVENT_STREAM_TIMEOUT'])
+    response = Response(stream_with_context(stream), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, whether or not the stream was read
+    response.call_on_close(slots.release)
+    return response
 
 @app.route('/create_board', methods=['POST'])
 @login_required
@@ -442,54 +586,143 @@ def create_board():
         new_board = Board(title=title, owner_id=current_user.id)
         db.session.add(new_board)
         db.session.commit()
+        invalidate_board_permissions(current_user.id)
         return jsonify({'success': True, 'board_id': new_board.id, 'title': new_board.title}), 201
     except Exception as e:
         db.session.rollback() 
         print("Error creating board:", str(e)) 
         return jsonify({'success': False, 'message': 'Failed to create the board', 'error': str(e)}), 500
 
+@app.route('/boards/<int:board_id>/clone', methods=['POST'])
+@login_required
+@board_access_required()
+def duplicate_board(board_id):
+    """Copy a board, or start a board from a template; 'template': true saves the copy as a template"""
+    data = request.get_json(silent=True) or {}
+    title = data.get('title') or f"Copy of {db.session.get(Board, board_id).title}"[:100]
+    if not isinstance(title, str) or not title.strip() or len(title) > 100:
+        return jsonify({"error": "title must be a non-empty string of at most 100 characters"}), 400
+
+    board, notes, replies = clone_board(board_id, current_user.id, title.strip(), bool(data.get('replies')),
+                                        bool(data.get('template')))
+    db.session.commit()
+    count_writes('note', 'create', notes)
+    count_writes('reply', 'create', replies)
+    invalidate_board_permissions(current_user.id)
+    return jsonify({'board_id': board.id, 'title': board.title, 'template': board.is_template,
+                    'notes': notes, 'replies': replies}), 201
+
+@app.route('/templates', methods=['GET'])
+@login_required
+def list_templates():
+    # Templates are few and rarely change, so unlike the board list they aren't cached
+    return jsonify(get_user_boards(current_user.id, templates=True))
+
 @app.route('/notes/get_by_board/<int:board_id>', methods=['GET'])
 @login_required
+@board_access_required()
 def get_notes_by_board(board_id):
-    board = Board.query.get(board_id)
-    access = Access.query.filter_by(user_id=current_user.id, board_id=board_id).first()
+    # The board version changes with every note change, so it validates the notes without loading them.
+    # It is read before the rows so a concurrent change is re-sent rather than missed.
+    version, updated_at = get_board_validators(board_id)
+    etag = f'board-{board_id}-{version}'
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        # Incremental sync: only notes changed after the client's board version, plus deletions
+        return conditional_json(etag, updated_at, lambda: {
+            'version': version,
+            'notes': [note_payload(note) for note in get_board_notes(board_id, since)],
+            'deleted': get_deleted_ids(board_id, 'note', since)
+        })
 
-    if board.owner_id != current_user.id and not access:
-        return jsonify({"error": "Unauthorized"}), 403
+    def notes_data():
+        notes = Note.query.filter_by(board_id=board_id).all()
+        return [{'id': note.id, 'content': note.content, 'color': note.color, 
+                 'position_x': note.position_x, 'position_y': note.position_y, 
+                 'width': note.width, 'height': note.height} for note in notes]
+    return conditional_json(etag, updated_at, notes_data)
 
-    notes = Note.query.filter_by(board_id=board_id).all()
-    notes_data = [{'id': note.id, 'content': note.content, 'color': note.color, 
-                   'position_x': note.position_x, 'position_y': note.position_y, 
-                   'width': note.width, 'height': note.height} for note in notes]
-    return jsonify(notes_data)
-
-@app.route('/debug/notes')
-def debug_notes():
-    notes = Note.query.all()  # Gets all notes
-    notes_data = [{'id': note.id, 'content': note.content, 'board_id': note.board_id} for note in notes]
-    return jsonify(notes_data) 
-@app.route('/debug/boards')
-def debug_boards():
-    boards = Board.query.all()  # Gets all boards
-    boards_data = [{'id': board.id, 'title': board.title, 'owner_id': board.owner_id} for board in boards]
-    return jsonify(boards_data)
-
-@app.route('/debug/user_boards')
+@app.route('/boards/<int:board_id>/export', methods=['GET'])
 @login_required
-def debug_user_boards():
-    users_data = []
-    users = User.query.all()
-    for user in users:
-        accessed_boards = Board.query.join(Access, Access.board_id == Board.id).filter(Access.user_id == user.id).all()
-        accessed_boards = [{'board_id': board.id, 'title': board.title, 'type': 'access_granted'} for board in accessed_boards]
-
-        users_data.append({
-            'user_id': user.id,
-            'username': user.email,
-            'boards': accessed_boards  # Only show boards where access has been granted
-        })
+@board_access_required()
+def export_board(board_id):
+    # Streamed from the cursor, so large boards are never held in memory
+    response = Response(stream_with_context(board_export_stream(board_id)), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=board-{board_id}.ndjson'
+    return response
+
+@app.route('/boards/<int:board_id>/import', methods=['POST'])
+@login_required
+@board_access_required(EDIT)
+def import_board_notes(board_id):
+    """Add the notes and replies of an exported board, uploaded as a 'file' field or as the raw NDJSON body"""
+    upload = request.files.get('file')
+    # request.stream is unbuffered, and reading it by line would fetch a byte at a time
+    lines = upload.stream if upload else io.BufferedReader(request.stream, 65536)
+    try:
+        notes, replies, version = import_board(board_id, current_user.id, lines)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    db.session.commit()
+    count_writes('note', 'create', notes)
+    count_writes('reply', 'create', replies)
+    invalidate_board_lists(board_id)
+    # Too many notes for one event; open boards fetch them with a sync instead
+    publish_board_event(board_id, 'notes_imported', {'version': version, 'notes': notes, 'replies': replies})
+    return jsonify({'notes': notes, 'replies': replies, 'version': version}), 200
+
+@app.route('/boards/<int:board_id>/notes/window', methods=['GET'])
+@login_required
+@board_access_required()
+def get_notes_in_viewport(board_id):
+    bounds = [request.args.get(name, type=int) for name in ('x0', 'y0', 'x1', 'y1')]
+    if None in bounds or bounds[2] <= bounds[0] or bounds[3] <= bounds[1]:
+        return jsonify({"error": "x0, y0, x1 and y1 must be integers with x0 < x1 and y0 < y1"}), 400
+    if window_too_large(*bounds):
+        return jsonify({"error": "Requested window is too large"}), 400
+
+    notes = get_notes_in_window(board_id, *bounds)
+    return jsonify({'notes': [note_payload(note) for note in notes]})
+
+@app.route('/search', methods=['GET'])
+@login_required
+def search():
+    limit = request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE'], type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if not 1 <= limit <= current_app.config['MAX_SEARCH_PAGE_SIZE'] or offset < 0:
+        return jsonify({"error": f"limit must be between 1 and {current_app.config['MAX_SEARCH_PAGE_SIZE']} and offset at least 0"}), 400
+
+    # Only boards the user owns or has been granted are searched
+    results, has_more = search_content(get_board_permissions(current_user.id), request.args.get('q', ''), limit, offset)
+    titles = {board['id']: board['title'] for board in get_cached_board_list(current_user.id)}
+    if any(result['board_id'] not in titles for result in results):
+        # Templates aren't in the board list
+        titles.update({board['id']: board['title'] for board in get_user_boards(current_user.id, templates=True)})
+    for result in results:
+        result['board_title'] = titles.get(result['board_id'])
+    return jsonify({'results': results, 'next_offset': offset + limit if has_more else None})
+
+@app.route('/admin/export/<dataset>', methods=['GET'])
+@admin_required
+def admin_export(dataset):
+    """Stream notes, boards or user_boards as NDJSON (default) or CSV, paged by ?after=<id>&limit=<n>"""
+    if dataset not in DATASETS:
+        return jsonify({"error": f"Unknown export, expected one of {', '.join(DATASETS)}"}), 404
+    export_format = request.args.get('format', 'ndjson')
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', 0, type=int)
+    if export_format not in ('ndjson', 'csv') or after < 0 or limit < 0:
+        return jsonify({"error": "format must be ndjson or csv, and after and limit non-negative integers"}), 400
+
+    # Rows are read and written as they stream, so memory use doesn't grow with the table
+    stream = export_stream(dataset, export_format, after, limit or None)
+    response = Response(stream_with_context(stream),
+                        mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename={dataset}.{export_format}'
+    return response
 
-    return jsonify(users_data)
 @app.route('/notes/<int:note_id>/add_reply', methods=['POST'])
 @login_required
 def add_reply(note_id):
@@ -498,12 +731,43 @@ def add_reply(note_id):
     reply = Reply(content=data['content'], user_id=current_user.id, note_id=note.id)
     db.session.add(reply)
     db.session.commit()
-    return jsonify(reply.to_dict()), 201
+    # Reload with the author eagerly loaded rather than refreshing each relationship lazily
+    reply = get_reply(reply.id)
+    reply_data = reply.to_dict()
+    publish_board_event(note.board_id, 'reply_added', reply_data)
+    return jsonify(reply_data), 201
 
 @app.route('/notes/<int:note_id>/replies', methods=['GET'])
+@login_required
 def get_replies(note_id):
-    replies = Reply.query.filter_by(note_id=note_id).all()
-    return jsonify([reply.to_dict() for reply in replies])
+    validators = get_note_validators(note_id)
+    if validators is None:
+        abort(404)
+    if validators.user_id != current_user.id and not has_board_permission(current_user.id, validators.board_id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        return jsonify({
+            'version': validators.version,
+            'replies': [reply.to_dict() for reply in get_note_replies(note_id, since)],
+            # Reply tombstones are kept per board; ids from other notes are simply not found
+            'deleted': get_deleted_ids(validators.board_id, 'reply', since)
+        })
+
+    limit = request.args.get('limit', current_app.config['REPLY_PAGE_SIZE'], type=int)
+    if not 1 <= limit <= current_app.config['MAX_REPLY_PAGE_SIZE']:
+        return jsonify({"error": f"limit must be between 1 and {current_app.config['MAX_REPLY_PAGE_SIZE']}"}), 400
+    page = get_reply_page(note_id, limit, request.args.get('before', type=int))
+    if page is None:
+        return jsonify({"error": "Unknown reply cursor"}), 400
+
+    # 'before' is the cursor for the next older page, or null at the start of the thread
+    replies, has_older = page
+    return jsonify({
+        'replies': [reply.to_dict() for reply in replies],
+        'before': replies[0].id if has_older else None
+    })
 
 # Add this temporary route - REMOVE AFTER USING ONCE
 @app.route('/admin/reset_db/<secret_key>')
@@ -541,6 +805,7 @@ def update_preferences():
             db.session.add(user_prefs)
         
         # Update fields from the request
+        renamed = 'username' in data and user_prefs.username != data['username']
         if 'username' in data:
             user_prefs.username = data['username']
         
@@ -559,59 +824,67 @@ def update_preferences():
                 if base64_size > 5000000:  # ~5MB limit
                     return jsonify({'success': False, 'message': 'Image too large. Please use a smaller image.'}), 400
                 
-                user_prefs.profile_picture = data['profile_picture']
+                try:
+                    set_profile_picture(user_prefs, data['profile_picture'])
+                except ValueError as e:
+                    db.session.rollback()
+                    return jsonify({'success': False, 'message': str(e)}), 400
         
+        # Replies show the username, and note ETags come from their board's version
+        if renamed:
+            bump_reply_boards(current_user.id)
         # Save changes
         db.session.commit()
+        invalidate_preferences(current_user.id)
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error updating preferences: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/avatars/<avatar_hash>', methods=['GET'])
+def get_avatar(avatar_hash):
+    # Avatars are content-addressed, so a matching ETag is answered without touching the database
+    if avatar_hash in request.if_none_match:
+        return not_modified_response(avatar_hash)
+
+    avatar = Avatar.query.get_or_404(avatar_hash)
+    return avatar_response(avatar)
+
 @app.route('/notes/<int:note_id>', methods=['GET'])
 @login_required
 def get_note(note_id):
-    note = Note.query.get_or_404(note_id)
+    validators = get_note_validators(note_id)
+    if validators is None:
+        abort(404)
     
     # Check if user has access to this note
-    if note.user_id != current_user.id:
-        # Check if the note is on a board the user has access to
-        access = Access.query.filter_by(user_id=current_user.id, board_id=note.board_id).first()
-        if not access and note.board.owner_id != current_user.id:
-            return jsonify({"error": "Unauthorized"}), 403
-    
-    # Get user info for the note
-    user = User.query.get(note.user_id)
-    user_prefs = UserPreferences.query.filter_by(user_id=user.id).first()
+    if validators.user_id != current_user.id and not has_board_permission(current_user.id, validators.board_id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    # Replies, and renames by anyone who replied, bump the board version too; the author's name
+    # and photo come from their preferences
+    author_etag = get_cached_preferences(validators.user_id)['etag'][:8]
+    etag = f'note-{note_id}-{validators.version}-{author_etag}'
+    return conditional_json(etag, validators.updated_at, lambda: note_detail(note_id))
+
+def note_detail(note_id):
+    # Note, author and author preferences come back in one query
+    note = get_note_with_author(note_id)
     
-    # Get replies
-    replies = Reply.query.filter_by(note_id=note.id).all()
+    # Get the newest page of replies along with their authors in a second query
+    replies, has_older = get_reply_page(note.id, current_app.config['REPLY_PAGE_SIZE'])
     replies_data = []
-    
     for reply in replies:
-        reply_user = User.query.get(reply.user_id)
-        reply_user_prefs = UserPreferences.query.filter_by(user_id=reply_user.id).first()
+        reply_user_prefs = reply.user.preferences
         
         replies_data.append({
             'id': reply.id,
             'content': reply.content,
             'timestamp': reply.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'username': reply_user_prefs.username if reply_user_prefs else reply_user.email
+            'username': reply_user_prefs.username if reply_user_prefs else reply.user.email
         })
     
     # Return complete note data
-    return jsonify({
-        'id': note.id,
-        'content': note.content,
-        'color': note.color,
-        'position_x': note.position_x,
-        'position_y': note.position_y,
-        'width': note.width,
-        'height': note.height,
-        'created_at': note.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        'user_id': note.user_id,
-        'user_name': user_prefs.username if user_prefs else user.email,
-        'user_photo': user_prefs.profile_picture if user_prefs and user_prefs.profile_picture else '/static/images/default-avatar.jpg',
-        'replies': replies_data
-    })
+    return dict(note_payload(note), replies=replies_data,
+                replies_before=replies[0].id if has_older else None)
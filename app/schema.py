@@ -0,0 +1,70 @@
+# app/schema.py
+import os
+import re
+import sys
+import click
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from . import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations', 'versions')
+
+REVISION = re.compile(r"^revision = ['\"](\w+)['\"]", re.MULTILINE)
+DOWN_REVISION = re.compile(r"^down_revision = ['\"](\w+)['\"]", re.MULTILINE)
+
+
+def head_revisions(directory=MIGRATIONS_DIR):
+    """The revisions no migration builds on, read from the migration files' identifier lines.
+
+    Alembic would find the same by importing every migration, but it takes longer to import
+    than the rest of the app does to start.
+    """
+    revisions, parents = set(), set()
+    for name in os.listdir(directory):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(directory, name), encoding='utf-8') as file:
+            source = file.read()
+        revisions.update(REVISION.findall(source))
+        parents.update(DOWN_REVISION.findall(source))
+    return revisions - parents
+
+
+def database_revisions():
+    """The revisions the database was last migrated to, in one query"""
+    return {row[0] for row in db.session.execute(text('SELECT version_num FROM alembic_version'))}
+
+
+def check_revision():
+    """Log an error if the database is not at the migrations' head. Returns whether it is."""
+    expected = head_revisions()
+    try:
+        found = database_revisions()
+    except SQLAlchemyError as e:
+        # No alembic_version table yet, or the database is unreachable; requests will retry it
+        current_app.logger.error(f"Could not read the schema revision, run 'flask db upgrade': {e}")
+        return False
+    if found != expected:
+        current_app.logger.error(f"Database is at revision {', '.join(sorted(found)) or 'none'} but the code "
+                                 f"expects {', '.join(sorted(expected))}; run 'flask db upgrade'")
+        return False
+    return True
+
+
+def running_migrations():
+    # Flask creates the app while it looks up the db group, before click has parsed past it
+    return click.get_current_context(silent=True) is not None and 'db' in sys.argv[1:]
+
+
+def prepare_schema(app):
+    """Ready the database as SCHEMA_MODE says (see config.py)"""
+    mode = app.config['SCHEMA_MODE']
+    # Under "flask db ..." the migrations are in charge; tables made here would break "upgrade"
+    if running_migrations():
+        return
+    with app.app_context():
+        if mode == 'create':
+            db.create_all()
+        elif mode == 'check':
+            check_revision()
@@ -0,0 +1,245 @@
+# app/search.py
+import re
+from sqlalchemy import bindparam, event, inspect, select, text
+from . import db
+from .models import Note, Reply
+
+MAX_TERMS = 8  # Words of a query that are matched; the rest are ignored
+
+# Notes and replies share one index, keyed by id * 2 + kind so either can be found by key
+NOTE, REPLY = 0, 1
+KINDS = {NOTE: 'note', REPLY: 'reply'}
+
+
+def search_key(kind, object_id):
+    return object_id * 2 + kind
+
+
+class SqliteSearch:
+    """FTS5 table ranked by bm25, keyed by rowid.
+
+    The board is also indexed as a token in board_tag, so the match intersects the query's
+    posting lists with the user's boards instead of ranking every match and filtering after.
+    """
+
+    key = 'rowid'
+
+    def create(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "content, board_tag, board_id UNINDEXED, note_id UNINDEXED, tokenize='porter unicode61')"
+        ))
+
+    def drop(self, connection):
+        connection.execute(text("DROP TABLE IF EXISTS search_index"))
+
+    def insert(self, connection, rows):
+        connection.execute(text(
+            "INSERT INTO search_index (rowid, board_id, note_id, content, board_tag) "
+            "VALUES (:key, :board_id, :note_id, :content, 'b' || :board_id)"
+        ), rows)
+
+    def insert_from(self, connection, select_sql):
+        connection.execute(text(
+            "INSERT INTO search_index (rowid, board_id, note_id, content, board_tag) "
+            f"SELECT key, board_id, note_id, content, 'b' || board_id FROM ({select_sql})"
+        ))
+
+    def match(self, terms, board_ids):
+        # Each word quoted so user input can't use FTS5 syntax; the last one matches as a prefix
+        words = ' '.join(f'"{term}"' for term in terms) + '*'
+        boards = ' OR '.join(f'b{int(board_id)}' for board_id in board_ids)
+        return f'content : ({words}) AND board_tag : ({boards})'
+
+    def query(self, connection, terms, board_ids, limit, offset):
+        # bm25 weights: content 1, board_tag 0, so boards don't affect the ranking
+        statement = text(
+            "SELECT rowid AS key, board_id, note_id, content FROM search_index "
+            "WHERE search_index MATCH :match "
+            "ORDER BY bm25(search_index, 1.0, 0.0), rowid LIMIT :limit OFFSET :offset"
+        )
+        return connection.execute(statement, {'match': self.match(terms, board_ids),
+                                              'limit': limit, 'offset': offset}).all()
+
+
+class PostgresSearch:
+    """Table with a generated tsvector column under a GIN index, ranked by ts_rank"""
+
+    key = 'id'
+
+    def create(self, connection):
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS search_index ("
+            "id BIGINT PRIMARY KEY, board_id INTEGER NOT NULL, note_id INTEGER NOT NULL, content TEXT NOT NULL, "
+            "document tsvector GENERATED ALWAYS AS (to_tsvector('english', content)) STORED)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)"
+        ))
+
+    def drop(self, connection):
+        connection.execute(text("DROP TABLE IF EXISTS search_index"))
+
+    def insert(self, connection, rows):
+        connection.execute(text(
+            "INSERT INTO search_index (id, board_id, note_id, content) VALUES (:key, :board_id, :note_id, :content)"
+        ), rows)
+
+    def insert_from(self, connection, select_sql):
+        connection.execute(text(
+            f"INSERT INTO search_index (id, board_id, note_id, content) "
+            f"SELECT key, board_id, note_id, content FROM ({select_sql}) AS documents"
+        ))
+
+    def match(self, terms):
+        return ' & '.join(terms) + ':*'
+
+    def query(self, connection, terms, board_ids, limit, offset):
+        statement = text(
+            "SELECT id AS key, board_id, note_id, content FROM search_index, to_tsquery('english', :match) AS query "
+            "WHERE document @@ query AND board_id IN :board_ids "
+            "ORDER BY ts_rank(document, query) DESC, id LIMIT :limit OFFSET :offset"
+        ).bindparams(bindparam('board_ids', expanding=True))
+        return connection.execute(statement, {'match': self.match(terms), 'board_ids': list(board_ids),
+                                              'limit': limit, 'offset': offset}).all()
+
+
+SEARCH_BACKENDS = {
+    'sqlite': SqliteSearch(),
+    'postgresql': PostgresSearch(),
+}
+
+
+def search_backend(connection):
+    return SEARCH_BACKENDS.get(connection.dialect.name)
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    # Created alongside the model tables by create_all; migrations create it for deployed databases
+    backend = search_backend(connection)
+    if backend is not None:
+        backend.create(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_index(target, connection, **kw):
+    backend = search_backend(connection)
+    if backend is not None:
+        backend.drop(connection)
+
+
+def unindex(connection, keys):
+    backend = search_backend(connection)
+    if backend is None or not keys:
+        return
+    statement = text(f"DELETE FROM search_index WHERE {backend.key} IN :keys").bindparams(
+        bindparam('keys', expanding=True))
+    connection.execute(statement, {'keys': list(keys)})
+
+
+def reindex(connection, documents):
+    """Replace the index entries of (kind, object_id, board_id, note_id, content) documents"""
+    backend = search_backend(connection)
+    if backend is None or not documents:
+        return
+    rows = [{'key': search_key(kind, object_id), 'board_id': board_id, 'note_id': note_id, 'content': content}
+            for kind, object_id, board_id, note_id, content in documents]
+    unindex(connection, [row['key'] for row in rows])
+    backend.insert(connection, rows)
+
+
+# Index rows for notes and replies, as read by insert_from
+NOTE_DOCUMENTS = f"SELECT id * 2 + {NOTE} AS key, board_id, id AS note_id, content FROM note"
+REPLY_DOCUMENTS = (
+    f"SELECT reply.id * 2 + {REPLY} AS key, note.board_id AS board_id, reply.note_id AS note_id, "
+    "reply.content AS content FROM reply JOIN note ON note.id = reply.note_id"
+)
+
+
+def rebuild_search_index(connection):
+    """Index every note and reply from scratch, with INSERT ... SELECT"""
+    backend = search_backend(connection)
+    if backend is None:
+        return
+    connection.execute(text("DELETE FROM search_index"))
+    backend.insert_from(connection, NOTE_DOCUMENTS)
+    backend.insert_from(connection, REPLY_DOCUMENTS)
+
+
+def index_board_version(connection, board_id, version):
+    """Index the notes and replies written to a board at one version, which must not be indexed yet"""
+    backend = search_backend(connection)
+    if backend is None:
+        return
+    board_id, version = int(board_id), int(version)
+    backend.insert_from(connection, f"{NOTE_DOCUMENTS} WHERE board_id = {board_id} AND version = {version}")
+    backend.insert_from(connection, f"{REPLY_DOCUMENTS} WHERE note.board_id = {board_id} AND reply.version = {version}")
+
+
+def reindex_note_content(connection, notes):
+    """Reindex (note_id, board_id, content) notes"""
+    reindex(connection, [(NOTE, note_id, board_id, note_id, content) for note_id, board_id, content in notes])
+
+
+def move_replies(connection, note_boards):
+    """Reindex the replies of notes that moved to another board, given {note_id: board_id}"""
+    if not note_boards:
+        return
+    replies = connection.execute(
+        select(Reply.id, Reply.note_id, Reply.content).where(Reply.note_id.in_(note_boards))
+    ).all()
+    reindex(connection, [(REPLY, reply.id, note_boards[reply.note_id], reply.note_id, reply.content)
+                         for reply in replies])
+
+
+def changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(db.session, 'after_flush')
+def index_search_content(session, flush_context):
+    """Keep search_index in step with notes and replies written through the ORM"""
+    notes = [note for note in session.new if isinstance(note, Note)]
+    notes += [note for note in session.dirty if isinstance(note, Note) and changed(note, ('content', 'board_id'))]
+    moved = {note.id: note.board_id for note in session.dirty if isinstance(note, Note) and changed(note, ('board_id',))}
+    replies = [reply for reply in session.new if isinstance(reply, Reply)]
+    replies += [reply for reply in session.dirty if isinstance(reply, Reply) and changed(reply, ('content', 'note_id'))]
+    deleted_notes = [note.id for note in session.deleted if isinstance(note, Note)]
+    deleted = [search_key(NOTE, note_id) for note_id in deleted_notes]
+    deleted += [search_key(REPLY, reply.id) for reply in session.deleted if isinstance(reply, Reply)]
+    if not (notes or replies or deleted):
+        return
+
+    # Core statements on the flush's connection, since ORM statements here would autoflush
+    connection = session.connection()
+    if deleted_notes:
+        deleted += [search_key(REPLY, reply_id) for reply_id in connection.execute(
+            select(Reply.id).where(Reply.note_id.in_(deleted_notes))).scalars()]
+    unindex(connection, deleted)
+    reindex_note_content(connection, [(note.id, note.board_id, note.content) for note in notes])
+    move_replies(connection, moved)
+    if replies:
+        boards = dict(connection.execute(
+            select(Note.id, Note.board_id).where(Note.id.in_({reply.note_id for reply in replies}))).all())
+        reindex(connection, [(REPLY, reply.id, boards.get(reply.note_id), reply.note_id, reply.content)
+                             for reply in replies if reply.note_id in boards])
+
+
+def search_content(board_ids, q, limit, offset):
+    """Ranked notes and replies matching q on the given boards, and whether more follow"""
+    terms = re.findall(r'\w+', q.lower())[:MAX_TERMS]
+    backend = search_backend(db.session.connection())
+    if not terms or not board_ids or backend is None:
+        return [], False
+    # One extra row tells us whether there is another page
+    rows = backend.query(db.session.connection(), terms, board_ids, limit + 1, offset)
+    results = [{
+        'kind': KINDS[row.key % 2],
+        'id': row.key // 2,
+        'note_id': row.note_id,
+        'board_id': row.board_id,
+        'content': row.content,
+    } for row in rows[:limit]]
+    return results, len(rows) > limit
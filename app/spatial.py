@@ -0,0 +1,128 @@
+# app/spatial.py
+from sqlalchemy import and_, delete, event, func, insert, inspect, select
+from sqlalchemy.orm import joinedload
+from . import db
+from .models import Note, NoteTile, User
+
+TILE_SIZE = 512  # Board pixels per grid bucket side
+MAX_WINDOW_TILES = 1024  # Largest viewport, in tiles, a single request may ask for
+MAX_GEOMETRY = 2 ** 31 - 1  # Geometry columns are 32-bit integers
+MAX_NOTE_SIZE = 8192  # Widest or tallest note, in pixels; a note covers at most 17x17 tiles
+
+# Notes saved without geometry are drawn at these values by notes.js
+DEFAULT_GEOMETRY = {'position_x': 100, 'position_y': 100, 'width': 250, 'height': 200}
+GEOMETRY_FIELDS = tuple(DEFAULT_GEOMETRY)
+
+note_tile = NoteTile.__table__
+
+
+def geometry(values):
+    """Note rectangle as whole-pixel (x, y, width, height), filling in the client's defaults"""
+    rectangle = []
+    for field in GEOMETRY_FIELDS:
+        try:
+            rectangle.append(int(values.get(field)))
+        except (TypeError, ValueError):
+            rectangle.append(DEFAULT_GEOMETRY[field])
+    return tuple(rectangle)
+
+
+def geometry_error(values):
+    """Why the geometry in values can't be stored, or None; missing and null fields keep their defaults"""
+    for field in GEOMETRY_FIELDS:
+        value = values.get(field)
+        if value is None:
+            continue
+        lowest, highest = (0, MAX_NOTE_SIZE) if field in ('width', 'height') else (-MAX_GEOMETRY, MAX_GEOMETRY)
+        if not isinstance(value, int) or isinstance(value, bool) or not lowest <= value <= highest:
+            return f'{field} must be an integer from {lowest} to {highest}'
+    return None
+
+
+def tile_range(x0, y0, x1, y1):
+    """Inclusive tile coordinates covering the rectangle from (x0, y0) to (x1, y1)"""
+    return x0 // TILE_SIZE, y0 // TILE_SIZE, max(x1 - 1, x0) // TILE_SIZE, max(y1 - 1, y0) // TILE_SIZE
+
+
+def note_tiles(note_id, board_id, values):
+    x, y, width, height = geometry(values)
+    # Sizes are checked on the way in (geometry_error); rows stored before that are tiled at the
+    # largest size, so one note can never produce more than (MAX_NOTE_SIZE / TILE_SIZE + 1) ** 2 tiles
+    width, height = (min(max(side, 1), MAX_NOTE_SIZE) for side in (width, height))
+    tx0, ty0, tx1, ty1 = tile_range(x, y, x + width, y + height)
+    return [{'note_id': note_id, 'board_id': board_id, 'tile_x': tx, 'tile_y': ty}
+            for tx in range(tx0, tx1 + 1) for ty in range(ty0, ty1 + 1)]
+
+
+def index_notes(connection, notes):
+    """Add the tiles of each (note_id, board_id, geometry dict), for notes that have none yet"""
+    if not notes:
+        return
+    tiles = [tile for note_id, board_id, values in notes for tile in note_tiles(note_id, board_id, values)]
+    connection.execute(insert(note_tile), tiles)
+
+
+def reindex_notes(connection, notes):
+    """Replace the tiles of each (note_id, board_id, geometry dict) with ones matching its geometry"""
+    if not notes:
+        return
+    connection.execute(delete(note_tile).where(note_tile.c.note_id.in_([note_id for note_id, _, _ in notes])))
+    index_notes(connection, notes)
+
+
+def unindex_notes(connection, note_ids):
+    if note_ids:
+        connection.execute(delete(note_tile).where(note_tile.c.note_id.in_(note_ids)))
+
+
+def geometry_changed(note):
+    state = inspect(note)
+    return any(state.attrs[field].history.has_changes() for field in GEOMETRY_FIELDS + ('board_id',))
+
+
+@event.listens_for(db.session, 'before_flush')
+def unindex_deleted_notes(session, flush_context, instances):
+    """Drop the tiles of notes deleted through the ORM before their rows go, since tiles reference them"""
+    deleted = [note.id for note in session.deleted if isinstance(note, Note)]
+    if deleted:
+        unindex_notes(session.connection(), deleted)
+
+
+@event.listens_for(db.session, 'after_flush')
+def index_note_geometry(session, flush_context):
+    """Keep note_tile in step with notes created, moved or resized through the ORM"""
+    changed = [note for note in session.new if isinstance(note, Note)]
+    changed += [note for note in session.dirty if isinstance(note, Note) and geometry_changed(note)]
+    if not changed:
+        return
+
+    # Core statements on the flush's connection, since ORM statements here would autoflush
+    reindex_notes(session.connection(), [(note.id, note.board_id, {field: getattr(note, field) for field in GEOMETRY_FIELDS})
+                                         for note in changed])
+
+
+def get_notes_in_window(board_id, x0, y0, x1, y1):
+    """Notes on the board whose rectangles intersect the window, found through their tiles"""
+    tx0, ty0, tx1, ty1 = tile_range(x0, y0, x1, y1)
+    in_window = (
+        select(NoteTile.note_id)
+        .where(NoteTile.board_id == board_id,
+               NoteTile.tile_x.between(tx0, tx1),
+               NoteTile.tile_y.between(ty0, ty1))
+        .distinct()
+    )
+    x = func.coalesce(Note.position_x, DEFAULT_GEOMETRY['position_x'])
+    y = func.coalesce(Note.position_y, DEFAULT_GEOMETRY['position_y'])
+    width = func.coalesce(Note.width, DEFAULT_GEOMETRY['width'])
+    height = func.coalesce(Note.height, DEFAULT_GEOMETRY['height'])
+    return (Note.query
+            .options(joinedload(Note.user).joinedload(User.preferences))
+            .filter(Note.id.in_(in_window),
+                    # Tiles are coarse, so trim to notes that really intersect
+                    and_(x < x1, x + width > x0, y < y1, y + height > y0))
+            .all())
+
+
+def window_too_large(x0, y0, x1, y1):
+    tx0, ty0, tx1, ty1 = tile_range(x0, y0, x1, y1)
+    return (tx1 - tx0 + 1) * (ty1 - ty0 + 1) > MAX_WINDOW_TILES
@@ -1,5 +1,9 @@
 let userPreferences = {};
 
+// Identifies this tab so it can ignore board events caused by its own requests
+const clientId =
+  Math.random().toString(36).slice(2) + Date.now().toString(36);
+
 // Fetch user preferences
 function fetchUserPreferences() {
   fetch("/get_preferences")
@@ -31,7 +35,8 @@ function createStickyNote() {
   headerBackground.classList.add("sticky-note-header-background");
 
   const profileImage = document.createElement("img");
-  profileImage.src = userPreferences.profilePicture || "default-avatar.jpg"; // Use the user's profile picture
+  profileImage.src =
+    userPreferences.profileThumbnail || "/static/images/default-avatar.jpg"; // Use the user's note-sized profile picture
   profileImage.alt = "Profile Photo";
   profileImage.classList.add("sticky-note-profile-picture");
 
@@ -91,6 +96,7 @@ function saveNote(content, color, noteElement) {
     headers: {
       "Content-Type": "application/x-www-form-urlencoded",
       "X-CSRF-Token": csrfToken,
+      "X-Client-Id": clientId,
     },
     body: `content=${encodeURIComponent(content)}&color=${encodeURIComponent(
       color
@@ -125,7 +131,7 @@ function saveNote(content, color, noteElement) {
 
 // New function to fetch and replace a note with a fully rendered version
 function fetchAndReplaceNote(noteId, currentElement) {
-  fetch(`/notes/${noteId}`)
+  fetch(`/notes/${noteId}`, { cache: "no-cache" })
     .then((response) => {
       if (!response.ok) {
         throw new Error("Failed to fetch complete note");
@@ -348,55 +354,20 @@ document.addEventListener("DOMContentLoaded", function () {
 });
 
 function updateNoteDetails(noteId, details) {
-  const csrfToken = document.querySelector('meta[name="csrf-token"]').content;
-  fetch(`/notes/update/${noteId}`, {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json",
-      "X-CSRF-Token": csrfToken,
-    },
-    body: JSON.stringify(details),
-  })
-    .then((response) => {
-      if (!response.ok) throw new Error("Failed to update note");
-      return response.json();
-    })
-    .then((data) => {
-      console.log("Note updated successfully", data);
-      const noteElement = document.querySelector(
-        `.sticky-note[data-id="${noteId}"]`
-      );
-      if (noteElement) {
-        noteElement.querySelector(".sticky-note-content").textContent =
-          details.content;
-        noteElement.style.backgroundColor = details.color;
-      }
-    })
-    .catch((error) => {
-      console.error("Error updating note:", error);
-    });
+  const noteElement = document.querySelector(
+    `.sticky-note[data-id="${noteId}"]`
+  );
+  if (noteElement) {
+    noteElement.querySelector(".sticky-note-content").textContent =
+      details.content;
+    noteElement.style.backgroundColor = details.color;
+  }
+  queueNoteUpdate(noteId, details);
 }
 
 function updateNoteColor(noteId, newColor) {
-  const csrfToken = document.querySelector('meta[name="csrf-token"]').content;
-  fetch(`/notes/update/color/${noteId}`, {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json",
-      "X-CSRF-Token": csrfToken,
-    },
-    body: JSON.stringify({ color: newColor }),
-  })
-    .then((response) => {
-      if (!response.ok) throw new Error("Failed to update color");
-      return response.json();
-    })
-    .then((data) => {
-      console.log("Color updated", data);
-    })
-    .catch((error) => {
-      console.error("Error updating color:", error);
-    });
+  // The colour picker fires on every input event, so changes are coalesced
+  queueNoteUpdate(noteId, { color: newColor });
 }
 
 // Function to add a reply to a sticky note
@@ -668,6 +639,58 @@ document.querySelectorAll(".auth-nav .auth-toggle-btn").forEach((button) => {
   }
 })();
 
+// Pending note changes, merged per note and sent together to /notes/batch_update
+const pendingNoteUpdates = new Map();
+const NOTE_UPDATE_DELAY = 400; // ms to wait for further changes before saving
+const NOTE_UPDATE_BATCH_SIZE = 500; // matches MAX_BATCH_SIZE on the server
+let noteUpdateTimer = null;
+
+function queueNoteUpdate(noteId, changes) {
+  const id = parseInt(noteId, 10);
+  const pending = pendingNoteUpdates.get(id) || { id: id };
+  pendingNoteUpdates.set(id, Object.assign(pending, changes));
+
+  clearTimeout(noteUpdateTimer);
+  noteUpdateTimer = setTimeout(flushNoteUpdates, NOTE_UPDATE_DELAY);
+}
+
+function flushNoteUpdates(keepalive = false) {
+  clearTimeout(noteUpdateTimer);
+  if (pendingNoteUpdates.size === 0) return;
+
+  const updates = Array.from(pendingNoteUpdates.values());
+  pendingNoteUpdates.clear();
+
+  for (let i = 0; i < updates.length; i += NOTE_UPDATE_BATCH_SIZE) {
+    fetch("/notes/batch_update", {
+      method: "POST",
+      keepalive: keepalive,
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRF-Token": document.querySelector('meta[name="csrf-token"]')
+          .content,
+        "X-Client-Id": clientId,
+      },
+      body: JSON.stringify({
+        notes: updates.slice(i, i + NOTE_UPDATE_BATCH_SIZE),
+      }),
+    })
+      .then((response) => {
+        if (!response.ok) throw new Error("Failed to save notes.");
+        return response.json();
+      })
+      .then((data) => {
+        if (data.failed.length > 0) {
+          console.error("Some notes were not saved:", data.failed);
+        }
+      })
+      .catch((error) => console.error("Error updating notes:", error));
+  }
+}
+
+// Send anything still pending when the user leaves the page
+window.addEventListener("pagehide", () => flushNoteUpdates(true));
+
 function saveNotePositionAndSize(note) {
   const id = note.dataset.id;
   if (!id) {
@@ -676,25 +699,12 @@ function saveNotePositionAndSize(note) {
   }
   const rect = note.getBoundingClientRect();
 
-  fetch(`/notes/update/${id}`, {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json",
-      "X-CSRF-Token": document.querySelector('meta[name="csrf-token"]').content,
-    },
-    body: JSON.stringify({
-      position_x: rect.left - 32,
-      position_y: rect.top - 130,
-      width: rect.width,
-      height: rect.height,
-    }),
-  })
-    .then((response) => {
-      if (!response.ok) throw new Error("Failed to save note.");
-      return response.json();
-    })
-    .then((data) => console.log("Update successful", data))
-    .catch((error) => console.error("Error updating note:", error));
+  queueNoteUpdate(id, {
+    position_x: Math.round(rect.left - 32),
+    position_y: Math.round(rect.top - 130),
+    width: Math.round(rect.width),
+    height: Math.round(rect.height),
+  });
 }
 function createNoteElement(note) {
   const noteElement = document.createElement("div");
@@ -765,7 +775,8 @@ document.addEventListener("DOMContentLoaded", function () {
 function fetchNotesForBoard(boardId) {
   console.log("Fetching notes for board ID:", boardId); // Debug
 
-  fetch(`/notes/get_by_board/${boardId}`)
+  // no-cache revalidates with the stored ETag, so an unchanged board costs a 304
+  fetch(`/notes/get_by_board/${boardId}`, { cache: "no-cache" })
     .then((response) => response.json())
     .then((notes) => {
       const boardElement = document.getElementById("board");
@@ -833,7 +844,7 @@ document
   });
 
 function updateBoardList() {
-  fetch("/boards/list")
+  fetch("/boards")
     .then((response) => response.json())
     .then((data) => {
       const boardsContainer = document.getElementById("boards-container");
@@ -842,6 +853,7 @@ function updateBoardList() {
         const boardLink = document.createElement("a");
         boardLink.className = "navbar-board";
         boardLink.textContent = board.title;
+        boardLink.title = `${board.note_count} notes`;
         boardLink.href = "#";
         boardLink.onclick = () => switchBoard(board.id);
         boardsContainer.appendChild(boardLink);
@@ -905,15 +917,40 @@ function grantAccess(username) {
     .catch((error) => console.error("Error granting access:", error));
 }
 
+// Replies arrive a page at a time, newest first; older pages load on request
+function loadReplies(noteId, before) {
+  const params = before ? `?before=${before}` : "";
+  fetch(`/notes/${noteId}/replies${params}`)
+    .then((response) => response.json())
+    .then((data) => {
+      const noteElement = document.querySelector(`#note${noteId}`);
+      if (!noteElement) return;
+      const repliesContainer = noteElement.querySelector(".replies-container");
+      // An older page goes above the replies already shown
+      const firstReply = repliesContainer.querySelector(".reply");
+      data.replies.forEach((reply) => {
+        repliesContainer.insertBefore(createReplyElement(reply), firstReply);
+      });
+      setOlderRepliesButton(noteId, repliesContainer, data.before);
+    })
+    .catch((error) => console.error("Error loading replies:", error));
+}
+
+function setOlderRepliesButton(noteId, repliesContainer, before) {
+  const existing = repliesContainer.querySelector(".load-older-replies");
+  if (existing) existing.remove();
+  if (!before) return;
+
+  const button = document.createElement("button");
+  button.className = "load-older-replies";
+  button.textContent = "Load older replies";
+  button.onclick = () => loadReplies(noteId, before);
+  repliesContainer.prepend(button);
+}
+
 document.addEventListener("DOMContentLoaded", function () {
   document.querySelectorAll(".sticky-note").forEach((note) => {
-    const noteId = note.dataset.id;
-    fetch(`/notes/${noteId}/replies`)
-      .then((response) => response.json())
-      .then((replies) => {
-        replies.forEach((reply) => displayReply(reply, noteId));
-      })
-      .catch((error) => console.error("Error loading replies:", error));
+    loadReplies(note.dataset.id);
   });
 });
 
@@ -928,6 +965,7 @@ function addReply(button, noteId) {
     headers: {
       "Content-Type": "application/json",
       "X-CSRF-Token": document.querySelector('meta[name="csrf-token"]').content,
+      "X-Client-Id": clientId,
     },
     body: JSON.stringify(data),
   })
@@ -939,12 +977,183 @@ function addReply(button, noteId) {
     .catch((error) => console.error("Error adding reply:", error));
 }
 
-function displayReply(reply, noteId) {
-  const noteElement = document.querySelector(`#note${noteId}`);
-  const repliesContainer = noteElement.querySelector(".replies-container");
+function createReplyElement(reply) {
   const replyDiv = document.createElement("div");
   replyDiv.className = "reply";
   replyDiv.innerHTML = `<strong>${reply.username}</strong>: ${reply.content}
                           <div class="reply-timestamp">${reply.timestamp}</div>`;
-  repliesContainer.appendChild(replyDiv);
+  return replyDiv;
+}
+
+function displayReply(reply, noteId) {
+  const noteElement = document.querySelector(`#note${noteId}`);
+  if (!noteElement) return;
+  const repliesContainer = noteElement.querySelector(".replies-container");
+  repliesContainer.appendChild(createReplyElement(reply));
+}
+
+// Apply the changed fields of a note pushed by another client
+function applyNoteChanges(changes) {
+  const noteElement = document.getElementById(`note${changes.id}`);
+  if (!noteElement) return;
+
+  if ("position_x" in changes) noteElement.style.left = `${changes.position_x}px`;
+  if ("position_y" in changes) noteElement.style.top = `${changes.position_y}px`;
+  if ("width" in changes) noteElement.style.width = `${changes.width}px`;
+  if ("height" in changes) noteElement.style.height = `${changes.height}px`;
+  if ("color" in changes) {
+    noteElement.style.backgroundColor = changes.color;
+    const colorPicker = noteElement.querySelector(".note-color-picker");
+    if (colorPicker) colorPicker.value = changes.color;
+  }
+  if ("content" in changes) {
+    noteElement.querySelector(".sticky-note-content").textContent =
+      changes.content;
+  }
+}
+
+// Board version the page is up to date with; see syncBoard
+let boardVersion = 0;
+const BOARD_SYNC_INTERVAL = 60000; // ms between catch-up syncs while the tab is visible
+
+// Fetch only the notes changed since boardVersion, plus deletions
+function syncBoard(boardId) {
+  fetch(`/notes/get_by_board/${boardId}?since=${boardVersion}`, { cache: "no-cache" })
+    .then((response) => {
+      if (!response.ok) throw new Error("Failed to sync board");
+      return response.json();
+    })
+    .then((data) => {
+      data.notes.forEach((note) => {
+        if (document.getElementById(`note${note.id}`)) {
+          applyNoteChanges(note);
+        } else {
+          document
+            .getElementById("board")
+            .appendChild(createCompleteNoteElement(note));
+        }
+      });
+      data.deleted.forEach((noteId) => {
+        const noteElement = document.getElementById(`note${noteId}`);
+        if (noteElement) noteElement.remove();
+      });
+      boardVersion = Math.max(boardVersion, data.version);
+    })
+    .catch((error) => console.error("Error syncing board:", error));
 }
+
+// Live updates from collaborators on the active board
+document.addEventListener("DOMContentLoaded", function () {
+  const boardId = document.body.getAttribute("board-id");
+  if (!boardId || boardId === "none") return;
+  boardVersion = parseInt(document.body.getAttribute("board-version"), 10) || 0;
+
+  // Catch up on anything missed while disconnected or hidden
+  setInterval(function () {
+    if (document.visibilityState === "visible") syncBoard(boardId);
+  }, BOARD_SYNC_INTERVAL);
+  if (!window.EventSource) return;
+
+  const boardEvents = new EventSource(`/boards/${boardId}/events`);
+  boardEvents.addEventListener("open", () => syncBoard(boardId));
+  const fromThisTab = (data) => data.origin === clientId;
+
+  boardEvents.addEventListener("note_added", function (e) {
+    const note = JSON.parse(e.data);
+    if (fromThisTab(note) || document.getElementById(`note${note.id}`)) return;
+    document.getElementById("board").appendChild(createCompleteNoteElement(note));
+  });
+
+  boardEvents.addEventListener("notes_updated", function (e) {
+    const data = JSON.parse(e.data);
+    if (fromThisTab(data)) return;
+    data.notes.forEach(applyNoteChanges);
+  });
+
+  boardEvents.addEventListener("note_deleted", function (e) {
+    const data = JSON.parse(e.data);
+    const noteElement = document.getElementById(`note${data.id}`);
+    if (noteElement) noteElement.remove();
+  });
+
+  boardEvents.addEventListener("notes_imported", () => syncBoard(boardId));
+
+  boardEvents.addEventListener("reply_added", function (e) {
+    const reply = JSON.parse(e.data);
+    if (fromThisTab(reply)) return;
+    displayReply(reply, reply.note_id);
+  });
+});
+
+// Tile-by-tile loading for boards too large to render at once (see spatial.py)
+const NOTE_TILE_SIZE = 512; // matches TILE_SIZE on the server
+const loadedNoteTiles = new Set();
+
+function loadVisibleNotes(boardId) {
+  const board = document.getElementById("board");
+  const rect = board.getBoundingClientRect();
+
+  // Viewport in board coordinates, padded by a tile so notes are ready before they scroll in
+  const tx0 = Math.floor((-rect.left - NOTE_TILE_SIZE) / NOTE_TILE_SIZE);
+  const ty0 = Math.floor((-rect.top - NOTE_TILE_SIZE) / NOTE_TILE_SIZE);
+  const tx1 = Math.floor((window.innerWidth - rect.left + NOTE_TILE_SIZE) / NOTE_TILE_SIZE);
+  const ty1 = Math.floor((window.innerHeight - rect.top + NOTE_TILE_SIZE) / NOTE_TILE_SIZE);
+
+  // Request the bounding box of the tiles not loaded yet
+  const missing = [];
+  let mx0 = Infinity, my0 = Infinity, mx1 = -Infinity, my1 = -Infinity;
+  for (let tx = tx0; tx <= tx1; tx++) {
+    for (let ty = ty0; ty <= ty1; ty++) {
+      const key = `${tx},${ty}`;
+      if (loadedNoteTiles.has(key)) continue;
+      missing.push(key);
+      mx0 = Math.min(mx0, tx);
+      my0 = Math.min(my0, ty);
+      mx1 = Math.max(mx1, tx);
+      my1 = Math.max(my1, ty);
+    }
+  }
+  if (missing.length === 0) return;
+  missing.forEach((key) => loadedNoteTiles.add(key));
+
+  const params = new URLSearchParams({
+    x0: mx0 * NOTE_TILE_SIZE,
+    y0: my0 * NOTE_TILE_SIZE,
+    x1: (mx1 + 1) * NOTE_TILE_SIZE,
+    y1: (my1 + 1) * NOTE_TILE_SIZE,
+  });
+  fetch(`/boards/${boardId}/notes/window?${params}`)
+    .then((response) => {
+      if (!response.ok) throw new Error("Failed to load notes");
+      return response.json();
+    })
+    .then((data) => {
+      data.notes.forEach((note) => {
+        if (document.getElementById(`note${note.id}`)) return;
+        board.appendChild(createCompleteNoteElement(note));
+        loadReplies(note.id);
+      });
+    })
+    .catch((error) => {
+      missing.forEach((key) => loadedNoteTiles.delete(key));
+      console.error("Error loading notes:", error);
+    });
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+  const boardId = document.body.getAttribute("board-id");
+  if (document.body.getAttribute("windowed") !== "true") return;
+
+  let scheduled = false;
+  const onViewportChange = () => {
+    if (scheduled) return;
+    scheduled = true;
+    setTimeout(() => {
+      scheduled = false;
+      loadVisibleNotes(boardId);
+    }, 150);
+  };
+  window.addEventListener("scroll", onViewportChange, { passive: true });
+  window.addEventListener("resize", onViewportChange);
+  loadVisibleNotes(boardId);
+});
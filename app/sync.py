@@ -0,0 +1,87 @@
+# app/sync.py
+from datetime import datetime
+from sqlalchemy import event, inspect, select, update
+from . import db
+from .models import Board, Note, Reply, Tombstone
+
+
+def bump_board_version(board_id):
+    """Increment and return the board's version.
+
+    The UPDATE locks the board row until commit, so concurrent writers to one board get
+    versions in commit order and a client holding version N has seen every change up to N.
+    """
+    db.session.execute(update(Board).where(Board.id == board_id).values(version=Board.version + 1, updated_at=datetime.now()))
+    return db.session.execute(select(Board.version).where(Board.id == board_id)).scalar()
+
+
+def bump_reply_boards(user_id):
+    """Bump every board the user has replied on, so note ETags change when the name on their replies does"""
+    boards = select(Note.board_id).join(Reply, Reply.note_id == Note.id).where(Reply.user_id == user_id).distinct()
+    db.session.execute(update(Board).where(Board.id.in_(boards)).values(version=Board.version + 1, updated_at=datetime.now()))
+
+
+def adjust_note_count(board_id, delta):
+    db.session.execute(update(Board).where(Board.id == board_id).values(note_count=Board.note_count + delta))
+
+
+def note_count_changes(session):
+    """Net change in each board's note count from the notes added, deleted or moved in this flush"""
+    deltas = {}
+    def add(board_id, delta):
+        if board_id is not None:
+            deltas[board_id] = deltas.get(board_id, 0) + delta
+
+    for note in session.new:
+        if isinstance(note, Note):
+            add(note.board_id, 1)
+    for note in session.deleted:
+        if isinstance(note, Note):
+            add(note.board_id, -1)
+    for note in session.dirty:
+        if isinstance(note, Note):
+            history = inspect(note).attrs.board_id.history
+            if history.deleted and history.added:
+                add(history.deleted[0], -1)
+                add(history.added[0], 1)
+    return {board_id: delta for board_id, delta in deltas.items() if delta}
+
+
+def board_id_for(session, obj):
+    if isinstance(obj, Note):
+        return obj.board_id
+    note = session.get(Note, obj.note_id)
+    return note.board_id if note else None
+
+
+@event.listens_for(db.session, 'before_flush')
+def version_changes(session, flush_context, instances):
+    """Stamp new and edited notes/replies with their board's next version, tombstone deletions
+    and keep board note counts current"""
+    with session.no_autoflush:
+        for board_id, delta in note_count_changes(session).items():
+            adjust_note_count(board_id, delta)
+
+        changed = [obj for obj in session.new if isinstance(obj, (Note, Reply))]
+        changed += [obj for obj in session.dirty
+                    if isinstance(obj, (Note, Reply)) and session.is_modified(obj, include_collections=False)]
+        deleted = [obj for obj in session.deleted if isinstance(obj, (Note, Reply))]
+        if not changed and not deleted:
+            return
+
+        # One version per board per flush
+        versions = {}
+        def version_for(board_id):
+            if board_id not in versions:
+                versions[board_id] = bump_board_version(board_id)
+            return versions[board_id]
+
+        for obj in changed:
+            board_id = board_id_for(session, obj)
+            if board_id is not None:
+                obj.version = version_for(board_id)
+        for obj in deleted:
+            board_id = board_id_for(session, obj)
+            if board_id is not None:
+                kind = 'note' if isinstance(obj, Note) else 'reply'
+                session.add(Tombstone(board_id=board_id, kind=kind, object_id=obj.id, version=version_for(board_id)))
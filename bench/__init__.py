@@ -0,0 +1,2 @@
+# bench/__init__.py
+# Standalone performance scripts, run with `python -m bench.<script>`
@@ -0,0 +1,58 @@
+# bench/board_transfer.py
+"""Time importing and exporting a large board through /boards/<id>/import and /boards/<id>/export.
+
+Usage: python -m bench.board_transfer [--notes 100000] [--replies 20000]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from app import create_app, db
+from app.models import Note, Reply
+from bench.load import PASSWORD, login_form, make_load_config, seed, sentence
+
+
+def board_file(note_count, reply_count):
+    """An export-format NDJSON board with random notes and replies"""
+    lines = [json.dumps({'type': 'board', 'format': 1, 'title': 'Imported'})]
+    for i in range(1, note_count + 1):
+        lines.append(json.dumps({'type': 'note', 'id': i, 'content': sentence(random.randint(3, 20)), 'color': '#7785cc',
+                                 'position_x': random.randint(0, 20000), 'position_y': random.randint(0, 20000),
+                                 'width': 250, 'height': 200}))
+    for _ in range(reply_count):
+        lines.append(json.dumps({'type': 'reply', 'note_id': random.randint(1, note_count), 'content': sentence(8)}))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=100000)
+    parser.add_argument('--replies', type=int, default=20000)
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(make_load_config(os.path.join(directory, 'bench.db')))
+        with app.app_context():
+            seed(app, 1, 1, 0, 0, 0, 0)
+        client = app.test_client()
+        client.post('/', data=login_form({'email': 'user1@example.com', 'password': PASSWORD}))
+        data = board_file(args.notes, args.replies)
+
+        start = time.perf_counter()
+        response = client.post('/boards/1/import', data=data, content_type='application/x-ndjson')
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 200, response.json
+        print(f'Imported {args.notes} notes and {args.replies} replies ({len(data) / 1e6:.1f} MB) in {elapsed:.1f}s')
+
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in client.get('/boards/1/export', buffered=False).response)
+        print(f'Exported {size / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s')
+        with app.app_context():
+            assert db.session.query(Note).count() == args.notes and db.session.query(Reply).count() == args.replies
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# bench/clone.py
+"""Time POST /boards/<id>/clone on boards of increasing size; the time per 10k notes should stay roughly flat.
+
+Usage: python -m bench.clone [--sizes 10000 50000 100000] [--replies 0.2]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from app import create_app
+from bench.board_transfer import board_file
+from bench.load import PASSWORD, login_form, make_load_config, seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--replies', type=float, default=0.2, help='Replies per note')
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(make_load_config(os.path.join(directory, 'bench.db')))
+        with app.app_context():
+            seed(app, 1, len(args.sizes), 0, 0, 0, 0)
+        client = app.test_client()
+        client.post('/', data=login_form({'email': 'user1@example.com', 'password': PASSWORD}))
+
+        print(f"{'notes':>8} {'replies':>8} {'clone':>9} {'per 10k':>9}")
+        for board_id, size in enumerate(args.sizes, 1):
+            reply_count = int(size * args.replies)
+            response = client.post(f'/boards/{board_id}/import', data=board_file(size, reply_count),
+                                   content_type='application/x-ndjson')
+            assert response.status_code == 200, response.json
+
+            start = time.perf_counter()
+            response = client.post(f'/boards/{board_id}/clone', json={'replies': True})
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 201, response.json
+            assert (response.json['notes'], response.json['replies']) == (size, reply_count)
+            print(f'{size:>8} {reply_count:>8} {elapsed * 1000:>7.0f}ms {elapsed * 1000 * 10000 / size:>7.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# bench/index_lookups.py
+"""Time the hot foreign-key lookups on a seeded database with and without the model indexes.
+
+Usage: python -m bench.index_lookups [--notes 1000000] [--repeat 200]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import insert, select
+from app import create_app, db
+from app.config import Config
+from app.models import User, UserPreferences, Board, Access, Note, Reply
+
+
+def make_config(path):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    return BenchConfig
+
+
+def seed(note_count, user_count, board_count, batch_size=50000):
+    """Bulk insert users, boards, access grants, notes and replies with executemany batches"""
+    db.session.execute(insert(User), [{'email': f'user{i}@example.com', 'password': 'x'} for i in range(1, user_count + 1)])
+    db.session.execute(insert(UserPreferences), [{'user_id': i, 'username': f'user{i}'} for i in range(1, user_count + 1)])
+    db.session.execute(insert(Board), [{'title': f'Board {i}', 'owner_id': random.randint(1, user_count)} for i in range(1, board_count + 1)])
+    grants = {(random.randint(1, user_count), random.randint(1, board_count)) for _ in range(board_count * 3)}
+    db.session.execute(insert(Access), [{'user_id': u, 'board_id': b, 'can_edit': True} for u, b in grants])
+
+    for start in range(0, note_count, batch_size):
+        db.session.execute(insert(Note), [
+            {'content': f'note {i}', 'user_id': random.randint(1, user_count), 'board_id': random.randint(1, board_count),
+             'color': '#ffffff', 'position_x': 0, 'position_y': 0, 'width': 250, 'height': 200}
+            for i in range(start, min(start + batch_size, note_count))
+        ])
+    reply_count = note_count // 10
+    for start in range(0, reply_count, batch_size):
+        db.session.execute(insert(Reply), [
+            {'content': f'reply {i}', 'user_id': random.randint(1, user_count), 'note_id': random.randint(1, note_count)}
+            for i in range(start, min(start + batch_size, reply_count))
+        ])
+    db.session.commit()
+
+
+def lookups(note_count, user_count, board_count):
+    """The filters used by notes(), get_notes_by_board, switch_board, get_note and get_replies"""
+    return {
+        'notes by board': lambda: select(Note.id).where(Note.board_id == random.randint(1, board_count)),
+        'notes by user': lambda: select(Note.id).where(Note.user_id == random.randint(1, user_count)),
+        'access by user+board': lambda: select(Access.id).where(Access.user_id == random.randint(1, user_count),
+                                                                Access.board_id == random.randint(1, board_count)),
+        'access by board': lambda: select(Access.id).where(Access.board_id == random.randint(1, board_count)),
+        'replies by note': lambda: select(Reply.id).where(Reply.note_id == random.randint(1, note_count)),
+        'newest reply page': lambda: (select(Reply.id).where(Reply.note_id == random.randint(1, note_count))
+                                      .order_by(Reply.created_at.desc(), Reply.id.desc()).limit(50)),
+        'preferences by user': lambda: select(UserPreferences.id).where(UserPreferences.user_id == random.randint(1, user_count)),
+        'boards by owner': lambda: select(Board.id).where(Board.owner_id == random.randint(1, user_count)),
+    }
+
+
+def time_lookups(queries, repeat):
+    results = {}
+    for name, make_query in queries.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            db.session.execute(make_query()).all()
+        results[name] = (time.perf_counter() - start) / repeat * 1000
+    return results
+
+
+def set_indexes(create):
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True) if create else index.drop(connection, checkfirst=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--boards', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(make_config(os.path.join(directory, 'bench.db')))
+        with app.app_context():
+            start = time.perf_counter()
+            set_indexes(False)
+            seed(args.notes, args.users, args.boards)
+            print(f'Seeded {args.notes} notes in {time.perf_counter() - start:.1f}s')
+
+            queries = lookups(args.notes, args.users, args.boards)
+            before = time_lookups(queries, args.repeat)
+            set_indexes(True)
+            after = time_lookups(queries, args.repeat)
+
+            print(f'{"lookup":<24}{"no index (ms)":>16}{"indexed (ms)":>16}{"speedup":>10}')
+            for name in queries:
+                print(f'{name:<24}{before[name]:>16.3f}{after[name]:>16.3f}{before[name] / after[name]:>9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
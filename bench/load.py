@@ -0,0 +1,344 @@
+# bench/load.py
+"""Seed a realistic dataset and load-test the main routes in-process and over HTTP.
+
+Usage: python -m bench.load [--users 200] [--boards 400] [--notes 20000] [--requests 500] [--concurrency 8]
+                            [--save results.json] [--baseline results.json] [--tolerance 0.2]
+
+Each route is measured twice: through the Flask test client one request at a time, counting
+the SQL statements per request, and through a threaded local HTTP server driven by
+--concurrency clients, which reads the counts from the Server-Timing header. With --baseline the run fails if a route's p95 latency grows by more
+than --tolerance or it issues more statements than the saved run.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from io import BytesIO
+from PIL import Image
+from sqlalchemy import event, select
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+from app import create_app, db
+from app.avatars import set_profile_picture
+from app.models import User, UserPreferences, Board, Access, Note, Reply
+from bench.index_lookups import make_config
+from bench.search import WORDS
+
+PASSWORD = 'benchpassword'
+PERCENTILES = (50, 95, 99)
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def login_form(s):
+    return {'email': s['email'], 'password': PASSWORD, 'login': 'Sign In'}
+
+
+def make_load_config(path):
+    class LoadConfig(make_config(path)):
+        # Plain-HTTP clients without a CSRF token
+        WTF_CSRF_ENABLED = False
+        SESSION_COOKIE_SECURE = False
+    return LoadConfig
+
+
+def avatar_data_urls(count):
+    """Distinct solid-colour PNGs as data URLs, like profile picture uploads"""
+    urls = []
+    for _ in range(count):
+        buffer = BytesIO()
+        Image.new('RGB', (256, 256), tuple(random.randrange(256) for _ in range(3))).save(buffer, 'PNG')
+        urls.append('data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode())
+    return urls
+
+
+def sentence(count):
+    return ' '.join(random.choices(WORDS, k=count)).capitalize()
+
+
+def seed(app, user_count, board_count, note_count, replies_per_note, shares_per_board, avatar_share, batch_size=2000):
+    """Create the dataset through the models, so the flush hooks maintain versions, counts and indexes"""
+    password = generate_password_hash(PASSWORD)  # Hashed once; every user shares it
+    users = [User(email=f'user{i}@example.com', password=password) for i in range(1, user_count + 1)]
+    db.session.add_all(users)
+    db.session.flush()
+
+    # Avatars are stored through the upload path so notes carry real /avatars/ URLs
+    avatars = avatar_data_urls(20)
+    with app.test_request_context():
+        for user in users:
+            preferences = UserPreferences(user_id=user.id, username=f'User {user.id}')
+            if random.random() < avatar_share:
+                set_profile_picture(preferences, random.choice(avatars))
+            db.session.add(preferences)
+        db.session.flush()
+
+    # Every user owns at least one board, so logging in never has to create one
+    boards = [Board(title=f'Board {i}', owner_id=users[i % user_count].id) for i in range(max(board_count, user_count))]
+    db.session.add_all(boards)
+    db.session.flush()
+    members = {board.id: [board.owner_id] for board in boards}
+    for board in boards:
+        grantees = random.sample(users, min(shares_per_board, user_count))
+        for user in grantees:
+            if user.id not in members[board.id]:
+                db.session.add(Access(user_id=user.id, board_id=board.id, can_edit=random.random() < 0.7))
+                members[board.id].append(user.id)
+    db.session.commit()
+
+    board_ids = list(members)
+    for start in range(0, note_count, batch_size):
+        for _ in range(start, min(start + batch_size, note_count)):
+            board_id = random.choice(board_ids)
+            db.session.add(Note(content=sentence(random.randint(3, 20)), user_id=random.choice(members[board_id]),
+                                board_id=board_id, color=random.choice(['#ffffff', '#7785cc', '#f4d35e']),
+                                position_x=random.randint(0, 3000), position_y=random.randint(0, 2000),
+                                width=250, height=200))
+        db.session.commit()
+
+    notes = db.session.execute(select(Note.id, Note.board_id)).all()
+    reply_count = int(note_count * replies_per_note)
+    for start in range(0, reply_count, batch_size):
+        for _ in range(start, min(start + batch_size, reply_count)):
+            note = random.choice(notes)
+            db.session.add(Reply(content=sentence(random.randint(2, 12)), user_id=random.choice(members[note.board_id]),
+                                 note_id=note.id))
+        db.session.commit()
+
+
+def load_sessions(count):
+    """The boards and notes each of `count` users can read and edit, for picking request targets"""
+    sessions = []
+    for user_id in random.sample(range(1, db.session.query(User).count() + 1), count):
+        readable = set(db.session.execute(select(Board.id).where(Board.owner_id == user_id)).scalars())
+        editable = set(readable)
+        for board_id, can_edit in db.session.execute(select(Access.board_id, Access.can_edit).where(Access.user_id == user_id)):
+            readable.add(board_id)
+            if can_edit:
+                editable.add(board_id)
+        notes = db.session.execute(select(Note.id, Note.board_id).where(Note.board_id.in_(readable))).all()
+        sessions.append({
+            'email': f'user{user_id}@example.com',
+            'boards': sorted(readable),
+            'notes': [note.id for note in notes] or [0],
+            'editable_notes': [note.id for note in notes if note.board_id in editable] or [0],
+        })
+    return sessions
+
+
+# Each scenario turns a session into (method, path, JSON body)
+SCENARIOS = {
+    'GET /notes': lambda s: ('GET', '/notes', None),
+    'GET /notes/get_by_board': lambda s: ('GET', f'/notes/get_by_board/{random.choice(s["boards"])}', None),
+    'POST /notes/update': lambda s: ('POST', f'/notes/update/{random.choice(s["editable_notes"])}',
+                                     {'position_x': random.randint(0, 3000), 'position_y': random.randint(0, 2000)}),
+    'GET /notes/<id>': lambda s: ('GET', f'/notes/{random.choice(s["notes"])}', None),
+    'POST /add_reply': lambda s: ('POST', f'/notes/{random.choice(s["notes"])}/add_reply', {'content': sentence(8)}),
+}
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values"""
+    return values[max(0, min(len(values) - 1, int(len(values) * p / 100 + 0.5) - 1))]
+
+
+def summarise(latencies, elapsed, errors, statements=None):
+    latencies = sorted(latencies)
+    result = {f'p{p}': percentile(latencies, p) * 1000 for p in PERCENTILES}
+    result.update(rps=len(latencies) / elapsed, errors=errors)
+    if statements is not None:
+        result['sql'] = sum(statements) / len(statements)
+        result['sql_max'] = max(statements)
+    return result
+
+
+def run_in_process(app, sessions, requests, warmup):
+    """One request at a time through the test client, counting SQL statements per request"""
+    clients = []
+    for s in sessions:
+        client = app.test_client()
+        if not client.post('/', data=login_form(s)).location.endswith('/notes'):
+            raise RuntimeError(f'Could not log in as {s["email"]}')
+        clients.append((client, s))
+
+    counter = {'statements': 0}
+    def count(*args):
+        counter['statements'] += 1
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+
+    results = {}
+    try:
+        for name, scenario in SCENARIOS.items():
+            def send():
+                client, s = random.choice(clients)
+                method, path, body = scenario(s)
+                counter['statements'] = 0
+                return client.open(path, method=method, json=body)
+
+            for _ in range(warmup):
+                send()
+            latencies, statements, errors = [], [], 0
+            start = time.perf_counter()
+            for _ in range(requests):
+                began = time.perf_counter()
+                response = send()
+                latencies.append(time.perf_counter() - began)
+                statements.append(counter['statements'])
+                errors += response.status_code >= 300  # Redirects mean the session was lost
+            results[name] = summarise(latencies, time.perf_counter() - start, errors, statements)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return results
+
+
+class HttpSession:
+    """A logged-in browser: a cookie jar and an opener for it"""
+
+    def __init__(self, base_url, s):
+        self.base_url = base_url
+        self.session = s
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        with self.opener.open(base_url + '/', urllib.parse.urlencode(login_form(s)).encode()) as response:
+            response.read()
+            if not response.url.endswith('/notes'):
+                raise RuntimeError(f'Could not log in as {s["email"]}')
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                # Being redirected (to the login page) counts as a failure
+                status = response.status if response.url == request.full_url else 302
+                return status, server_timing_queries(response.headers)
+        except urllib.error.HTTPError as error:
+            return error.code, server_timing_queries(error.headers)
+
+
+def server_timing_queries(headers):
+    """The statement count the app reports in its Server-Timing header (see app/instrumentation.py)"""
+    match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing', ''))
+    return int(match.group(1)) if match else None
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def run_http(app, sessions, requests, warmup, concurrency):
+    """--concurrency clients sending requests to a threaded server on a local port"""
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    results = {}
+    try:
+        clients = [HttpSession(base_url, s) for s in sessions]
+        def send(scenario):
+            client = random.choice(clients)
+            began = time.perf_counter()
+            status, queries = client.request(*scenario(client.session))
+            return time.perf_counter() - began, status, queries
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            for name, scenario in SCENARIOS.items():
+                list(pool.map(send, [scenario] * warmup))
+                start = time.perf_counter()
+                outcomes = list(pool.map(send, [scenario] * requests))
+                elapsed = time.perf_counter() - start
+                statements = [queries for _, _, queries in outcomes]
+                results[name] = summarise([latency for latency, _, _ in outcomes], elapsed,
+                                          sum(status >= 300 for _, status, _ in outcomes),
+                                          None if None in statements else statements)
+    finally:
+        server.shutdown()
+    return results
+
+
+def print_results(title, results):
+    print(f'\n{title}')
+    print(f'{"endpoint":<26}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>9}{"sql":>7}{"errors":>8}')
+    for name, r in results.items():
+        sql = f'{r["sql"]:.1f}' if 'sql' in r else '-'
+        print(f'{name:<26}{r["p50"]:>9.2f}{r["p95"]:>9.2f}{r["p99"]:>9.2f}{r["rps"]:>9.0f}{sql:>7}{r["errors"]:>8}')
+
+
+def regressions(results, baseline, tolerance):
+    """Routes whose p95 grew beyond the tolerance, or whose SQL count grew at all, since the baseline"""
+    found = []
+    for mode, routes in results.items():
+        for name, r in routes.items():
+            before = baseline.get(mode, {}).get(name)
+            if before is None:
+                continue
+            if r['p95'] > before['p95'] * (1 + tolerance):
+                found.append(f'{mode} {name}: p95 {before["p95"]:.2f} -> {r["p95"]:.2f} ms')
+            if 'sql' in r and r['sql_max'] > before['sql_max']:
+                found.append(f'{mode} {name}: up to {before["sql_max"]} -> {r["sql_max"]} statements')
+            if r['errors'] > before['errors']:
+                found.append(f'{mode} {name}: {before["errors"]} -> {r["errors"]} errors')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--boards', type=int, default=400)
+    parser.add_argument('--notes', type=int, default=20000)
+    parser.add_argument('--replies-per-note', type=float, default=1.0)
+    parser.add_argument('--shares-per-board', type=int, default=3)
+    parser.add_argument('--avatar-share', type=float, default=0.5, help='fraction of users with a profile picture')
+    parser.add_argument('--sessions', type=int, default=20, help='logged-in users sending requests')
+    parser.add_argument('--requests', type=int, default=500, help='measured requests per route and mode')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='fail on regressions against this saved JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(make_load_config(os.path.join(directory, 'bench.db')))
+        with app.app_context():
+            start = time.perf_counter()
+            seed(app, args.users, args.boards, args.notes, args.replies_per_note, args.shares_per_board, args.avatar_share)
+            print(f'Seeded {args.users} users, {args.boards} boards and {args.notes} notes in {time.perf_counter() - start:.1f}s')
+            sessions = load_sessions(min(args.sessions, args.users))
+
+        results = {
+            'in-process': run_in_process(app, sessions, args.requests, args.warmup),
+            'http': run_http(app, sessions, args.requests, args.warmup, args.concurrency),
+        }
+    print_results('Test client, one request at a time', results['in-process'])
+    print_results(f'HTTP, {args.concurrency} concurrent clients', results['http'])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# bench/login.py
+"""Login throughput, and what a burst of logins does to note requests running alongside it.
+
+Usage: python -m bench.login [--logins 200] [--concurrency 16] [--workers 2] [--queue 16]
+
+Run with --workers 32, one gunicorn process's default GUNICORN_THREADS, to see hashing as it was
+before the pool: every request thread of the process free to hash at once.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from werkzeug.serving import make_server
+from app import create_app
+from app.models import User
+from bench.load import HttpSession, QuietRequestHandler, login_form, make_load_config, percentile, seed
+
+
+def log_in(base_url, email):
+    """Sign in with a fresh cookie jar, returning (seconds, status)"""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    start = time.perf_counter()
+    try:
+        with opener.open(base_url + '/', urllib.parse.urlencode(login_form({'email': email})).encode()) as response:
+            response.read()
+            status = 200 if response.url.endswith('/notes') else 401
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return time.perf_counter() - start, status
+
+
+def note_traffic(clients, stop):
+    """Board fetches from logged-in users until stop is set, returning their latencies"""
+    latencies = []
+    while not stop.is_set():
+        client = random.choice(clients)
+        start = time.perf_counter()
+        client.request('GET', '/boards/list', None)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16, help='Clients logging in at once')
+    parser.add_argument('--workers', type=int, default=2, help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--queue', type=int, default=16, help='PASSWORD_HASH_QUEUE')
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        class Config(make_load_config(os.path.join(directory, 'bench.db'))):
+            PASSWORD_HASH_WORKERS = args.workers
+            PASSWORD_HASH_QUEUE = args.queue
+        app = create_app(Config)
+        with app.app_context():
+            seed(app, args.users, args.users, 0, 0, 0, 0)
+            emails = [user.email for user in User.query.all()]
+
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            clients = [HttpSession(base_url, {'email': email}) for email in emails[:4]]
+
+            stop = threading.Event()
+            with ThreadPoolExecutor(2) as pool:
+                quiet = [pool.submit(note_traffic, clients, stop) for _ in range(2)]
+                time.sleep(2)
+                stop.set()
+            quiet = sorted(latency for future in quiet for latency in future.result())
+
+            stop = threading.Event()
+            with ThreadPoolExecutor(2) as pool:
+                busy = [pool.submit(note_traffic, clients, stop) for _ in range(2)]
+                start = time.perf_counter()
+                with ThreadPoolExecutor(args.concurrency) as logins:
+                    outcomes = list(logins.map(lambda email: log_in(base_url, email),
+                                               random.choices(emails, k=args.logins)))
+                elapsed = time.perf_counter() - start
+                stop.set()
+            busy = sorted(latency for future in busy for latency in future.result())
+        finally:
+            server.shutdown()
+
+    signed_in = sorted(latency for latency, status in outcomes if status == 200)
+    turned_away = sum(status == 503 for _, status in outcomes)
+    print(f'hash workers {args.workers}, queue {args.queue}, {args.concurrency} clients logging in')
+    print(f'logins: {len(signed_in)} in {elapsed:.1f}s ({len(signed_in) / elapsed:.1f}/s), '
+          f'p50 {percentile(signed_in, 50) * 1000:.0f}ms, p95 {percentile(signed_in, 95) * 1000:.0f}ms, '
+          f'{turned_away} turned away (503), {len(outcomes) - len(signed_in) - turned_away} failed')
+    print(f'board list p95: {percentile(quiet, 95) * 1000:.1f}ms alone, {percentile(busy, 95) * 1000:.1f}ms during logins')
+
+
+if __name__ == '__main__':
+    main()
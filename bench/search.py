@@ -0,0 +1,72 @@
+# bench/search.py
+"""Time /search queries against a seeded full-text index.
+
+Usage: python -m bench.search [--notes 1000000] [--vocabulary 2000] [--repeat 100]
+
+Note text is drawn uniformly from --vocabulary words, so each query word appears in roughly
+8 / vocabulary of all notes; a small vocabulary shows the cost of very common words.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from app import create_app, db
+from app.permissions import load_board_permissions
+from app.search import rebuild_search_index, search_content
+from bench.index_lookups import make_config, seed
+
+WORDS = ['meeting', 'deadline', 'review', 'budget', 'design', 'launch', 'bug', 'client', 'draft', 'sprint',
+         'invoice', 'roadmap', 'hiring', 'release', 'feedback', 'research', 'demo', 'backlog', 'retro', 'plan']
+
+
+def vocabulary(size):
+    """WORDS padded out with made-up words to the given size"""
+    words = list(WORDS)
+    while len(words) < size:
+        words.append(''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=random.randint(4, 9))))
+    return words
+
+
+def word_content(count, words):
+    """Replace the seeded note and reply text with random words so queries have controlled hit rates"""
+    for table in ('note', 'reply'):
+        ids = [row[0] for row in db.session.execute(db.text(f'SELECT id FROM {table}'))]
+        db.session.execute(db.text(f'UPDATE {table} SET content = :content WHERE id = :id'), [
+            {'id': i, 'content': ' '.join(random.choices(words, k=count))} for i in ids
+        ])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--boards', type=int, default=20000)
+    parser.add_argument('--vocabulary', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(make_config(os.path.join(directory, 'bench.db')))
+        with app.app_context():
+            seed(args.notes, args.users, args.boards)
+            word_content(8, vocabulary(max(args.vocabulary, len(WORDS))))
+            start = time.perf_counter()
+            rebuild_search_index(db.session.connection())
+            db.session.commit()
+            print(f'Indexed {args.notes} notes in {time.perf_counter() - start:.1f}s')
+
+            queries = {'one word': 'budget', 'two words': 'budget review', 'prefix': 'road'}
+            print(f'{"query":<12}{"ms / search":>14}')
+            for name, q in queries.items():
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    board_ids = load_board_permissions(random.randint(1, args.users))
+                    search_content(board_ids, q, 20, 0)
+                print(f'{name:<12}{(time.perf_counter() - start) / args.repeat * 1000:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# bench/startup.py
+"""Time a cold worker boot: a fresh interpreter importing run.py, as gunicorn does, per SCHEMA_MODE.
+
+Usage: python -m bench.startup [--runs 10] [--modes create check]
+
+The database is migrated to head first, so 'check' finds it up to date.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOOT = "import time; start = time.perf_counter(); import run; print(time.perf_counter() - start)"
+
+
+def boot(environment):
+    """Seconds from interpreter start to a created app, and the part of it spent in run.py"""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', BOOT], cwd=ROOT, env=environment, check=True,
+                            capture_output=True, text=True).stdout
+    return time.perf_counter() - start, float(output.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--modes', nargs='+', default=['create', 'check'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        environment = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'run', 'db', 'upgrade'], cwd=ROOT,
+                       env=environment, check=True, capture_output=True)
+
+        print(f"{'mode':>8} {'process p50':>12} {'app p50':>9} {'app max':>9}")
+        for mode in args.modes:
+            times = [boot(dict(environment, SCHEMA_MODE=mode)) for _ in range(args.runs)]
+            process = [total for total, _ in times]
+            app = [created for _, created in times]
+            print(f'{mode:>8} {statistics.median(process) * 1000:>10.0f}ms {statistics.median(app) * 1000:>7.0f}ms '
+                  f'{max(app) * 1000:>7.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
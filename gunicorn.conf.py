@@ -0,0 +1,30 @@
+# gunicorn.conf.py
+# Read by gunicorn from the working directory, so the Procfile command picks it up
+import os
+import shutil
+import tempfile
+
+# Workers write their metrics to files here and /metrics adds them up (see app/metrics.py).
+# It has to be set before prometheus_client is first imported.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'taskhub-metrics'))
+
+# Workers leave the schema to "flask db upgrade" (the Procfile's release step) and only check its revision
+os.environ.setdefault('SCHEMA_MODE', 'check')
+
+from prometheus_client import multiprocess  # noqa: E402
+
+# Event streams (GET /boards/<id>/events) hold a thread each for up to EVENT_STREAM_TIMEOUT, so
+# there are threads for EVENT_MAX_STREAMS of them (24 by default) and requests besides
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+
+def on_starting(server):
+    # Files left by a previous run would be added to this one's values
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+
+def child_exit(server, worker):
+    # Drops the exited worker's live gauges, such as connections in use
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,39 @@
+"""Board note counts.
+
+Revision ID: 2b7e9c4d6a18
+Revises: 9d0b6f4a8e13
+Create Date: 2026-10-18 10:12:37.418260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7e9c4d6a18'
+down_revision = '9d0b6f4a8e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = {column['name'] for column in inspector.get_columns('board')}
+    with op.batch_alter_table('board') as batch_op:
+        if 'note_count' not in existing:
+            batch_op.add_column(sa.Column('note_count', sa.Integer(), nullable=False, server_default='0'))
+        if 'updated_at' not in existing:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    # Backfill from the notes already on each board
+    op.execute(
+        'UPDATE board SET '
+        'note_count = (SELECT COUNT(*) FROM note WHERE note.board_id = board.id), '
+        'updated_at = (SELECT MAX(COALESCE(note.updated_at, note.created_at)) FROM note WHERE note.board_id = board.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('board') as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('note_count')
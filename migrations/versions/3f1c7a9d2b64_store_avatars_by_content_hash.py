@@ -0,0 +1,96 @@
+"""Store avatars by content hash.
+
+Revision ID: 3f1c7a9d2b64
+Revises: 92d5808ccfb4
+Create Date: 2026-10-17 10:12:40.118204
+
+"""
+import base64
+import binascii
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c7a9d2b64'
+down_revision = '92d5808ccfb4'
+branch_labels = None
+depends_on = None
+
+
+avatar = sa.table('avatar',
+    sa.column('hash', sa.String),
+    sa.column('content_type', sa.String),
+    sa.column('data', sa.LargeBinary),
+    sa.column('created_at', sa.DateTime),
+)
+# The raster types the upload path accepts (app/avatars.py ALLOWED_FORMATS), copied so this
+# migration keeps its meaning as the app changes. SVG could carry script when served from our origin.
+RASTER_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+
+user_preferences = sa.table('user_preferences',
+    sa.column('id', sa.Integer),
+    sa.column('profile_picture', sa.Text),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    # Databases bootstrapped with db.create_all() may already have the table
+    if not sa.inspect(bind).has_table('avatar'):
+        op.create_table('avatar',
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('content_type', sa.String(length=50), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('hash')
+        )
+
+    if not sa.inspect(bind).has_table('user_preferences'):
+        return
+
+    # Move inline base64 profile pictures into the avatar table, one row at a time
+    rows = bind.execute(
+        sa.select(user_preferences.c.id, user_preferences.c.profile_picture)
+        .where(user_preferences.c.profile_picture.like('data:image%'))
+    ).fetchall()
+    stored = set(bind.execute(sa.select(avatar.c.hash)).scalars())
+    for row in rows:
+        header, _, encoded = row.profile_picture.partition(',')
+        content_type = header[len('data:'):].split(';')[0].lower()
+        try:
+            data = base64.b64decode(encoded, validate=True) if header.endswith(';base64') else None
+        except binascii.Error:
+            data = None
+        if content_type not in RASTER_TYPES or not data:
+            # Pictures an upload would refuse go back to the default rather than being served
+            bind.execute(
+                user_preferences.update()
+                .where(user_preferences.c.id == row.id)
+                .values(profile_picture=None)
+            )
+            continue
+        avatar_hash = hashlib.sha256(data).hexdigest()
+        if avatar_hash not in stored:
+            bind.execute(avatar.insert().values(hash=avatar_hash, content_type=content_type, data=data))
+            stored.add(avatar_hash)
+        bind.execute(
+            user_preferences.update()
+            .where(user_preferences.c.id == row.id)
+            .values(profile_picture=f'/avatars/{avatar_hash}')
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    avatars = bind.execute(sa.select(avatar.c.hash, avatar.c.content_type, avatar.c.data)).fetchall()
+    for row in avatars:
+        data_url = f'data:{row.content_type};base64,{base64.b64encode(row.data).decode()}'
+        bind.execute(
+            user_preferences.update()
+            .where(user_preferences.c.profile_picture == f'/avatars/{row.hash}')
+            .values(profile_picture=data_url)
+        )
+    op.drop_table('avatar')
@@ -0,0 +1,64 @@
+"""Board versions and tombstones.
+
+Revision ID: 5a9c3e7f1d20
+Revises: e1a5f08b3c72
+Create Date: 2026-10-17 22:08:14.662053
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9c3e7f1d20'
+down_revision = 'e1a5f08b3c72'
+branch_labels = None
+depends_on = None
+
+
+def missing_columns(inspector, table, names):
+    existing = {column['name'] for column in inspector.get_columns(table)}
+    return [name for name in names if name not in existing]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if missing_columns(inspector, 'board', ['version']):
+        with op.batch_alter_table('board') as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+
+    for table, parent in [('note', 'board_id'), ('reply', 'note_id')]:
+        missing = missing_columns(inspector, table, ['updated_at', 'version'])
+        with op.batch_alter_table(table) as batch_op:
+            if 'updated_at' in missing:
+                batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+            if 'version' in missing:
+                batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+        index_name = f'ix_{table}_{parent}_version'
+        if index_name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(index_name, table, [parent, 'version'], unique=False)
+
+    if not inspector.has_table('tombstone'):
+        op.create_table('tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('board_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=False),
+        sa.Column('object_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_tombstone_board_id_version', 'tombstone', ['board_id', 'version'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tombstone_board_id_version', table_name='tombstone')
+    op.drop_table('tombstone')
+    for table, parent in [('reply', 'note_id'), ('note', 'board_id')]:
+        op.drop_index(f'ix_{table}_{parent}_version', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
+            batch_op.drop_column('updated_at')
+    with op.batch_alter_table('board') as batch_op:
+        batch_op.drop_column('version')
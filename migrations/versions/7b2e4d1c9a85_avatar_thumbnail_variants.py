@@ -0,0 +1,102 @@
+"""Avatar thumbnail variants.
+
+Revision ID: 7b2e4d1c9a85
+Revises: 3f1c7a9d2b64
+Create Date: 2026-10-17 14:03:27.551930
+
+"""
+import hashlib
+from io import BytesIO
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e4d1c9a85'
+down_revision = '3f1c7a9d2b64'
+branch_labels = None
+depends_on = None
+
+
+avatar = sa.table('avatar',
+    sa.column('hash', sa.String),
+    sa.column('content_type', sa.String),
+    sa.column('data', sa.LargeBinary),
+)
+user_preferences = sa.table('user_preferences',
+    sa.column('id', sa.Integer),
+    sa.column('profile_picture', sa.Text),
+    sa.column('profile_thumbnail', sa.Text),
+)
+
+# The variants app/avatars.py made when this revision was written, copied so the migration
+# produces the same images however the app's avatar code changes later
+ALLOWED_FORMATS = {'PNG', 'JPEG', 'GIF', 'WEBP'}
+MAX_SOURCE_PIXELS = 25000000
+VARIANTS = {'note': 80, 'profile': 160}
+VARIANT_CONTENT_TYPE = 'image/webp'
+
+
+def make_variants(data):
+    """{variant name: WebP bytes} for a stored original, or None if it isn't a usable raster image"""
+    from PIL import Image, ImageOps
+    try:
+        image = Image.open(BytesIO(data))
+        if image.format not in ALLOWED_FORMATS or image.width * image.height > MAX_SOURCE_PIXELS:
+            return None
+        image.load()
+    except (OSError, Image.DecompressionBombError):
+        return None
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    variants = {}
+    for name, size in VARIANTS.items():
+        buffer = BytesIO()
+        ImageOps.fit(image, (size, size), Image.LANCZOS).save(buffer, 'WEBP', quality=80)
+        variants[name] = buffer.getvalue()
+    return variants
+
+
+def upgrade():
+    bind = op.get_bind()
+    columns = [column['name'] for column in sa.inspect(bind).get_columns('user_preferences')]
+    if 'profile_thumbnail' not in columns:
+        with op.batch_alter_table('user_preferences') as batch_op:
+            batch_op.add_column(sa.Column('profile_thumbnail', sa.Text(), nullable=True))
+
+    # Replace originals stored by the previous revision with the fixed-size variants
+    originals = bind.execute(
+        sa.select(avatar.c.hash, avatar.c.data).where(avatar.c.content_type != VARIANT_CONTENT_TYPE)
+    ).fetchall()
+    stored = set(bind.execute(sa.select(avatar.c.hash)).scalars())
+    for original in originals:
+        variants = make_variants(original.data)
+        if variants is None:
+            # Left in place it would be served as is, so its users go back to the default picture
+            bind.execute(
+                user_preferences.update()
+                .where(user_preferences.c.profile_picture == f'/avatars/{original.hash}')
+                .values(profile_picture=None, profile_thumbnail=None)
+            )
+            bind.execute(avatar.delete().where(avatar.c.hash == original.hash))
+            continue
+        urls = {}
+        for name, data in variants.items():
+            variant_hash = hashlib.sha256(data).hexdigest()
+            if variant_hash not in stored:
+                bind.execute(avatar.insert().values(hash=variant_hash, content_type=VARIANT_CONTENT_TYPE, data=data))
+                stored.add(variant_hash)
+            urls[name] = f'/avatars/{variant_hash}'
+        bind.execute(
+            user_preferences.update()
+            .where(user_preferences.c.profile_picture == f'/avatars/{original.hash}')
+            .values(profile_picture=urls['profile'], profile_thumbnail=urls['note'])
+        )
+        bind.execute(avatar.delete().where(avatar.c.hash == original.hash))
+
+
+def downgrade():
+    # Variants are kept; profile_picture already points at a usable image
+    with op.batch_alter_table('user_preferences') as batch_op:
+        batch_op.drop_column('profile_thumbnail')
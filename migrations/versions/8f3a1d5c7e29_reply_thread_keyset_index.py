@@ -0,0 +1,30 @@
+"""Reply thread keyset index.
+
+Revision ID: 8f3a1d5c7e29
+Revises: 2b7e9c4d6a18
+Create Date: 2026-10-18 11:03:52.771045
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3a1d5c7e29'
+down_revision = '2b7e9c4d6a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('reply')}
+    if 'ix_reply_note_id_created_at_id' not in indexes:
+        op.create_index('ix_reply_note_id_created_at_id', 'reply', ['note_id', 'created_at', 'id'], unique=False)
+    # The composite index starts with note_id, so the single-column one is redundant
+    if 'ix_reply_note_id' in indexes:
+        op.drop_index('ix_reply_note_id', table_name='reply')
+
+
+def downgrade():
+    op.create_index('ix_reply_note_id', 'reply', ['note_id'], unique=False)
+    op.drop_index('ix_reply_note_id_created_at_id', table_name='reply')
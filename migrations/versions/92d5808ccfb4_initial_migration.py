@@ -17,32 +17,89 @@ depends_on = None
 
 
 def upgrade():
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.create_table('user',
-    sa.Column('id', sa.Integer(), nullable=False),
-    sa.Column('email', sa.String(length=120), nullable=False),
-    sa.Column('password', sa.String(length=120), nullable=False),
-    sa.PrimaryKeyConstraint('id'),
-    sa.UniqueConstraint('email')
-    )
-    op.create_table('note',
-    sa.Column('id', sa.Integer(), nullable=False),
-    sa.Column('content', sa.Text(), nullable=False),
-    sa.Column('created_at', sa.DateTime(), nullable=True),
-    sa.Column('user_id', sa.Integer(), nullable=False),
-    sa.Column('color', sa.String(length=7), nullable=True),
-    sa.Column('position_x', sa.Integer(), nullable=True),
-    sa.Column('position_y', sa.Integer(), nullable=True),
-    sa.Column('width', sa.Integer(), nullable=True),
-    sa.Column('height', sa.Integer(), nullable=True),
-    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
-    sa.PrimaryKeyConstraint('id')
-    )
-    # ### end Alembic commands ###
+    # Databases bootstrapped with db.create_all() before they were versioned already have these
+    # tables, so each is only created when missing
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'user' not in tables:
+        op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('password', sa.String(length=500), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email')
+        )
+    if 'board' not in tables:
+        op.create_table('board',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=100), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'note' not in tables:
+        op.create_table('note',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('color', sa.String(length=7), nullable=True),
+        sa.Column('position_x', sa.Integer(), nullable=True),
+        sa.Column('position_y', sa.Integer(), nullable=True),
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('board_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['board_id'], ['board.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'access' not in tables:
+        op.create_table('access',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('board_id', sa.Integer(), nullable=False),
+        sa.Column('can_edit', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['board_id'], ['board.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'user_preferences' not in tables:
+        op.create_table('user_preferences',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('designTheme', sa.String(length=150), nullable=True),
+        sa.Column('designBackColor', sa.String(length=7), nullable=True),
+        sa.Column('designSideBarColor', sa.String(length=7), nullable=True),
+        sa.Column('timezone', sa.String(length=100), nullable=True),
+        sa.Column('enable_email_notif', sa.Boolean(), nullable=True),
+        sa.Column('enable_email_notif_reply', sa.Boolean(), nullable=True),
+        sa.Column('enable_email_notif_board', sa.Boolean(), nullable=True),
+        sa.Column('enable_email_notif_own', sa.Boolean(), nullable=True),
+        sa.Column('enable_email_notif_star', sa.Boolean(), nullable=True),
+        sa.Column('privacy', sa.String(length=50), nullable=True),
+        sa.Column('profile_picture', sa.Text(), nullable=True),
+        sa.Column('username', sa.String(length=150), nullable=True),
+        sa.Column('light_dark_mode', sa.Boolean(), nullable=True),
+        sa.Column('note_colour', sa.String(length=7), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'reply' not in tables:
+        op.create_table('reply',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content', sa.String(length=1000), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('note_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['note_id'], ['note.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
 
 
 def downgrade():
-    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('reply')
+    op.drop_table('user_preferences')
+    op.drop_table('access')
     op.drop_table('note')
+    op.drop_table('board')
     op.drop_table('user')
-    # ### end Alembic commands ###
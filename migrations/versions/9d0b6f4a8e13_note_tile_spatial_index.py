@@ -0,0 +1,62 @@
+"""Note tile spatial index.
+
+Revision ID: 9d0b6f4a8e13
+Revises: 5a9c3e7f1d20
+Create Date: 2026-10-18 09:47:30.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.spatial import note_tiles
+
+
+# revision identifiers, used by Alembic.
+revision = '9d0b6f4a8e13'
+down_revision = '5a9c3e7f1d20'
+branch_labels = None
+depends_on = None
+
+
+note = sa.table('note',
+    sa.column('id', sa.Integer),
+    sa.column('board_id', sa.Integer),
+    sa.column('position_x', sa.Integer),
+    sa.column('position_y', sa.Integer),
+    sa.column('width', sa.Integer),
+    sa.column('height', sa.Integer),
+)
+
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table('note_tile'):
+        return
+    note_tile = op.create_table('note_tile',
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('tile_x', sa.Integer(), nullable=False),
+    sa.Column('tile_y', sa.Integer(), nullable=False),
+    sa.Column('board_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['note_id'], ['note.id'], ),
+    sa.PrimaryKeyConstraint('note_id', 'tile_x', 'tile_y')
+    )
+    op.create_index('ix_note_tile_board_id_tile', 'note_tile', ['board_id', 'tile_x', 'tile_y'], unique=False)
+
+    # Backfill tiles for existing notes in id order, one batch at a time
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(note).where(note.c.id > last_id).order_by(note.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        tiles = [tile for row in rows for tile in note_tiles(row.id, row.board_id, row._mapping)]
+        bind.execute(note_tile.insert(), tiles)
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_index('ix_note_tile_board_id_tile', table_name='note_tile')
+    op.drop_table('note_tile')
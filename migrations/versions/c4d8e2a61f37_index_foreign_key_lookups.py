@@ -0,0 +1,86 @@
+"""Index foreign key lookups.
+
+Revision ID: c4d8e2a61f37
+Revises: 7b2e4d1c9a85
+Create Date: 2026-10-17 16:41:09.204417
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e2a61f37'
+down_revision = '7b2e4d1c9a85'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, columns, unique)
+INDEXES = [
+    ('ix_note_board_id', 'note', ['board_id'], False),
+    ('ix_note_user_id', 'note', ['user_id'], False),
+    ('ix_access_user_id_board_id', 'access', ['user_id', 'board_id'], True),
+    ('ix_access_board_id', 'access', ['board_id'], False),
+    ('ix_reply_note_id', 'reply', ['note_id'], False),
+    ('ix_user_preferences_user_id', 'user_preferences', ['user_id'], True),
+    ('ix_board_owner_id', 'board', ['owner_id'], False),
+]
+
+
+logger = logging.getLogger('alembic.env')
+
+
+def merge_duplicates(bind, table, columns):
+    """Fold each duplicate group into its oldest row, the one the app has been reading"""
+    keys = ', '.join(columns)
+    same_key = ' AND '.join(f'other.{column} = {table}.{column}' for column in columns)
+    kept = f'id IN (SELECT MIN(id) FROM {table} GROUP BY {keys} HAVING COUNT(*) > 1)'
+    if table == 'access':
+        # Any grant that allowed editing wins; MAX over CASE since PostgreSQL has no MAX(boolean)
+        bind.execute(sa.text(
+            f'UPDATE access SET can_edit = (SELECT MAX(CASE WHEN other.can_edit THEN 1 ELSE 0 END) '
+            f'FROM access AS other WHERE {same_key}) = 1 WHERE {kept}'
+        ))
+        return
+    # Elsewhere the oldest row's values stand, with settings it lacks taken from the newest duplicate having them
+    for column in sa.inspect(bind).get_columns(table):
+        name = column['name']
+        if name == 'id' or name in columns:
+            continue
+        bind.execute(sa.text(
+            f'UPDATE {table} SET {name} = (SELECT other.{name} FROM {table} AS other '
+            f'WHERE {same_key} AND other.{name} IS NOT NULL ORDER BY other.id DESC LIMIT 1) '
+            f'WHERE {name} IS NULL AND {kept}'
+        ))
+
+
+def remove_duplicates(bind, table, columns):
+    """Merge, then delete, all but the oldest row of each duplicate group so a unique index can be built"""
+    merge_duplicates(bind, table, columns)
+    keys = ', '.join(columns)
+    removed = bind.execute(sa.text(
+        f'DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {keys})'
+    )).rowcount
+    if removed:
+        logger.info(f'Merged and removed {removed} duplicate {table} rows on ({keys})')
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for name, table, columns, unique in INDEXES:
+        if not inspector.has_table(table):
+            continue
+        if name in {index['name'] for index in inspector.get_indexes(table)}:
+            continue
+        if unique:
+            remove_duplicates(bind, table, columns)
+        op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    for name, table, columns, unique in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,34 @@
+"""Full-text search index.
+
+Revision ID: d6e2b8f04a51
+Revises: 8f3a1d5c7e29
+Create Date: 2026-10-18 13:27:45.109382
+
+"""
+from alembic import op
+
+from app.search import rebuild_search_index, search_backend
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6e2b8f04a51'
+down_revision = '8f3a1d5c7e29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    backend = search_backend(bind)
+    if backend is None:
+        return
+    # create_all may already have made an empty index, so it is always rebuilt
+    backend.create(bind)
+    rebuild_search_index(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    backend = search_backend(bind)
+    if backend is not None:
+        backend.drop(bind)
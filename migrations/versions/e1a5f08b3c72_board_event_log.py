@@ -0,0 +1,37 @@
+"""Board event log.
+
+Revision ID: e1a5f08b3c72
+Revises: c4d8e2a61f37
+Create Date: 2026-10-17 19:22:51.730116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a5f08b3c72'
+down_revision = 'c4d8e2a61f37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table('board_event'):
+        return
+    op.create_table('board_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('board_id', sa.Integer(), nullable=False),
+    sa.Column('event_type', sa.String(length=50), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_board_event_board_id', 'board_event', ['board_id'], unique=False)
+    op.create_index('ix_board_event_created_at', 'board_event', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_board_event_created_at', table_name='board_event')
+    op.drop_index('ix_board_event_board_id', table_name='board_event')
+    op.drop_table('board_event')
@@ -0,0 +1,28 @@
+"""Board templates.
+
+Revision ID: f4b1c8e3d927
+Revises: d6e2b8f04a51
+Create Date: 2026-10-18 14:26:09.318472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b1c8e3d927'
+down_revision = 'd6e2b8f04a51'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('board')}
+    if 'is_template' not in existing:
+        with op.batch_alter_table('board') as batch_op:
+            batch_op.add_column(sa.Column('is_template', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table('board') as batch_op:
+        batch_op.drop_column('is_template')
@@ -1,9 +1,32 @@
 import pytest
 from app import create_app, db
-from app.models import User, Note, UserPreferences
+from app.models import User, Note, NoteTile, UserPreferences, Reply, Board, BoardEvent
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from contextlib import contextmanager
+from datetime import datetime
+import base64
+import brotli
+import gzip
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import zlib
+from io import BytesIO
+from PIL import Image
 from app.config import TestConfig  
+from app.auth import PasswordHasher
+from app.cache import FileCache
+from app.events import DatabaseBroker
+from app.instrumentation import start_request
+from app.schema import check_revision, head_revisions
+from app.spatial import MAX_NOTE_SIZE, TILE_SIZE
+from prometheus_client import REGISTRY
 from werkzeug.security import generate_password_hash
-from flask import url_for
+from flask import g, url_for
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 
@@ -44,6 +67,29 @@ def get_csrf_token(client):
                 return csrf_token
     return None
 
+@contextmanager
+def count_queries():
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+def add_notes_by_authors(board_id, note_count, author_count, prefix):
+    authors = []
+    for i in range(author_count):
+        author = User(email=f"{prefix}{i}@example.com", password="x")
+        db.session.add(author)
+        db.session.flush()
+        db.session.add(UserPreferences(user_id=author.id, username=f"{prefix}{i}"))
+        authors.append(author)
+    for i in range(note_count):
+        db.session.add(Note(content=f"note {i}", user_id=authors[i % author_count].id, board_id=board_id))
+    db.session.commit()
+
 def test_authentication_page(client):
     response = client.get("/")
     assert b"Sign In" in response.data 
@@ -220,6 +266,825 @@ def test_unsuccessful_logout(client, app):
     assert response.status_code == 200
     assert b'You have been logged out.' in response.data
 
+def test_board_render_query_count_is_constant(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    # Warm the cached sidebar board list so both renders do the same work apart from the notes
+    client.get('/notes')
+    add_notes_by_authors(1, 2, 2, 'small')
+    with count_queries() as small_board:
+        response = client.get('/notes')
+    assert response.status_code == 200
+    assert b'small1' in response.data
+
+    add_notes_by_authors(1, 100, 20, 'large')
+    with count_queries() as large_board:
+        response = client.get('/notes')
+    assert response.status_code == 200
+    assert b'large19' in response.data
+    assert len(large_board) == len(small_board)
+
+def test_note_detail_query_count_is_constant(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    response = client.post('/notes/add', data={'content': 'Discussed note', 'color': '#ffffff'})
+    note_id = response.json['id']
+
+    def add_replies(count, prefix):
+        add_notes_by_authors(1, 0, count, prefix)
+        for author in User.query.filter(User.email.like(f"{prefix}%")).all():
+            db.session.add(Reply(content=f"reply from {author.email}", user_id=author.id, note_id=note_id))
+        db.session.commit()
+
+    # Warm the cached author preferences the note's ETag is built from
+    client.get(f'/notes/{note_id}')
+    add_replies(2, 'few')
+    with count_queries() as few_replies:
+        response = client.get(f'/notes/{note_id}')
+    assert len(response.json['replies']) == 2
+
+    add_replies(30, 'many')
+    with count_queries() as many_replies:
+        response = client.get(f'/notes/{note_id}')
+    assert len(response.json['replies']) == 32
+    assert {reply['username'] for reply in response.json['replies']} >= {'few0', 'many29'}
+    assert len(many_replies) == len(few_replies)
+
+def test_profile_picture_served_as_cached_avatar(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    buffer = BytesIO()
+    Image.new('RGB', (1200, 800), '#7785cc').save(buffer, 'PNG')
+    data_url = 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+    response = client.post('/update_preferences', json={'profile_picture': data_url})
+    assert response.json['success'] == True
+
+    preferences = UserPreferences.query.filter_by(user_id=1).first()
+    assert preferences.profile_picture.startswith('/avatars/')
+    assert preferences.profile_thumbnail.startswith('/avatars/')
+
+    for avatar_url, size in [(preferences.profile_thumbnail, 80), (preferences.profile_picture, 160)]:
+        response = client.get(avatar_url)
+        assert response.status_code == 200
+        assert response.mimetype == 'image/webp'
+        assert 'immutable' in response.headers['Cache-Control']
+        assert Image.open(BytesIO(response.data)).size == (size, size)
+
+    response = client.get(avatar_url, headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+    response = client.post('/update_preferences', json={'profile_picture': 'data:image/svg+xml;base64,PHN2Zy8+'})
+    assert response.status_code == 400
+
+    # A PNG header claiming 20000x20000 trips Pillow's decompression bomb check before ours
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+    bomb = (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 20000, 20000, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'')) + chunk(b'IEND', b''))
+    response = client.post('/update_preferences', json={'profile_picture': 'data:image/png;base64,' + base64.b64encode(bomb).decode()})
+    assert response.status_code == 400
+    assert response.json['message'] == 'Image too large. Please use a smaller image.'
+
+def test_batch_note_update(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    note_ids = [client.post('/notes/add', data={'content': f'note {i}', 'color': '#ffffff'}).json['id'] for i in range(3)]
+    other_user = User(email="other@example.com", password="x")
+    db.session.add(other_user)
+    db.session.flush()
+    other_board = Board(title='Private', owner_id=other_user.id)
+    db.session.add(other_board)
+    db.session.flush()
+    private_note = Note(content='private', user_id=other_user.id, board_id=other_board.id)
+    db.session.add(private_note)
+    db.session.commit()
+
+    response = client.post('/notes/batch_update', json={'notes': [
+        {'id': note_ids[0], 'position_x': 10, 'position_y': 20},
+        {'id': note_ids[1], 'width': 300, 'height': 150, 'color': '#000000'},
+        {'id': note_ids[0], 'position_x': 15, 'content': 'moved'},
+        {'id': private_note.id, 'position_x': 99},
+        {'id': 9999, 'position_x': 1},
+    ]})
+    assert response.status_code == 200
+    assert sorted(response.json['updated']) == sorted(note_ids[:2])
+    assert {failure['id']: failure['error'] for failure in response.json['failed']} == {private_note.id: 'Unauthorized', 9999: 'Note not found'}
+
+    db.session.expire_all()
+    first = db.session.get(Note, note_ids[0])
+    assert (first.position_x, first.position_y, first.content) == (15, 20, 'moved')
+    second = db.session.get(Note, note_ids[1])
+    assert (second.width, second.height, second.color) == (300, 150, '#000000')
+    assert db.session.get(Note, private_note.id).position_x is None
+
+    # Values the columns can't hold reject the batch, naming the note
+    for patch in ({'content': None}, {'content': '  '}, {'color': ['x']}, {'position_x': 'abc'},
+                  {'width': -1}, {'height': True}, {'position_y': 2 ** 40}):
+        response = client.post('/notes/batch_update', json={'notes': [{'id': note_ids[1], 'position_x': 1},
+                                                                      {'id': note_ids[0], **patch}]})
+        assert response.status_code == 400
+        assert response.json['error'].startswith(f'Note {note_ids[0]}: {next(iter(patch))} must be')
+    db.session.expire_all()
+    assert db.session.get(Note, note_ids[0]).content == 'moved'
+    assert db.session.get(Note, note_ids[1]).position_x is None
+
+def test_board_events_stream_changes(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    app.config['EVENT_HEARTBEAT'] = 0.1
+    app.config['EVENT_STREAM_TIMEOUT'] = 1
+
+    stream = client.get('/boards/1/events', buffered=False)
+    assert stream.mimetype == 'text/event-stream'
+    note_id = client.post('/notes/add', data={'content': 'Live note', 'color': '#ffffff'}).json['id']
+    client.post('/notes/batch_update', json={'notes': [{'id': note_id, 'position_x': 40}]})
+
+    chunks = iter(stream.response)
+    assert next(chunks).startswith(b'retry:')
+    added = next(chunks).decode()
+    assert 'event: note_added' in added and 'Live note' in added
+    moved = next(chunks).decode()
+    assert 'event: notes_updated' in moved and '"position_x": 40' in moved
+    stream.close()
+
+    # Streams hold a thread each, so a process only opens EVENT_MAX_STREAMS of them
+    app.extensions['event_stream_slots'] = threading.BoundedSemaphore(1)
+    first = client.get('/boards/1/events', buffered=False)
+    assert first.status_code == 200
+    assert client.get('/boards/1/events').status_code == 503
+    first.close()
+    second = client.get('/boards/1/events', buffered=False)
+    assert second.status_code == 200
+    second.close()
+
+def test_database_broker_shares_events_between_workers(app):
+    app.config['EVENT_POLL_INTERVAL'] = 0.01
+    publisher = DatabaseBroker(app.config)
+    subscriber = DatabaseBroker(app.config)
+
+    with app.test_request_context():
+        subscription = subscriber.subscribe(1)
+        publisher.publish(1, 'note_deleted', {'id': 5})
+        publisher.publish(2, 'note_deleted', {'id': 6})
+        events = subscription.get(timeout=1)
+        assert [(event.type, event.data) for event in events] == [('note_deleted', {'id': 5})]
+
+        # One poller per process serves every subscription; a reconnect replays what it missed
+        replayed = subscriber.subscribe(1, last_event_id=0)
+        publisher.publish(1, 'note_deleted', {'id': 7})
+        assert [event.data['id'] for event in subscription.get(timeout=1)] == [7]
+        assert [event.data['id'] for event in replayed.get(timeout=1)] == [5, 7]
+        assert [thread.name for thread in threading.enumerate()].count('board-event-poller') == 1
+        replayed.close()
+
+        # Ids are assigned before commit, so a smaller one can become visible after a larger one
+        latest = db.session.execute(text('SELECT max(id) FROM board_event')).scalar()
+        for event_id in (latest + 10, latest + 5):
+            db.session.add(BoardEvent(id=event_id, board_id=1, event_type='note_deleted', payload=json.dumps({'id': event_id})))
+            db.session.commit()
+            assert [event.id for event in subscription.get(timeout=1)] == [event_id]
+        assert subscription.get(timeout=0.1) == []
+        subscription.close()
+
+def test_incremental_board_sync(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    first_id = client.post('/notes/add', data={'content': 'first', 'color': '#ffffff'}).json['id']
+    second_id = client.post('/notes/add', data={'content': 'second', 'color': '#ffffff'}).json['id']
+    response = client.get('/notes/get_by_board/1?since=0')
+    assert sorted(note['id'] for note in response.json['notes']) == [first_id, second_id]
+    cursor = response.json['version']
+
+    response = client.get(f'/notes/get_by_board/1?since={cursor}')
+    assert response.json == {'version': cursor, 'notes': [], 'deleted': []}
+
+    client.post('/notes/batch_update', json={'notes': [{'id': first_id, 'position_x': 5}]})
+    client.post(f'/notes/delete/{second_id}')
+    third_id = client.post('/notes/add', data={'content': 'third', 'color': '#ffffff'}).json['id']
+    response = client.get(f'/notes/get_by_board/1?since={cursor}')
+    assert sorted(note['id'] for note in response.json['notes']) == [first_id, third_id]
+    assert response.json['deleted'] == [second_id]
+    assert response.json['version'] > cursor
+
+    client.post(f'/notes/{first_id}/add_reply', json={'content': 'a reply'})
+    response = client.get(f'/notes/{first_id}/replies?since={response.json["version"]}')
+    assert [reply['content'] for reply in response.json['replies']] == ['a reply']
+
+    # The plain list response is unchanged for existing callers
+    assert isinstance(client.get('/notes/get_by_board/1').json, list)
+
+def test_viewport_note_loading(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    def window(x0, y0, x1, y1):
+        response = client.get(f'/boards/1/notes/window?x0={x0}&y0={y0}&x1={x1}&y1={y1}')
+        assert response.status_code == 200
+        return sorted(note['content'] for note in response.json['notes'])
+
+    positions = {'near': (0, 0), 'far': (5000, 5000), 'edge': (1000, 0)}
+    ids = {}
+    for content, (x, y) in positions.items():
+        ids[content] = client.post('/notes/add', data={'content': content, 'color': '#ffffff'}).json['id']
+        client.post(f'/notes/update/{ids[content]}', json={'position_x': x, 'position_y': y, 'width': 250, 'height': 200})
+
+    assert window(0, 0, 1024, 768) == ['edge', 'near']
+    assert window(0, 0, 1000, 768) == ['near']
+    assert window(4800, 4800, 6000, 6000) == ['far']
+
+    client.post('/notes/batch_update', json={'notes': [{'id': ids['far'], 'position_x': 100, 'position_y': 300}]})
+    assert window(0, 0, 1000, 768) == ['far', 'near']
+    assert window(4800, 4800, 6000, 6000) == []
+
+    client.post(f'/notes/delete/{ids["near"]}')
+    assert window(0, 0, 1000, 768) == ['far']
+
+    assert client.get('/boards/1/notes/window?x0=0&y0=0&x1=10').status_code == 400
+    assert client.get('/boards/1/notes/window?x0=0&y0=0&x1=100000&y1=100000').status_code == 400
+
+    # Every route writing geometry bounds it, and rows written around them are tiled at the largest size
+    for patch in ({'width': 200000}, {'height': -1}, {'position_x': 'abc'}):
+        response = client.post(f'/notes/update/{ids["far"]}', json=patch)
+        assert response.status_code == 400
+        assert response.json['error'].startswith(f'{next(iter(patch))} must be')
+    huge = Note(content='huge', user_id=1, board_id=1, width=200000, height=200000)
+    db.session.add(huge)
+    db.session.commit()
+    assert db.session.query(NoteTile).filter_by(note_id=huge.id).count() == (MAX_NOTE_SIZE // TILE_SIZE + 1) ** 2
+
+    app.config['WINDOWED_BOARD_THRESHOLD'] = 1
+    response = client.get('/notes')
+    assert b'windowed="true"' in response.data
+    assert f'id="note{ids["far"]}"'.encode() not in response.data
+
+def test_preferences_cached_with_etag(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    response = client.get('/get_preferences')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    # Served from the cache: no preferences query, and a matching ETag gets a 304
+    with count_queries() as statements:
+        response = client.get('/get_preferences', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert not any('user_preferences' in statement for statement in statements)
+
+    response = client.post('/update_preferences', json={'username': 'Renamed'})
+    assert response.json['success'] == True
+
+    response = client.get('/get_preferences', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['username'] == 'Renamed'
+    assert response.headers['ETag'] != etag
+
+def test_board_permissions_cached_until_sharing_changes(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    db.session.add(User(email="guest@example.com", password=generate_password_hash("guestpassword")))
+    db.session.commit()
+
+    # The fixture's app context (and so g) spans every request, so the guest gets its own
+    guest = app.test_client()
+    def guest_get(url):
+        with app.app_context():
+            return guest.get(url)
+    with app.app_context():
+        guest.post('/', data={'email': 'guest@example.com', 'password': 'guestpassword', 'login': True})
+
+    assert guest_get('/boards/details/1').status_code == 403
+    assert guest_get('/boards/details/999').status_code == 404
+
+    response = client.post('/boards/share', data={'board_id': 1, 'email': 'guest@example.com'})
+    assert response.json['message'] == 'Access granted'
+    assert guest_get('/boards/details/1').status_code == 200
+
+    # Permissions come from the cache, so board-scoped requests skip the board and access lookups
+    with count_queries() as statements:
+        assert guest_get('/notes/get_by_board/1').status_code == 200
+    assert not any('FROM access' in statement for statement in statements)
+
+    response = client.post('/boards/share', data={'board_id': 1, 'email': 'guest@example.com'})
+    assert response.json['message'] == 'Access revoked'
+    assert guest_get('/boards/details/1').status_code == 403
+
+def test_board_list_json(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    response = client.get('/boards')
+    assert response.status_code == 200
+    assert [(board['title'], board['permission'], board['note_count']) for board in response.json] == [('Default Board', 'owner', 0)]
+
+    note_id = client.post('/notes/add', data={'content': 'counted', 'color': '#ffffff'}).json['id']
+    client.post('/notes/add', data={'content': 'deleted', 'color': '#ffffff'})
+    client.post(f'/notes/delete/{note_id}')
+    client.post('/create_board', data={'title': 'Second'})
+
+    # Served from the cache, which notes and boards created by the user invalidate
+    with count_queries() as statements:
+        boards = client.get('/boards').json
+        assert client.get('/boards').json == boards
+    assert len(statements) == 1
+    assert [(board['title'], board['note_count']) for board in boards] == [('Default Board', 1), ('Second', 0)]
+    assert boards[0]['updated_at'] is not None
+
+def test_board_list_cache_invalidated_for_collaborators(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    db.session.add(User(email="guest@example.com", password=generate_password_hash("guestpassword")))
+    db.session.commit()
+    client.post('/boards/share', data={'board_id': 1, 'email': 'guest@example.com'})
+
+    guest = app.test_client()
+    def guest_count():
+        with app.app_context():
+            return next(board for board in guest.get('/boards').json if board['id'] == 1)['note_count']
+    with app.app_context():
+        guest.post('/', data={'email': 'guest@example.com', 'password': 'guestpassword', 'login': True})
+    assert guest_count() == 0
+
+    # The owner's notes change the count on the guest's cached list too
+    note_id = client.post('/notes/add', data={'content': 'shared', 'color': '#ffffff'}).json['id']
+    assert guest_count() == 1
+    client.post(f'/notes/delete/{note_id}')
+    assert guest_count() == 0
+
+def test_file_cache_sweeps_retired_entries(app, tmp_path):
+    cache = FileCache(dict(app.config, CACHE_DIR=str(tmp_path), CACHE_MAX_ENTRIES=3))
+    cache.SWEEP_EVERY = 10
+
+    # Keys retired by a version bump are never read again, so only the sweep removes them
+    for i in range(5):
+        cache.set(f'old:{i}', i, ttl=-1)
+    for i in range(5):
+        cache.set(f'live:{i}', i, ttl=60 + i)
+    assert sorted(tmp_path.iterdir()) == sorted(tmp_path / os.path.basename(cache._path(f'live:{i}')) for i in (2, 3, 4))
+    assert [cache.get(f'live:{i}') for i in range(5)] == [None, None, 2, 3, 4]
+
+def test_reply_pages(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    note_id = client.post('/notes/add', data={'content': 'Long thread', 'color': '#ffffff'}).json['id']
+
+    # Replies sharing a timestamp are ordered by id
+    created_at = datetime(2026, 1, 1)
+    db.session.add_all([Reply(content=f"reply {i}", user_id=1, note_id=note_id, created_at=created_at) for i in range(7)])
+    db.session.commit()
+
+    pages = []
+    before = None
+    while True:
+        query = f'&before={before}' if before else ''
+        response = client.get(f'/notes/{note_id}/replies?limit=3{query}')
+        assert response.status_code == 200
+        pages.append([reply['content'] for reply in response.json['replies']])
+        before = response.json['before']
+        if before is None:
+            break
+    assert pages == [['reply 4', 'reply 5', 'reply 6'], ['reply 1', 'reply 2', 'reply 3'], ['reply 0']]
+
+    app.config['REPLY_PAGE_SIZE'] = 2
+    response = client.get(f'/notes/{note_id}')
+    assert [reply['content'] for reply in response.json['replies']] == ['reply 5', 'reply 6']
+    assert response.json['replies_before'] is not None
+
+    assert client.get(f'/notes/{note_id}/replies?limit=0').status_code == 400
+    assert client.get(f'/notes/{note_id}/replies?before=9999').status_code == 400
+
+    # Threads are only shown to users who can read the board
+    stranger = app.test_client()
+    with app.app_context():
+        response = stranger.get(f'/notes/{note_id}/replies?since=0', headers={'Accept': 'application/json'})
+        assert response.status_code == 401
+        assert stranger.get(f'/notes/{note_id}/replies').status_code == 302
+    db.session.add(User(email="stranger@example.com", password=generate_password_hash("strangerpassword")))
+    db.session.commit()
+    with app.app_context():
+        stranger.post('/', data={'email': 'stranger@example.com', 'password': 'strangerpassword', 'login': True})
+    with app.app_context():
+        assert stranger.get(f'/notes/{note_id}/replies?since=0').status_code == 403
+    with app.app_context():
+        assert stranger.get(f'/notes/{note_id}/replies').status_code == 403
+    with app.app_context():
+        assert stranger.get('/notes/9999/replies').status_code == 404
+
+def test_static_fingerprints_and_compression(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    response = client.get('/notes')
+    script_url = re.search(r'src="(/static/js/notes\.js\?v=[0-9a-f]+)"', response.data.decode()).group(1)
+    response = client.get(script_url, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Set-Cookie' not in response.headers
+    assert brotli.decompress(response.data) == client.get('/static/js/notes.js').data
+    assert client.get(script_url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # Unversioned URLs are revalidated rather than cached for a year
+    response = client.get('/static/js/notes.js')
+    assert 'Content-Encoding' not in response.headers
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    add_notes_by_authors(1, 50, 5, 'gzip')
+    plain = client.get('/notes/get_by_board/1')
+    with app.app_context():
+        response = client.get('/notes/get_by_board/1', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain.data
+
+    # Pages embedding the CSRF token are sent uncompressed, so their size can't leak it (BREACH)
+    with app.app_context():
+        response = client.get('/notes', headers={'Accept-Encoding': 'gzip'})
+    assert len(response.data) >= app.config['COMPRESS_MIN_SIZE']
+    assert 'Content-Encoding' not in response.headers
+    assert b'name="csrf-token"' in response.data
+
+def test_conditional_board_and_note_requests(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    note_id = client.post('/notes/add', data={'content': 'Cached note', 'color': '#ffffff'}).json['id']
+
+    etags = {}
+    for url in ['/notes/get_by_board/1', '/notes/get_by_board/1?since=0', f'/notes/{note_id}', '/boards/details/1']:
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert 'Last-Modified' in response.headers
+
+        # Only the validators are read; the rows are not loaded for a 304
+        with count_queries() as statements:
+            response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert len(statements) == 1
+        etags[url] = etag
+
+    client.post(f'/notes/{note_id}/add_reply', json={'content': 'Changes the note'})
+    response = client.get(f'/notes/{note_id}', headers={'If-None-Match': etags[f'/notes/{note_id}']})
+    assert response.status_code == 200
+    assert response.json['replies'][0]['content'] == 'Changes the note'
+
+def test_note_etag_changes_when_reply_author_renames(client, app):
+    assert login(client).status_code == 302
+    db.session.add(User(email="guest@example.com", password=generate_password_hash("guestpassword")))
+    db.session.commit()
+    note_id = client.post('/notes/add', data={'content': 'Shared note', 'color': '#ffffff'}).json['id']
+    client.post('/boards/share', data={'board_id': 1, 'email': 'guest@example.com'})
+
+    # Each request gets a fresh app context, so current_user and g are loaded as in production
+    guest = app.test_client()
+    def request(user_client, method, url, **kwargs):
+        with app.app_context():
+            return user_client.open(url, method=method, **kwargs)
+    request(guest, 'POST', '/', data={'email': 'guest@example.com', 'password': 'guestpassword', 'login': True})
+    request(guest, 'POST', '/update_preferences', json={'username': 'Guest'})
+    assert request(guest, 'POST', f'/notes/{note_id}/add_reply', json={'content': 'Reply'}).status_code == 201
+
+    response = request(client, 'GET', f'/notes/{note_id}')
+    assert response.json['replies'][0]['username'] == 'Guest'
+    etag = response.headers['ETag']
+    assert request(client, 'GET', f'/notes/{note_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    request(guest, 'POST', '/update_preferences', json={'username': 'Renamed guest'})
+    response = request(client, 'GET', f'/notes/{note_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['replies'][0]['username'] == 'Renamed guest'
+
+def test_full_text_search(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    running = client.post('/notes/add', data={'content': 'Running the budget review', 'color': '#ffffff'}).json['id']
+    budget = client.post('/notes/add', data={'content': 'Budget budget budget', 'color': '#ffffff'}).json['id']
+    deleted = client.post('/notes/add', data={'content': 'Budget draft', 'color': '#ffffff'}).json['id']
+    client.post(f'/notes/{running}/add_reply', json={'content': 'Roadmap ready'})
+    client.post(f'/notes/delete/{deleted}')
+
+    # Stemmed, prefix-matched and ranked, with replies alongside notes
+    results = client.get('/search?q=budget').json['results']
+    assert [result['note_id'] for result in results] == [budget, running]
+    assert results[0]['board_title'] == 'Default Board'
+    assert client.get('/search?q=runs review').json['results'][0]['note_id'] == running
+    assert [(result['kind'], result['note_id']) for result in client.get('/search?q=road').json['results']] == [('reply', running)]
+
+    response = client.get('/search?q=budget&limit=1')
+    assert response.json['next_offset'] == 1
+    assert client.get('/search?q=budget&limit=1&offset=1').json['results'][0]['note_id'] == running
+    assert client.get('/search?q=budget&limit=0').status_code == 400
+
+    # Batch edits bypass the ORM flush, so the route reindexes them
+    client.post('/notes/batch_update', json={'notes': [{'id': budget, 'content': 'Invoice'}]})
+    assert [result['note_id'] for result in client.get('/search?q=invoice').json['results']] == [budget]
+    assert [result['note_id'] for result in client.get('/search?q=budget').json['results']] == [running]
+
+    # Other users only search boards they've been given
+    db.session.add(User(email="guest@example.com", password=generate_password_hash("guestpassword")))
+    db.session.commit()
+    guest = app.test_client()
+    def guest_search(q):
+        with app.app_context():
+            return guest.get(f'/search?q={q}').json['results']
+    with app.app_context():
+        guest.post('/', data={'email': 'guest@example.com', 'password': 'guestpassword', 'login': True})
+    assert guest_search('invoice') == []
+    client.post('/boards/share', data={'board_id': 1, 'email': 'guest@example.com'})
+    assert [result['note_id'] for result in guest_search('invoice')] == [budget]
+
+def test_request_instrumentation(client, app, caplog):
+    login_response = login(client)
+    assert login_response.status_code == 302
+
+    timing = client.get('/boards').headers['Server-Timing']
+    assert re.search(r'db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, total;dur=[\d.]+', timing)
+
+    app.config['QUERY_BUDGET'] = 1
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger=app.logger.name):
+        response = client.get('/notes/get_by_board/1')
+    logged = [json.loads(record.getMessage()) for record in caplog.records if record.name == app.logger.name]
+    request_record = next(record for record in logged if 'status' in record)
+    assert request_record['endpoint'] == 'app.get_notes_by_board'
+    assert request_record['response_bytes'] == len(response.data)
+    assert request_record['queries'] > len(request_record['slowest']) == app.config['SLOW_STATEMENT_COUNT']
+    warning = next(record for record in logged if 'warning' in record)
+    assert (warning['queries'], warning['budget']) == (request_record['queries'], 1)
+
+def test_request_log_lines_emitted_by_default(client, app, caplog):
+    assert login(client).status_code == 302
+    # No caplog.at_level: LOG_LEVEL alone must let the INFO lines through
+    assert app.logger.getEffectiveLevel() == logging.INFO
+    client.get('/boards')
+    assert any(record.name == app.logger.name and record.levelno == logging.INFO and '"path": "/boards"' in record.getMessage()
+               for record in caplog.records)
+
+def test_failed_statements_leave_no_timing_state(app):
+    with app.test_request_context('/'):
+        start_request()
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                db.session.execute(text('SELECT * FROM missing_table'))
+            db.session.rollback()
+        db.session.execute(text('SELECT 1'))
+        # The pooled connection outlives requests, so nothing may pile up on it
+        assert not db.session.connection().info.get('statement_start')
+        assert [statement for _, statement in g.request_stats.statements] == ['SELECT 1']
+
+def test_metrics_endpoint(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    requests_before = sample('taskhub_request_duration_seconds_count', endpoint='app.list_boards', method='GET')
+    notes_before = sample('taskhub_writes_total', kind='note', operation='create')
+    updates_before = sample('taskhub_writes_total', kind='note', operation='update')
+    avatars_before = sample('taskhub_avatar_size_bytes_count')
+
+    client.get('/boards')
+    note_id = client.post('/notes/add', data={'content': 'counted', 'color': '#ffffff'}).json['id']
+    client.post('/notes/batch_update', json={'notes': [{'id': note_id, 'position_x': 5}]})
+    buffer = BytesIO()
+    Image.new('RGB', (200, 200), '#7785cc').save(buffer, 'PNG')
+    client.post('/update_preferences', json={'profile_picture': 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()})
+    avatar = client.get(UserPreferences.query.filter_by(user_id=1).first().profile_thumbnail)
+
+    assert sample('taskhub_request_duration_seconds_count', endpoint='app.list_boards', method='GET') == requests_before + 1
+    assert sample('taskhub_writes_total', kind='note', operation='create') == notes_before + 1
+    assert sample('taskhub_writes_total', kind='note', operation='update') == updates_before + 1
+    assert sample('taskhub_avatar_size_bytes_count') == avatars_before + 1
+    assert sample('taskhub_avatar_size_bytes_sum') >= len(avatar.data)
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.data.decode()
+    assert 'taskhub_request_duration_seconds_bucket{endpoint="app.list_boards"' in body
+    assert 'taskhub_db_connections_in_use' in body
+
+    app.config['METRICS_TOKEN'] = 'scraper'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scraper'}).status_code == 200
+
+def test_admin_exports(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    assert client.get('/admin/export/notes').status_code == 403
+
+    app.config['ADMIN_EMAILS'] = ['user@example.com']
+    note_ids = [client.post('/notes/add', data={'content': f'note, {i}', 'color': '#ffffff'}).json['id'] for i in range(3)]
+    db.session.add(User(email="guest@example.com", password="x"))
+    db.session.commit()
+    client.post('/boards/share', data={'board_id': 1, 'email': 'guest@example.com'})
+
+    response = client.get('/admin/export/notes')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    notes = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [note['id'] for note in notes] == note_ids
+    assert notes[0]['content'] == 'note, 0'
+
+    # Keyset pages continue after the last id seen
+    page = client.get(f'/admin/export/notes?after={note_ids[0]}&limit=1').data.decode().splitlines()
+    assert [json.loads(line)['id'] for line in page] == [note_ids[1]]
+
+    rows = client.get('/admin/export/notes?format=csv').data.decode().splitlines()
+    assert rows[0] == 'id,board_id,user_id,content,color,created_at,updated_at'
+    assert rows[1].startswith(f'{note_ids[0]},1,1,"note, 0"')
+    assert client.get('/admin/export/boards?format=csv&after=99').data.decode().splitlines() == ['id,title,owner_id,note_count,updated_at']
+
+    users = [json.loads(line) for line in client.get('/admin/export/user_boards').data.decode().splitlines()]
+    assert [(user['username'], [board['board_id'] for board in user['boards']]) for user in users] == [
+        ('user@example.com', []), ('guest@example.com', [1])]
+    assert client.get('/admin/export/user_boards?format=csv').data.decode().splitlines()[1:] == [
+        '1,user@example.com,,', '2,guest@example.com,1,Default Board']
+
+    assert client.get('/admin/export/users').status_code == 404
+    assert client.get('/admin/export/notes?format=xml').status_code == 400
+
+    # Scripts authenticate with the admin secret instead of a session
+    app.config['ADMIN_SECRET'] = 'export-secret'
+    anonymous = app.test_client()
+    with app.app_context():
+        assert anonymous.get('/admin/export/boards').status_code == 401
+    with app.app_context():
+        assert anonymous.get('/admin/export/boards', headers={'Authorization': 'Bearer export-secret'}).status_code == 200
+
+def test_board_export_and_import(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    first = client.post('/notes/add', data={'content': 'Exported plan', 'color': '#7785cc'}).json['id']
+    client.post(f'/notes/update/{first}', json={'position_x': 5000, 'position_y': 5000, 'width': 250, 'height': 200})
+    second = client.post('/notes/add', data={'content': 'Second note', 'color': '#ffffff'}).json['id']
+    client.post(f'/notes/{first}/add_reply', json={'content': 'First reply'})
+    client.post(f'/notes/{first}/add_reply', json={'content': 'Second reply'})
+
+    response = client.get('/boards/1/export')
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [(record['type'], record.get('content')) for record in records] == [
+        ('board', None), ('note', 'Exported plan'), ('note', 'Second note'), ('reply', 'First reply'), ('reply', 'Second reply')]
+
+    board_id = client.post('/create_board', data={'title': 'Copy'}).json['board_id']
+    version = client.get(f'/notes/get_by_board/{board_id}?since=0').json['version']
+    response = client.post(f'/boards/{board_id}/import', data=response.data, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert (response.json['notes'], response.json['replies']) == (2, 2)
+
+    # Bulk inserted, but versioned, counted, tiled and searchable like notes added one at a time
+    synced = client.get(f'/notes/get_by_board/{board_id}?since={version}').json['notes']
+    assert sorted(note['content'] for note in synced) == ['Exported plan', 'Second note']
+    copy = next(note for note in synced if note['content'] == 'Exported plan')
+    assert (copy['position_x'], copy['color']) == (5000, '#7785cc')
+    assert [note['content'] for note in client.get(f'/boards/{board_id}/notes/window?x0=4800&y0=4800&x1=6000&y1=6000').json['notes']] == ['Exported plan']
+    assert [reply['content'] for reply in client.get(f'/notes/{copy["id"]}').json['replies']] == ['First reply', 'Second reply']
+    assert next(board for board in client.get('/boards').json if board['id'] == board_id)['note_count'] == 2
+    assert {result['board_id'] for result in client.get('/search?q=reply').json['results']} == {1, board_id}
+
+    # A bad line rejects the whole file
+    upload = b'{"type": "note", "id": 1, "content": "kept?"}\n{"type": "reply", "note_id": 7, "content": "orphan"}\n'
+    response = client.post(f'/boards/{board_id}/import', data={'file': (BytesIO(upload), 'board.ndjson')})
+    assert response.status_code == 400
+    assert response.json['error'].startswith('Line 2:')
+    assert not client.get('/search?q=kept').json['results']
+
+    # Geometry is bounded as in batch updates, so one line can't ask for millions of tiles
+    tiles = db.session.query(NoteTile).filter_by(board_id=board_id).count()
+    for geometry in ({'width': 200000}, {'height': -1}, {'position_x': 10 ** 19}):
+        upload = json.dumps({'type': 'note', 'content': 'huge', **geometry}).encode()
+        response = client.post(f'/boards/{board_id}/import', data=upload, content_type='application/x-ndjson')
+        assert response.status_code == 400
+        assert response.json['error'].startswith(f'Line 1: {next(iter(geometry))} must be an integer')
+    assert db.session.query(NoteTile).filter_by(board_id=board_id).count() == tiles
+
+def test_board_clone_and_templates(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    first = client.post('/notes/add', data={'content': 'Standup layout', 'color': '#7785cc'}).json['id']
+    client.post(f'/notes/update/{first}', json={'position_x': 5000, 'position_y': 5000, 'width': 250, 'height': 200})
+    client.post('/notes/add', data={'content': 'Retro column', 'color': '#ffffff'})
+    client.post(f'/notes/{first}/add_reply', json={'content': 'Copied thread'})
+
+    response = client.post('/boards/1/clone', json={'template': True, 'title': 'Sprint template'})
+    assert response.status_code == 201
+    assert (response.json['notes'], response.json['replies'], response.json['template']) == (2, 0, True)
+    template_id = response.json['board_id']
+    assert [board['id'] for board in client.get('/templates').json] == [template_id]
+    assert template_id not in [board['id'] for board in client.get('/boards').json]
+
+    # Starting a board from the template copies it the same way
+    response = client.post(f'/boards/{template_id}/clone', json={'title': 'Sprint 1'})
+    assert response.status_code == 201
+    board_id = response.json['board_id']
+    board = next(board for board in client.get('/boards').json if board['id'] == board_id)
+    assert (board['title'], board['note_count']) == ('Sprint 1', 2)
+    notes = client.get(f'/notes/get_by_board/{board_id}?since=0').json['notes']
+    assert sorted((note['content'], note['color']) for note in notes) == [('Retro column', '#ffffff'), ('Standup layout', '#7785cc')]
+    assert [note['content'] for note in client.get(f'/boards/{board_id}/notes/window?x0=4800&y0=4800&x1=6000&y1=6000').json['notes']] == ['Standup layout']
+    assert {result['board_id'] for result in client.get('/search?q=retro').json['results']} == {1, template_id, board_id}
+
+    # Replies are only copied when asked for
+    response = client.post('/boards/1/clone', json={'replies': True})
+    assert (response.json['title'], response.json['replies']) == ('Copy of Default Board', 1)
+    copy = next(note for note in client.get(f'/notes/get_by_board/{response.json["board_id"]}?since=0').json['notes']
+                if note['content'] == 'Standup layout')
+    assert [reply['content'] for reply in client.get(f'/notes/{copy["id"]}').json['replies']] == ['Copied thread']
+
+    assert client.post('/boards/1/clone', json={'title': 'x' * 101}).status_code == 400
+    assert client.post('/boards/999/clone', json={}).status_code == 404
+
+def test_password_hashing_service(client, app):
+    # A new hash method is adopted at each user's next login
+    app.extensions['password_hasher'] = PasswordHasher(dict(app.config, PASSWORD_HASH_METHOD='pbkdf2:sha256:1000'))
+    assert login(client).status_code == 302
+    assert User.query.filter_by(email='user@example.com').one().password.startswith('pbkdf2:sha256:1000$')
+    client.get('/logout')
+
+    # The email is looked up once, by the form, and reused by the view
+    with app.app_context(), count_queries() as statements:
+        response = client.post('/', data={'email': 'user@example.com', 'password': 'x', 'confirm_password': 'x', 'register': True})
+    assert b'Email already registered' in response.data
+    assert len([statement for statement in statements if 'FROM user ' in statement]) == 1
+
+    # Sign-ins beyond the pool and its queue are turned away rather than queued indefinitely
+    hasher = PasswordHasher(dict(app.config, PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0))
+    app.extensions['password_hasher'] = hasher
+    hasher.slots.acquire()
+    with app.app_context():
+        response = login(client)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    hasher.slots.release()
+    with app.app_context():
+        assert login(client).status_code == 302
+
+    # An unknown email costs one check, as a wrong password does, and never a hash as well
+    def operations(operation):
+        return REGISTRY.get_sample_value('taskhub_password_hash_seconds_count', {'operation': operation}) or 0
+    before = operations('hash'), operations('check')
+    with app.app_context():
+        client.get('/logout')
+    with app.app_context():
+        client.post('/', data={'email': 'nobody@example.com', 'password': 'x', 'login': True})
+    assert (operations('hash'), operations('check')) == (before[0], before[1] + 1)
+
+def test_cached_identity(client, app):
+    login_response = login(client)
+    assert login_response.status_code == 302
+    # A fresh app context per request, so current_user is loaded each time as in production
+    def get(url, **kwargs):
+        with app.app_context():
+            return client.get(url, **kwargs)
+    etag = get('/get_preferences').headers['ETag']
+    get('/boards')
+
+    # The hot path loads the user, their permissions and preferences without a query
+    with count_queries() as statements:
+        assert get('/get_preferences', headers={'If-None-Match': etag}).status_code == 304
+        assert get('/boards').status_code == 200
+    assert statements == []
+
+    # A change retires the identity; one query then reloads it with preferences and boards
+    with app.app_context():
+        assert client.post('/update_preferences', json={'username': 'Renamed'}).json['success']
+    with count_queries() as statements:
+        response = get('/get_preferences')
+        assert get('/boards/details/1').status_code == 200
+    assert response.json['username'] == 'Renamed'
+    assert len([statement for statement in statements if 'FROM user ' in statement]) == 1
+    # The identity query is the only one to read the user, their preferences or their access
+    assert len([statement for statement in statements if 'user_preferences' in statement or 'access.user_id' in statement]) == 1
+
+def test_schema_revision_check(app, caplog):
+    heads = head_revisions()
+    assert len(heads) == 1
+    # Tables made by create_all have no revision; that is logged, not raised
+    assert not check_revision()
+    assert "flask db upgrade" in caplog.text
+    db.session.rollback()
+
+    db.session.execute(text('CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)'))
+    db.session.execute(text('INSERT INTO alembic_version VALUES (:head)'), {'head': next(iter(heads))})
+    assert check_revision()
+
+def test_note_delete_with_foreign_keys(client, app):
+    assert login(client).status_code == 302
+    db.session.execute(text('PRAGMA foreign_keys=ON'))
+    assert db.session.execute(text('PRAGMA foreign_keys')).scalar() == 1
+    note_id = client.post('/notes/add', data={'content': 'Tiled', 'color': '#ffffff'}).json['id']
+    assert db.session.execute(text('SELECT count(*) FROM note_tile WHERE note_id = :id'), {'id': note_id}).scalar() > 0
+
+    # Tiles reference the note, so they must go first
+    client.post(f'/notes/delete/{note_id}')
+    assert db.session.get(Note, note_id) is None
+    assert db.session.execute(text('SELECT count(*) FROM note_tile WHERE note_id = :id'), {'id': note_id}).scalar() == 0
+
 # SELENIUM
 driver = webdriver.Chrome()
 